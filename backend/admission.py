@@ -0,0 +1,239 @@
+"""Priority-aware admission control and load shedding
+
+Every request is put in a traffic class, highest priority first:
+signaling > chat > writes > listings > uploads. HTTP requests in a class
+run at most `limit` at a time; the rest wait in a bounded queue for at most
+`deadline` seconds. A request that finds the queue full, outlives its
+deadline or arrives while the event loop lags more than the class tolerates
+is refused at once with 503 and Retry-After, before its body is read, so an
+overloaded worker spends its time on the traffic that matters most.
+
+WebSockets hold no slot (they live for minutes); signaling sockets are never
+refused and chat sockets are refused (close code 1013) only on loop lag.
+Probes, /metrics, /admin and /debug bypass admission entirely.
+"""
+import asyncio
+import json
+import math
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from metrics import registry, loop_lag_current
+
+# Per class: (max concurrent HTTP requests, max queued requests, seconds a request
+# may wait for a slot, event-loop lag in seconds above which new requests are shed).
+# A limit or lag of 0 means unbounded / never shed.
+CLASS_LIMITS = {
+    "signaling": (0, 0, 0.0, 0.0),
+    "chat": (64, 256, 1.0, 1.0),
+    "writes": (32, 128, 0.5, 0.5),
+    "listings": (32, 64, 0.25, 0.25),
+    "uploads": (4, 8, 0.25, 0.1),
+}
+
+# Paths never subject to admission: probes, metrics and operator endpoints
+EXEMPT_PATHS = re.compile(r"^/(health|ready|metrics|heartbeat|admin|debug)(/|$)")
+
+# Live chat posts; other POST/PUT/DELETE requests are "writes"
+CHAT_POST = re.compile(r"^/rooms/[^/]+/chat/[^/]+$")
+
+# Close code for refused WebSockets ("Try Again Later")
+OVERLOADED_CODE = 1013
+
+admitted_total = registry.counter(
+    "publicpooper_admission_admitted_total", "Requests admitted by traffic class", ["class"])
+rejected_total = registry.counter(
+    "publicpooper_admission_rejected_total", "Requests shed by traffic class and reason", ["class", "reason"])
+queue_wait_seconds = registry.histogram(
+    "publicpooper_admission_queue_wait_seconds", "Time admitted requests waited for a slot", ["class"])
+
+
+def loop_lag() -> float:
+    """Latest event-loop lag sample (metrics.monitor_loop_lag)"""
+    return loop_lag_current.children[()].value
+
+
+class TrafficClass:
+    """Concurrency slots and a FIFO of waiters for one class"""
+
+    def __init__(self, name: str, priority: int, limit: int, queue_limit: int,
+                 deadline: float, shed_lag: float):
+        self.name = name
+        self.priority = priority
+        self.configure(limit, queue_limit, deadline, shed_lag)
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "deadline": 0, "overload": 0}
+
+    def configure(self, limit: int, queue_limit: int, deadline: float, shed_lag: float):
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.deadline = deadline
+        self.shed_lag = shed_lag
+
+    def overloaded(self) -> bool:
+        return self.shed_lag > 0 and loop_lag() > self.shed_lag
+
+    def shed(self) -> Optional[str]:
+        """Reason to refuse a request before it queues, if any"""
+        if self.overloaded():
+            return "overload"
+        if self.limit and self.in_flight >= self.limit and len(self.waiters) >= self.queue_limit:
+            return "queue_full"
+        return None
+
+    async def acquire(self) -> Optional[str]:
+        """Take a slot, waiting up to deadline; returns the rejection reason instead if refused"""
+        reason = self.shed()
+        if reason is None and self.limit and self.in_flight >= self.limit:
+            started = time.perf_counter()
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, self.deadline)
+            except asyncio.TimeoutError:
+                # A slot may have been handed over just as the deadline passed
+                if waiter.cancelled():
+                    reason = "deadline"
+            except BaseException:
+                self._give_up(waiter)
+                raise
+            if reason is None:
+                # release() handed its slot over; in_flight already counts this request
+                queue_wait_seconds.labels(self.name).observe(time.perf_counter() - started)
+            else:
+                self._give_up(waiter)
+        elif reason is None:
+            self.in_flight += 1
+            queue_wait_seconds.labels(self.name).observe(0.0)
+        if reason is not None:
+            self.reject(reason)
+            return reason
+        self.admitted += 1
+        admitted_total.labels(self.name).inc()
+        return None
+
+    def release(self):
+        """Free a slot, handing it straight to the oldest waiter still waiting"""
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _give_up(self, waiter: asyncio.Future):
+        """Leave the queue; a slot handed over in the meantime is passed on"""
+        if waiter.done() and not waiter.cancelled():
+            self.release()
+            return
+        waiter.cancel()
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def reject(self, reason: str):
+        self.rejected[reason] += 1
+        rejected_total.labels(self.name, reason).inc()
+
+    def retry_after(self) -> float:
+        return max(self.deadline, loop_lag())
+
+    def stats(self) -> dict:
+        return {
+            "priority": self.priority,
+            "limit": self.limit,
+            "queue_limit": self.queue_limit,
+            "deadline": self.deadline,
+            "shed_lag": self.shed_lag,
+            "in_flight": self.in_flight,
+            "queued": len(self.waiters),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected)
+        }
+
+
+classes: Dict[str, TrafficClass] = {
+    name: TrafficClass(name, priority, *limits)
+    for priority, (name, limits) in enumerate(CLASS_LIMITS.items())
+}
+
+registry.callback(
+    "publicpooper_admission_in_flight", "HTTP requests holding a slot by traffic class", "gauge",
+    lambda: [((name,), traffic.in_flight) for name, traffic in classes.items()],
+    ["class"])
+registry.callback(
+    "publicpooper_admission_queued", "HTTP requests waiting for a slot by traffic class", "gauge",
+    lambda: [((name,), len(traffic.waiters)) for name, traffic in classes.items()],
+    ["class"])
+
+
+def classify(scope) -> Optional[TrafficClass]:
+    """Traffic class of an ASGI scope; None for exempt paths"""
+    path = scope["path"]
+    if EXEMPT_PATHS.match(path):
+        return None
+    if scope["type"] == "websocket":
+        return classes["signaling"] if path.startswith("/signal/") else classes["chat"]
+    method = scope["method"]
+    if method in ("GET", "HEAD", "OPTIONS"):
+        return classes["listings"]
+    if path.startswith("/emojis/upload/"):
+        return classes["uploads"]
+    if method == "POST" and CHAT_POST.match(path):
+        return classes["chat"]
+    return classes["writes"]
+
+
+def stats() -> dict:
+    return {name: traffic.stats() for name, traffic in classes.items()}
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the traffic classes above"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        traffic = classify(scope) if scope["type"] in ("http", "websocket") else None
+        if traffic is None:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["type"] == "websocket":
+            if traffic.overloaded():
+                traffic.reject("overload")
+                await send({"type": "websocket.close", "code": OVERLOADED_CODE})
+                return
+            traffic.admitted += 1
+            admitted_total.labels(traffic.name).inc()
+            await self.app(scope, receive, send)
+            return
+
+        reason = await traffic.acquire()
+        if reason is not None:
+            await self._reject(send, traffic, reason)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            traffic.release()
+
+    @staticmethod
+    async def _reject(send, traffic: TrafficClass, reason: str):
+        body = json.dumps({"detail": f"Server overloaded ({traffic.name}: {reason})"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(traffic.retry_after()))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
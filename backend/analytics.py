@@ -0,0 +1,378 @@
+"""Hourly analytics rollups of chat volume, betting and room sessions
+
+Writes are counted in memory as they happen (record_*) and added to the
+rollup tables in one small transaction every ROLLUP_FLUSH_INTERVAL
+seconds, so the hot write paths gain a dict update rather than a second
+write. Dashboards query the rollup tables only. Rows written before
+rollups existed are folded in once by a background backfill.
+"""
+import asyncio
+import sqlite3
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Seconds between flushes of in-memory counts to the rollup tables
+ROLLUP_FLUSH_INTERVAL = 5.0
+# Rows returned by a series or top-rooms query at most
+MAX_ROLLUP_ROWS = 5000
+
+GRANULARITIES = {
+    # Bucket expression per granularity; buckets are 'YYYY-MM-DDTHH:00' hours
+    "hour": "bucket",
+    "day": "substr(bucket, 1, 10)",
+}
+
+ROLLUP_TABLES = ("ChatRollup", "BetRollup", "SessionRollup")
+
+
+def hour_bucket(timestamp: str) -> str:
+    """Rollup bucket of an ISO timestamp: its hour, 'YYYY-MM-DDTHH:00'"""
+    return timestamp[:13].replace(" ", "T") + ":00"
+
+
+class RollupWriter:
+    """In-memory rollup deltas, flushed to the rollup tables in batches
+
+    connect opens the primary database (where the rollups live);
+    connect_sources opens every database holding Chat/Bet rows (one per
+    shard when sharded) for the backfill, which is the only reader of the
+    raw tables. A crash loses at most the last flush interval of counts.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection],
+                 connect_sources: Callable[[], List[sqlite3.Connection]],
+                 interval: float = ROLLUP_FLUSH_INTERVAL):
+        self.connect = connect
+        self.connect_sources = connect_sources
+        self.interval = interval
+        # Deltas not yet written: {(bucket, rid): [messages, directed]}
+        self.chat: Dict[Tuple[str, str], List] = {}
+        # {(bucket, rid): [bets, total, maxBet]}
+        self.bets: Dict[Tuple[str, str], List] = {}
+        # {(bucket, rid): [sessions, totalDuration, maxDuration]}
+        self.sessions: Dict[Tuple[str, str], List] = {}
+        # Rows created before this are counted by the backfill, later ones by record_*
+        self.started_at = datetime.now().isoformat()
+        self.flushes = 0
+        self.rows_written = 0
+        self.last_flush: Optional[str] = None
+        self.max_flush_ms = 0.0
+        self.backfill_done = False
+        self._flushing = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def record_chat(self, rid: str, create_at: str, directed: bool = False):
+        entry = self.chat.get((hour_bucket(create_at), rid))
+        if entry is None:
+            entry = self.chat[(hour_bucket(create_at), rid)] = [0, 0]
+        entry[0] += 1
+        if directed:
+            entry[1] += 1
+
+    def record_bet(self, rid: str, create_at: str, amount: float):
+        entry = self.bets.get((hour_bucket(create_at), rid))
+        if entry is None:
+            entry = self.bets[(hour_bucket(create_at), rid)] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += amount
+        entry[2] = max(entry[2], amount)
+
+    def record_session(self, rid: str, leave_at: str, duration: float):
+        """A finished RoomUser session, bucketed by when it ended"""
+        entry = self.sessions.get((hour_bucket(leave_at), rid))
+        if entry is None:
+            entry = self.sessions[(hour_bucket(leave_at), rid)] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += duration
+        entry[2] = max(entry[2], duration)
+
+    @staticmethod
+    def _write(conn: sqlite3.Connection, chat: dict, bets: dict, sessions: dict) -> int:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO ChatRollup (bucket, rid, messages, directed) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (bucket, rid) DO UPDATE SET messages = messages + excluded.messages, "
+            "directed = directed + excluded.directed",
+            [(bucket, rid, messages, directed) for (bucket, rid), (messages, directed) in chat.items()]
+        )
+        cursor.executemany(
+            "INSERT INTO BetRollup (bucket, rid, bets, total, maxBet) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (bucket, rid) DO UPDATE SET bets = bets + excluded.bets, "
+            "total = total + excluded.total, maxBet = MAX(maxBet, excluded.maxBet)",
+            [(bucket, rid, count, total, max_bet) for (bucket, rid), (count, total, max_bet) in bets.items()]
+        )
+        # The room type is copied in so by-type queries need no join
+        cursor.executemany(
+            "INSERT INTO SessionRollup (bucket, rid, roomType, sessions, totalDuration, maxDuration) "
+            "VALUES (?, ?, (SELECT type FROM Room WHERE rid = ?), ?, ?, ?) "
+            "ON CONFLICT (bucket, rid) DO UPDATE SET sessions = sessions + excluded.sessions, "
+            "totalDuration = totalDuration + excluded.totalDuration, "
+            "maxDuration = MAX(maxDuration, excluded.maxDuration)",
+            [(bucket, rid, rid, count, total, longest)
+             for (bucket, rid), (count, total, longest) in sessions.items()]
+        )
+        return len(chat) + len(bets) + len(sessions)
+
+    def _flush_rows(self, chat: dict, bets: dict, sessions: dict) -> int:
+        conn = self.connect()
+        try:
+            started = time.perf_counter()
+            written = self._write(conn, chat, bets, sessions)
+            conn.commit()
+            self.max_flush_ms = max(self.max_flush_ms, (time.perf_counter() - started) * 1000.0)
+            return written
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _merge(into: dict, deltas: dict, maximum_at: int):
+        """Put deltas that failed to flush back in front of newer ones"""
+        for key, values in deltas.items():
+            entry = into.get(key)
+            if entry is None:
+                into[key] = values
+                continue
+            for i, value in enumerate(values):
+                entry[i] = max(entry[i], value) if i == maximum_at else entry[i] + value
+
+    async def flush(self) -> int:
+        """Write pending deltas; returns rollup rows touched"""
+        async with self._flushing:
+            chat, bets, sessions = self.chat, self.bets, self.sessions
+            if not (chat or bets or sessions):
+                return 0
+            self.chat, self.bets, self.sessions = {}, {}, {}
+            try:
+                written = await asyncio.to_thread(self._flush_rows, chat, bets, sessions)
+            except Exception:
+                self._merge(self.chat, chat, -1)
+                self._merge(self.bets, bets, 2)
+                self._merge(self.sessions, sessions, 2)
+                raise
+            self.flushes += 1
+            self.rows_written += written
+            self.last_flush = datetime.now().isoformat()
+            return written
+
+    def _backfill(self) -> bool:
+        """Fold rows created before started_at into the rollups, once per database"""
+        conn = self.connect()
+        try:
+            if conn.execute("SELECT 1 FROM RollupBackfill WHERE id = 1").fetchone():
+                return False
+            chat: dict = {}
+            bets: dict = {}
+            sessions: dict = {}
+            # Read-only GROUP BYs; they scan the raw tables once, with no write lock held
+            for source in self.connect_sources():
+                try:
+                    for bucket, rid, messages, directed in source.execute(
+                            "SELECT substr(createAt, 1, 13), rid, COUNT(*), COUNT(NULLIF(targetUid, '')) FROM Chat "
+                            "WHERE createAt < ? GROUP BY 1, 2", (self.started_at,)):
+                        chat[(hour_bucket(bucket), rid)] = [messages, directed]
+                    for bucket, rid, count, total, max_bet in source.execute(
+                            "SELECT substr(createAt, 1, 13), rid, COUNT(*), TOTAL(bet), MAX(bet) FROM Bet "
+                            "WHERE createAt < ? GROUP BY 1, 2", (self.started_at,)):
+                        bets[(hour_bucket(bucket), rid)] = [count, total, max_bet or 0.0]
+                finally:
+                    source.close()
+            for bucket, rid, count, total, longest in conn.execute(
+                    "SELECT substr(leaveAt, 1, 13), rid, COUNT(*), TOTAL(duration), MAX(duration) FROM RoomUser "
+                    "WHERE leaveAt IS NOT NULL AND leaveAt < ? GROUP BY 1, 2", (self.started_at,)):
+                sessions[(hour_bucket(bucket), rid)] = [count, total, longest or 0.0]
+            self._write(conn, chat, bets, sessions)
+            cursor = conn.execute("INSERT OR IGNORE INTO RollupBackfill (id, completedAt) VALUES (1, ?)",
+                                  (datetime.now().isoformat(),))
+            if cursor.rowcount == 0:
+                # Another worker backfilled while this one was counting
+                conn.rollback()
+                return False
+            conn.commit()
+            print(f"[analytics] Backfilled rollups: {len(chat)} chat, {len(bets)} bet, {len(sessions)} session buckets")
+            return True
+        finally:
+            conn.close()
+
+    async def run(self):
+        try:
+            await asyncio.to_thread(self._backfill)
+            self.backfill_done = True
+        except Exception as e:
+            print(f"[analytics] Rollup backfill failed: {e}")
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[analytics] Rollup flush failed, retrying next interval: {e}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"[analytics] Final rollup flush failed: {e}")
+
+    def _clear(self):
+        conn = self.connect()
+        try:
+            for table in ROLLUP_TABLES:
+                conn.execute(f"DELETE FROM {table}")
+            conn.execute("DELETE FROM RollupBackfill")
+            conn.commit()
+        finally:
+            conn.close()
+
+    async def rebuild(self) -> bool:
+        """Drop the rollups and recount them from the raw tables (admin use; scans Chat, Bet and RoomUser)"""
+        async with self._flushing:
+            # Everything pending is older than the new cutoff, so the backfill counts it
+            self.chat, self.bets, self.sessions = {}, {}, {}
+            self.started_at = datetime.now().isoformat()
+            self.backfill_done = False
+            await asyncio.to_thread(self._clear)
+            done = await asyncio.to_thread(self._backfill)
+            self.backfill_done = True
+            return done
+
+    def stats(self) -> dict:
+        return {
+            "interval": self.interval,
+            "pending": {"chat": len(self.chat), "bets": len(self.bets), "sessions": len(self.sessions)},
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "last_flush": self.last_flush,
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "backfill_done": self.backfill_done
+        }
+
+
+def _filters(rid: Optional[str], since: Optional[str], until: Optional[str],
+             room_type: Optional[str] = None) -> Tuple[str, list]:
+    """WHERE clause over bucket/rid; since is truncated to its hour, until is exclusive"""
+    conditions = []
+    params: list = []
+    if rid is not None:
+        conditions.append("rid = ?")
+        params.append(rid)
+    if room_type is not None:
+        conditions.append("roomType = ?")
+        params.append(room_type)
+    if since is not None:
+        conditions.append("bucket >= ?")
+        params.append(since[:13].replace(" ", "T"))
+    if until is not None:
+        conditions.append("bucket < ?")
+        params.append(until.replace(" ", "T"))
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+
+def _bucket_expression(granularity: str) -> str:
+    try:
+        return GRANULARITIES[granularity]
+    except KeyError:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+
+
+def chat_series(conn: sqlite3.Connection, rid: Optional[str] = None, since: Optional[str] = None,
+                until: Optional[str] = None, granularity: str = "hour") -> List[dict]:
+    """Messages (and directed messages) per bucket, for one room or all"""
+    expression = _bucket_expression(granularity)
+    where, params = _filters(rid, since, until)
+    rows = conn.execute(
+        f"SELECT {expression} AS period, SUM(messages) AS messages, SUM(directed) AS directed "
+        f"FROM ChatRollup {where} GROUP BY period ORDER BY period LIMIT ?",
+        params + [MAX_ROLLUP_ROWS]
+    ).fetchall()
+    return [{"bucket": row["period"], "messages": row["messages"], "directed": row["directed"]} for row in rows]
+
+
+def bet_series(conn: sqlite3.Connection, rid: Optional[str] = None, since: Optional[str] = None,
+               until: Optional[str] = None, granularity: str = "hour") -> List[dict]:
+    """Bet count, volume, average and largest bet per bucket"""
+    expression = _bucket_expression(granularity)
+    where, params = _filters(rid, since, until)
+    rows = conn.execute(
+        f"SELECT {expression} AS period, SUM(bets) AS bets, TOTAL(total) AS total, MAX(maxBet) AS maxBet "
+        f"FROM BetRollup {where} GROUP BY period ORDER BY period LIMIT ?",
+        params + [MAX_ROLLUP_ROWS]
+    ).fetchall()
+    return [{
+        "bucket": row["period"],
+        "bets": row["bets"],
+        "total": row["total"],
+        "average": row["total"] / row["bets"] if row["bets"] else 0.0,
+        "max": row["maxBet"]
+    } for row in rows]
+
+
+def session_series(conn: sqlite3.Connection, rid: Optional[str] = None, room_type: Optional[str] = None,
+                   since: Optional[str] = None, until: Optional[str] = None,
+                   granularity: str = "hour") -> List[dict]:
+    """Finished sessions, total and average duration per bucket"""
+    expression = _bucket_expression(granularity)
+    where, params = _filters(rid, since, until, room_type)
+    rows = conn.execute(
+        f"SELECT {expression} AS period, SUM(sessions) AS sessions, TOTAL(totalDuration) AS totalDuration, "
+        f"MAX(maxDuration) AS maxDuration FROM SessionRollup {where} GROUP BY period ORDER BY period LIMIT ?",
+        params + [MAX_ROLLUP_ROWS]
+    ).fetchall()
+    return [{
+        "bucket": row["period"],
+        "sessions": row["sessions"],
+        "totalDuration": row["totalDuration"],
+        "averageDuration": row["totalDuration"] / row["sessions"] if row["sessions"] else 0.0,
+        "maxDuration": row["maxDuration"]
+    } for row in rows]
+
+
+def sessions_by_room_type(conn: sqlite3.Connection, since: Optional[str] = None,
+                          until: Optional[str] = None) -> List[dict]:
+    """Session count and average duration per room type"""
+    where, params = _filters(None, since, until)
+    rows = conn.execute(
+        f"SELECT roomType, SUM(sessions) AS sessions, TOTAL(totalDuration) AS totalDuration "
+        f"FROM SessionRollup {where} GROUP BY roomType ORDER BY roomType",
+        params
+    ).fetchall()
+    return [{
+        "roomType": row["roomType"],
+        "sessions": row["sessions"],
+        "totalDuration": row["totalDuration"],
+        "averageDuration": row["totalDuration"] / row["sessions"] if row["sessions"] else 0.0
+    } for row in rows]
+
+
+# metric -> (table, aggregate expression)
+TOP_ROOM_METRICS = {
+    "messages": ("ChatRollup", "SUM(messages)"),
+    "bets": ("BetRollup", "SUM(bets)"),
+    "volume": ("BetRollup", "TOTAL(total)"),
+    "sessions": ("SessionRollup", "SUM(sessions)"),
+    "duration": ("SessionRollup", "TOTAL(totalDuration)"),
+}
+
+
+def top_rooms(conn: sqlite3.Connection, metric: str = "messages", since: Optional[str] = None,
+              until: Optional[str] = None, limit: int = 10) -> List[dict]:
+    """Rooms ranked by one rollup metric over a time range"""
+    if metric not in TOP_ROOM_METRICS:
+        raise ValueError(f"metric must be one of {', '.join(TOP_ROOM_METRICS)}")
+    table, aggregate = TOP_ROOM_METRICS[metric]
+    where, params = _filters(None, since, until)
+    rows = conn.execute(
+        f"SELECT rid, {aggregate} AS value FROM {table} {where} GROUP BY rid ORDER BY value DESC LIMIT ?",
+        params + [max(1, min(limit, MAX_ROLLUP_ROWS))]
+    ).fetchall()
+    return [{"rid": row["rid"], metric: row["value"]} for row in rows]
@@ -1,24 +1,54 @@
+# Imported first so startup.PROCESS_STARTED marks the start of the worker's startup
+from startup import StartupTracker, LazyModule, LazyTemplates
 from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, WebSocket, WebSocketDisconnect, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, HTMLResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List, Dict, Set
 import sqlite3
 import uuid
 from datetime import datetime
 import os
+import sys
 import shutil
 import re
-import json
 import asyncio
-from PIL import Image
 import io
-from db import init_database
+import time
+from db import init_database, connect as connect_db
+import metrics
+import ratelimit
+import admission
+from metadata_cache import MetadataCache
+from emoji_index import EmojiPrefixIndex, EMOJI_SEARCH_LIMIT, EMOJI_SEARCH_MAX_LIMIT
+from profiler import LoopProfiler
+import protocol
+from signaling import CandidateCoalescer
+from multiplex import SignalingMultiplexer, StreamChannel, MAX_MULTIPLEXED_STREAMS
+from heartbeat import HeartbeatScheduler
+from replay import ReplayBuffer
+from connections import ChatConnection, ConnectionRegistry
+import chat_search
+import archive
+from archive import ChatArchiver
+import analytics
+from analytics import RollupWriter
+from backup import BackupScheduler
+from shards import ShardRouter
+from assets import AssetCache, IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL
+import recordings
+from recordings import RecordingIndexer, RangeFileResponse
+from lifecycle import RoomLifecycleScheduler, close_rooms, ROOM_CLOSED_CODE
+from bets import BetAggregator, PotUpdatePusher, BetValidationCache, IdempotencyCache, next_bet_timestamp
 
 app = FastAPI(title="PublicPooper API", version="1.0.0")
 streams = {}
+# Admission control by traffic class (innermost, so throttled requests never take a slot)
+app.add_middleware(admission.AdmissionMiddleware)
+# Ingress rate limits (inside CORS, so 429s and 503s still get CORS headers); room
+# budgets are only charged for senders in the metadata cache
+app.add_middleware(ratelimit.RateLimitMiddleware, known_user=lambda uid: metadata.has_user(uid))
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -27,10 +57,13 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Database configuration
 DATABASE_PATH = "publicpooper.db"
 EMOJI_UPLOAD_DIR = "emojis"
+# Chat with a targetUid goes only to the sender and the target (False: to the whole room, clients filter)
+DIRECTED_CHAT_DELIVERY = True
 
 # Create emoji directory if it doesn't exist
 os.makedirs(EMOJI_UPLOAD_DIR, exist_ok=True)
@@ -38,45 +71,79 @@ os.makedirs(EMOJI_UPLOAD_DIR, exist_ok=True)
 # Create templates directory if it doesn't exist
 os.makedirs("templates", exist_ok=True)
 
-# Mount static files for emoji serving
-app.mount("/emojis", StaticFiles(directory=EMOJI_UPLOAD_DIR), name="emojis")
+# Setup Jinja2 templates (built on first render)
+templates = LazyTemplates("templates")
+
+# Signaling script and viewer pages, rendered once per parameter set and precompressed
+asset_cache = AssetCache(templates)
+
+# PIL is only needed to process emoji uploads; imported on the first one
+Image = LazyModule("PIL.Image")
 
-# Setup Jinja2 templates
-templates = Jinja2Templates(directory="templates")
+# Startup phase timings and readiness (/ready)
+startup_tracker = StartupTracker()
 
 # WebRTC Signaling - Store active streams with multiple viewers support
 streams: Dict[str, Dict[str, List[WebSocket]]] = {}
 # Store viewer ID mappings: {stream_id: {websocket: viewer_id}}
 viewer_id_mappings: Dict[str, Dict[WebSocket, int]] = {}
+# Reverse index for routing broadcaster messages: {stream_id: {viewer_id: websocket}}
+viewer_sockets: Dict[str, Dict[int, WebSocket]] = {}
 # Store next available viewer ID for each stream
 next_viewer_ids: Dict[str, int] = {}
+# Store negotiated wire encoding per signaling socket: {websocket: codec}
+signaling_codecs: Dict[WebSocket, object] = {}
+# Batches ICE candidates for signaling sockets that opted in with ?coalesce=1
+candidate_coalescer = CandidateCoalescer()
+# Viewer sockets watching many streams over /signal/multi (entries in the
+# registries above are their per-stream StreamChannels)
+signaling_mux = SignalingMultiplexer()
+
+# Server-side heartbeat shared by chat and signaling sockets
+heartbeat = HeartbeatScheduler()
+
+# Per-room sequence numbers and recent frames, replayed to chat sockets reconnecting with ?resume_from=
+replay = ReplayBuffer()
 
 # WebSocket connection manager
 class ConnectionManager:
     def __init__(self):
-        # Store active connections: {room_id: {user_id: websocket}}
-        self.active_connections: Dict[str, Dict[str, WebSocket]] = {}
-        # Store user info: {user_id: {"room_id": str, "websocket": WebSocket}}
-        self.user_connections: Dict[str, Dict[str, any]] = {}
-
-    async def connect(self, websocket: WebSocket, room_id: str, user_id: str):
-        """Accept WebSocket connection and add to room"""
-        await websocket.accept()
+        # Open chat sockets by handle, user and room (one compact record each)
+        self.registry = ConnectionRegistry()
+
+    async def connect(self, websocket: WebSocket, room_id: str, user_id: str,
+                      resume_from: Optional[int] = None, epoch: Optional[str] = None):
+        """Accept WebSocket connection (negotiating its encoding) and add to room
+        
+        With resume_from (the last seq the client saw, in the given epoch) the
+        frames broadcast since are replayed first. Returns the codec the client
+        negotiated.
+        """
+        codec = await protocol.accept(websocket)
         
         # Remove user from previous room if connected elsewhere
-        if user_id in self.user_connections:
+        if self.registry.user(user_id) is not None:
             await self.disconnect_user(user_id)
         
-        # Initialize room if it doesn't exist (do this AFTER disconnect to avoid deletion)
-        if room_id not in self.active_connections:
-            self.active_connections[room_id] = {}
+        await self.catch_up(websocket, codec, room_id, user_id, resume_from, epoch)
         
-        # Add user to room
-        self.active_connections[room_id][user_id] = websocket
-        self.user_connections[user_id] = {
-            "room_id": room_id,
-            "websocket": websocket
-        }
+        # No await between catching up and registering, so no broadcast can fall in between.
+        # An overlapping connect for this user may have registered while we caught up;
+        # the newest socket wins, as above.
+        stale = self.registry.user(user_id)
+        if stale is not None:
+            heartbeat.unregister(stale.websocket)
+            self.registry.remove(stale)
+        self.registry.add(user_id, room_id, websocket, codec)
+        heartbeat.register(websocket, "chat", lambda: self.disconnect_user(user_id, websocket))
+        
+        if stale is not None and stale.room_id != room_id and self.registry.room_size(stale.room_id):
+            await self.broadcast_to_room(stale.room_id, {
+                "type": "user_left",
+                "user_id": user_id,
+                "message": f"User {user_id} left the room",
+                "timestamp": datetime.now().isoformat()
+            })
         
         # Notify room about new user
         await self.broadcast_to_room(room_id, {
@@ -85,82 +152,205 @@ class ConnectionManager:
             "message": f"User {user_id} joined the room",
             "timestamp": datetime.now().isoformat()
         }, exclude_user=user_id)
+        return codec
 
-    async def disconnect_user(self, user_id: str):
-        """Disconnect user and remove from all tracking"""
-        if user_id in self.user_connections:
-            user_info = self.user_connections[user_id]
-            room_id = user_info["room_id"]
-            websocket = user_info["websocket"]
-            
-            # Remove from room
-            if room_id in self.active_connections and user_id in self.active_connections[room_id]:
-                del self.active_connections[room_id][user_id]
-                
-                # Only clean up empty rooms if no one else is connecting
-                # (This prevents race conditions during reconnection)
-                if not self.active_connections[room_id]:
-                    del self.active_connections[room_id]
-            
-            # Remove from user tracking
-            del self.user_connections[user_id]
-            
-            # Notify room about user leaving (only if room still exists and has users)
-            if room_id in self.active_connections and self.active_connections[room_id]:
-                await self.broadcast_to_room(room_id, {
-                    "type": "user_left",
-                    "user_id": user_id,
-                    "message": f"User {user_id} left the room",
+    async def catch_up(self, websocket: WebSocket, codec, room_id: str, user_id: str,
+                       resume_from: Optional[int], epoch: Optional[str]):
+        """Replay missed frames, then send a "sync" frame with the room's seq
+        
+        "complete" is false when resume_from is too old (or from another epoch)
+        to be served from the replay window; the client then reloads the room's
+        history over REST. Frames broadcast while replaying are sent too, so the
+        socket is caught up when this returns.
+        """
+        complete = True
+        if resume_from is None:
+            cursor = replay.last_seq(room_id)
+        else:
+            replay.resumes += 1
+            if replay.since(room_id, resume_from, epoch) is None:
+                replay.gaps += 1
+                complete = False
+                cursor = replay.last_seq(room_id)
+            else:
+                cursor = resume_from
+        replayed = 0
+        synced = False
+        while True:
+            missed = replay.since(room_id, cursor)
+            if missed is None:
+                # The window moved past the cursor while we were sending
+                replay.gaps += 1
+                complete = synced = False
+                cursor = replay.last_seq(room_id)
+                continue
+            if not missed:
+                if synced:
+                    break
+                await protocol.send_message(websocket, codec, {
+                    "type": "sync",
+                    "seq": cursor,
+                    "epoch": replay.epoch,
+                    "replayed": replayed,
+                    "complete": complete,
                     "timestamp": datetime.now().isoformat()
                 })
+                synced = True
+                continue
+            for entry in missed:
+                cursor = entry.seq
+                if not entry.for_user(user_id):
+                    continue
+                await protocol.send(websocket, entry.payload(codec))
+                replayed += 1
+        replay.frames_replayed += replayed
+
+    async def disconnect_user(self, user_id: str, websocket: WebSocket = None):
+        """Disconnect user and remove from all tracking
+        
+        If websocket is given, only disconnect when it is still the user's
+        current socket (a reconnect may already have replaced it).
+        """
+        connection = self.registry.user(user_id)
+        if connection is None:
+            return
+        if websocket is not None and connection.websocket is not websocket:
+            return
+        heartbeat.unregister(connection.websocket)
+        self.registry.remove(connection)
+        room_id = connection.room_id
+        
+        # Notify room about user leaving (only if it still has users)
+        if self.registry.room_size(room_id):
+            await self.broadcast_to_room(room_id, {
+                "type": "user_left",
+                "user_id": user_id,
+                "message": f"User {user_id} left the room",
+                "timestamp": datetime.now().isoformat()
+            })
 
     async def broadcast_to_room(self, room_id: str, message: dict, exclude_user: str = None):
-        """Send message to all users in a room"""
-        if room_id not in self.active_connections:
+        """Send message to all users in a room
+        
+        The message goes out with the room's next "seq" and is kept for replay,
+        also when nobody is connected (they may be about to reconnect).
+        """
+        entry = replay.stamp(room_id, message, exclude_user)
+        if not self.registry.room_size(room_id):
             return
         
+        start = time.perf_counter()
+        
         # Get all users in room
+        users_to_notify = [connection for connection in self.registry.room(room_id)
+                           if connection.user_id != exclude_user]
+        
+        await self.send_entry(entry, users_to_notify)
+        
+        metrics.broadcast_seconds.observe(time.perf_counter() - start)
+        metrics.broadcast_recipients.observe(len(users_to_notify))
+
+    async def send_to_room_users(self, room_id: str, message: dict, user_ids: Set[str]):
+        """Send message only to those of user_ids connected to the room
+        
+        Looked up by user in the registry, so the cost does not grow with
+        the room. The message still takes the room's next seq, and is
+        replayed to these users only.
+        """
+        entry = replay.stamp(room_id, message, recipients=frozenset(user_ids))
         users_to_notify = []
-        for user_id, websocket in self.active_connections[room_id].items():
-            if exclude_user and user_id == exclude_user:
-                continue
-            users_to_notify.append((user_id, websocket))
+        for user_id in user_ids:
+            connection = self.registry.user(user_id)
+            if connection is not None and connection.room_id == room_id:
+                users_to_notify.append(connection)
+        await self.send_entry(entry, users_to_notify)
+
+    async def deliver_chat(self, room_id: str, message: dict):
+        """Send a chat message: to the sender and target if it has a targetUid, else to the room"""
+        target_uid = message.get("targetUid")
+        if DIRECTED_CHAT_DELIVERY and target_uid:
+            metrics.directed_messages.inc()
+            await self.send_to_room_users(room_id, message, {message["uid"], target_uid})
+        else:
+            await self.broadcast_to_room(room_id, message)
+
+    async def send_entry(self, entry, users_to_notify: List[ChatConnection]):
+        """Send a stamped frame to connections, encoding once per codec
         
-        # Send to all users (handle disconnections)
-        disconnected_users = []
-        for user_id, websocket in users_to_notify:
+        The encodings stay with the entry for replays. Users whose socket
+        fails are disconnected.
+        """
+        disconnected = []
+        for connection in users_to_notify:
             try:
-                await websocket.send_text(json.dumps(message))
+                await protocol.send(connection.websocket, entry.payload(connection.codec))
             except Exception:
                 # Mark for removal if connection is broken
-                disconnected_users.append(user_id)
+                disconnected.append(connection)
         
         # Clean up broken connections
-        for user_id in disconnected_users:
-            await self.disconnect_user(user_id)
+        for connection in disconnected:
+            await self.disconnect_user(connection.user_id, connection.websocket)
 
     async def send_to_user(self, user_id: str, message: dict):
         """Send message to specific user"""
-        if user_id in self.user_connections:
-            websocket = self.user_connections[user_id]["websocket"]
+        connection = self.registry.user(user_id)
+        if connection is not None:
+            try:
+                await protocol.send_message(connection.websocket, connection.codec, message)
+            except Exception:
+                await self.disconnect_user(user_id, connection.websocket)
+
+    async def close_room(self, room_id: str, message: dict, code: int) -> List[str]:
+        """Send message to everyone in a room, then close and forget their sockets
+        
+        Returns the ids of the users that were connected.
+        """
+        connected = self.registry.room(room_id)
+        await self.broadcast_to_room(room_id, message)
+        self.registry.drop_room(room_id)
+        replay.drop(room_id)
+        for connection in connected:
+            heartbeat.unregister(connection.websocket)
             try:
-                await websocket.send_text(json.dumps(message))
+                await connection.websocket.close(code=code, reason="Room closed")
             except Exception:
-                await self.disconnect_user(user_id)
+                pass
+        return [connection.user_id for connection in connected]
+
+    def is_connected(self, user_id: str) -> bool:
+        return self.registry.user(user_id) is not None
 
     def get_room_users(self, room_id: str) -> List[str]:
         """Get list of users currently connected to a room"""
-        if room_id in self.active_connections:
-            return list(self.active_connections[room_id].keys())
-        return []
+        return [connection.user_id for connection in self.registry.room(room_id)]
 
 # Global connection manager instance
 manager = ConnectionManager()
 
+# Running bet totals and throttled pot updates pushed to rooms
+bet_aggregator = BetAggregator()
+pot_pusher = PotUpdatePusher(bet_aggregator, manager.broadcast_to_room)
+
+# User and Room rows behind the existence/type checks at the top of most endpoints
+metadata = MetadataCache()
+
+# Emoji names by prefix for /emojis/search (loaded at startup, updated on upload/delete)
+emoji_index = EmojiPrefixIndex()
+
+# Routes each room's Chat and Bet rows to its shard file (shards.SHARD_COUNT; off by default)
+shard_router = ShardRouter(DATABASE_PATH)
+
+# Known users/rooms and seen idempotency keys for bulk bet ingestion
+bet_validation = BetValidationCache()
+bet_idempotency = IdempotencyCache()
+
+# Max bets accepted by one bulk request
+MAX_BULK_BETS = 5000
+
 def get_db():
     """Create a new database connection for each request (thread-safe)"""
-    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
+    conn = connect_db(DATABASE_PATH, check_same_thread=False)
     try:
         yield conn
     finally:
@@ -179,9 +369,7 @@ def process_emoji_in_comment(comment: str, db: sqlite3.Connection, user_type: st
     
     def replace_emoji(match):
         emoji_name = match.group(1)
-        cursor = db.cursor()
-        cursor.execute("SELECT filename, isPremium FROM Emoji WHERE name = ?", (emoji_name,))
-        emoji_row = cursor.fetchone()
+        emoji_row = metadata.emoji(db, emoji_name)
         
         if emoji_row:
             # Check if user can send this emoji
@@ -220,6 +408,7 @@ class RoomResponse(BaseModel):
     type: str
     duration: float
     createAt: str
+    closedAt: Optional[str] = None  # Set once the room's duration has run out
 
 class ChatCreate(BaseModel):
     comment: str
@@ -232,6 +421,22 @@ class ChatResponse(BaseModel):
     comment: str
     createAt: str
 
+class ChatRetentionUpdate(BaseModel):
+    retentionDays: float  # 0 or less keeps the room's chat forever
+
+class ChatSearchResult(ChatResponse):
+    score: float  # Relevance, higher is better
+
+class RateLimitUpdate(BaseModel):
+    rate: float  # Sustained messages per second
+    burst: float
+
+class AdmissionUpdate(BaseModel):
+    limit: int  # Concurrent requests, 0 for unbounded
+    queue_limit: int
+    deadline: float  # Seconds a request may wait for a slot
+    shed_lag: float  # Event-loop lag (seconds) above which new requests are refused, 0 for never
+
 class BetCreate(BaseModel):
     bet: float
 
@@ -241,11 +446,42 @@ class BetResponse(BaseModel):
     bet: float
     createAt: str
 
+class BulkBetItem(BaseModel):
+    uid: str
+    rid: str
+    bet: float
+    idempotencyKey: Optional[str] = None
+
+class BulkBetCreate(BaseModel):
+    bets: List[BulkBetItem]
+
+class BulkBetResult(BaseModel):
+    index: int
+    status: str  # "accepted", "duplicate" or "rejected"
+    createAt: Optional[str] = None  # Original createAt for duplicates
+    detail: Optional[str] = None
+
+class BulkBetResponse(BaseModel):
+    accepted: int
+    duplicates: int
+    rejected: int
+    results: List[BulkBetResult]
+
 class RoomJoinResponse(BaseModel):
     message: str
     room: RoomResponse
     isNewRoom: bool
 
+class RecordingResponse(BaseModel):
+    sid: str
+    uid: str  # Broadcaster (stream id)
+    startedAt: str
+    endedAt: Optional[str] = None  # None while the stream is still being recorded
+    segments: int
+    duration: float  # Seconds
+    bytes: int
+    playlist: str
+
 class EmojiResponse(BaseModel):
     eid: str
     name: str
@@ -255,63 +491,194 @@ class EmojiResponse(BaseModel):
     url: str
     isPremium: bool  # New field to indicate if emoji is premium
 
+# Background event-loop lag probe
+loop_lag_task: Optional[asyncio.Task] = None
+
+# Event-loop stall watchdog and opt-in sampling profiler
+loop_profiler = LoopProfiler()
+
+# Indexes chat written before the search index existed
+chat_search_backfill_task: Optional[asyncio.Task] = None
+
+async def close_expired_rooms(expired):
+    """Close rooms whose duration ran out
+    
+    Finalizes their open sessions in one transaction, tells connected chat
+    sockets the room closed, closes them, and tears down the signaling
+    streams of the room's users (streams are keyed by the broadcaster's uid).
+    """
+    conn = connect_db(DATABASE_PATH)
+    try:
+        finalized = close_rooms(conn, expired, rollups.record_session)
+    finally:
+        conn.close()
+    
+    for rid, session_uids in finalized.items():
+        bet_validation.close_room(rid)
+        metadata.invalidate_room(rid)
+        connected = await manager.close_room(rid, {
+            "type": "room_closed",
+            "rid": rid,
+            "message": "The room has reached the end of its duration",
+            "timestamp": datetime.now().isoformat()
+        }, ROOM_CLOSED_CODE)
+        for stream_id in set(session_uids) | set(connected):
+            # Leave streams alone for users now chatting in another room
+            if not manager.is_connected(stream_id):
+                await close_signaling_stream(stream_id, ROOM_CLOSED_CODE)
+        print(f"[lifecycle] Room {rid} closed: {len(session_uids)} sessions finalized, "
+              f"{len(connected)} sockets closed")
+
+# Closes rooms when Room.duration runs out
+room_lifecycle = RoomLifecycleScheduler(close_expired_rooms)
+
+# Moves chat past its room's retention into compressed archive segments
+chat_archiver = ChatArchiver(lambda: connect_db(DATABASE_PATH), connect_room=shard_router.connect)
+
+# Hourly chat/bet/session rollups, counted on write and flushed in batches
+rollups = RollupWriter(lambda: connect_db(DATABASE_PATH),
+                       lambda: [connect_db(path) for path in shard_router.paths()])
+
+# Indexes SRS's HLS segments into recording sessions linked from LeaderBoard.recording
+recording_indexer = RecordingIndexer(lambda: connect_db(DATABASE_PATH))
+
+# Online, compressed snapshots of the primary database and any shard files
+backups = BackupScheduler(lambda: [DATABASE_PATH] + (shard_router.paths() if shard_router.enabled else []))
+
+# Connection gauges are computed at scrape time from the live registries
+metrics.registry.callback(
+    "publicpooper_ws_connections", "Open chat WebSocket connections", "gauge",
+    lambda: len(manager.registry))
+metrics.registry.callback(
+    "publicpooper_signaling_connections", "Open signaling WebSocket connections by role", "gauge",
+    lambda: [((role,), sum(len(roles.get(role, [])) for roles in streams.values()))
+             for role in ("broadcaster", "viewer")],
+    ["role"])
+metrics.registry.callback(
+    "publicpooper_active_streams", "Streams with at least one signaling connection", "gauge",
+    lambda: len(streams))
+metrics.registry.callback(
+    "publicpooper_backup_last_success_timestamp_seconds", "Unix time of the last completed database snapshot", "gauge",
+    lambda: backups.last_success or 0)
+metrics.registry.callback(
+    "publicpooper_heartbeat_reaped_total", "Sockets reaped by the heartbeat", "counter",
+    lambda: [((kind,), count) for kind, count in heartbeat.reaped.items()],
+    ["kind"])
+
 # Initialize database on startup
 @app.on_event("startup")
 async def startup_event():
+    startup_tracker.mark("startup")
     init_database()
+    shard_router.init()
+    startup_tracker.mark("database")
+    conn = connect_db(DATABASE_PATH)
+    try:
+        shard_connections = shard_router.connect_all(conn)
+        try:
+            bet_aggregator.rebuild(*shard_connections)
+        finally:
+            shard_router.close_all(conn, shard_connections)
+        bet_validation.load(conn)
+        room_lifecycle.load(conn)
+        recording_indexer.load(conn)
+        emoji_index.load(conn)
+    finally:
+        conn.close()
+    startup_tracker.mark("aggregates")
+    startup_tracker.start_prewarm(lambda: connect_db(DATABASE_PATH), metadata)
+    room_lifecycle.start()
+    chat_archiver.start()
+    rollups.start()
+    recording_indexer.start()
+    backups.start()
+    heartbeat.start()
+    global loop_lag_task
+    loop_lag_task = asyncio.create_task(metrics.monitor_loop_lag())
+    loop_profiler.register_routes(app.routes)
+    loop_profiler.start()
+    global chat_search_backfill_task
+    chat_search_backfill_task = asyncio.create_task(chat_search.run_backfill(lambda: connect_db(DATABASE_PATH)))
+    startup_tracker.mark("serving")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await startup_tracker.stop()
+    await heartbeat.stop()
+    await room_lifecycle.stop()
+    await chat_archiver.stop()
+    await rollups.stop()
+    await recording_indexer.stop()
+    await backups.stop()
+    if loop_lag_task is not None:
+        loop_lag_task.cancel()
+    await loop_profiler.stop()
+    if chat_search_backfill_task is not None:
+        chat_search_backfill_task.cancel()
+
+def webrtc_js_asset():
+    return asset_cache.render("webrtc.js", "text/javascript")
+
+def webrtc_js_url() -> str:
+    """Versioned script URL for pages, so browsers may cache it indefinitely"""
+    return f"/static/webrtc.js?v={webrtc_js_asset().version}"
 
 @app.get("/static/webrtc.js")
-async def webrtc_js(request: Request):
-    return templates.TemplateResponse("webrtc.js", {
-        "request": request
-    })
+async def webrtc_js(request: Request, v: Optional[str] = None):
+    asset = webrtc_js_asset()
+    cache_control = IMMUTABLE_CACHE_CONTROL if v == asset.version else REVALIDATE_CACHE_CONTROL
+    return asset.response(request, cache_control)
 
 # HTML Template routes for WebRTC streaming
 @app.get("/stream/{stream_id}", response_class=HTMLResponse)
 async def stream_page(request: Request, stream_id: str):
     """Serve the broadcaster page for a specific stream"""
-    return templates.TemplateResponse("stream.html", {
-        "request": request,
-        "stream_id": stream_id
-    })
+    return asset_cache.render("stream.html", "text/html",
+                              stream_id=stream_id, webrtc_js_url=webrtc_js_url()).response(request)
 
 @app.get("/watch/{stream_id}", response_class=HTMLResponse)
 async def watch_page(request: Request, stream_id: str):
     """Serve the viewer page for a specific stream"""
-    return templates.TemplateResponse("watch.html", {
-        "request": request,
-        "stream_id": stream_id
-    })
+    return asset_cache.render("watch.html", "text/html",
+                              stream_id=stream_id, webrtc_js_url=webrtc_js_url()).response(request)
 
 @app.get("/watch-all", response_class=HTMLResponse)
 async def watch_all_page(request: Request):
     """Serve the page to watch all active streams"""
-    # Get active stream IDs from the streams dictionary
-    active_stream_ids = list(streams.keys()) if streams else ['stream1', 'stream2', 'stream3']
+    # Streams with a broadcaster; the page follows later starts/stops over /signal/multi
+    active_stream_ids = tuple(live_streams())
     
-    return templates.TemplateResponse("watch_all.html", {
-        "request": request,
-        "stream_ids": active_stream_ids
-    })
+    return asset_cache.render("watch_all.html", "text/html",
+                              stream_ids=active_stream_ids, webrtc_js_url=webrtc_js_url()).response(request)
 
-# WebRTC Signaling endpoint
-@app.websocket("/signal/{stream_id}/{role}")
-async def webrtc_signaling(websocket: WebSocket, stream_id: str, role: str):
-    """WebRTC signaling endpoint for video streaming
-    
-    Connect with: ws://localhost:8000/signal/{stream_id}/{role}
-    Roles: 'broadcaster' or 'viewer'
-    
-    Supports one broadcaster and multiple viewers per stream.
-    Each viewer gets a unique ID for proper message routing.
+async def relay_signal(target: WebSocket, message, frame_codec, message_data: dict, candidate: bool = False):
+    """Forward a signaling frame to one peer
+
+    The received frame is passed through untouched when the target negotiated
+    the same encoding. ICE candidates for coalescing sockets are batched;
+    anything else flushes the target's pending candidates first.
     """
-    await websocket.accept()
-    print(f"[{stream_id}] {role} connected")
-    
+    target_codec = signaling_codecs.get(target, protocol.JSON)
+    if target_codec is not frame_codec:
+        message = target_codec.encode(message_data)
+    if candidate and candidate_coalescer.wants(target):
+        await candidate_coalescer.add(target, target_codec, message)
+        return
+    if target in candidate_coalescer.pending:
+        await candidate_coalescer.flush(target)
+    await protocol.send(target, message)
+
+def live_streams() -> List[str]:
+    """Streams that currently have a broadcaster"""
+    return [stream_id for stream_id, roles in streams.items() if roles.get("broadcaster")]
+
+def add_signaling_socket(stream_id: str, role: str, websocket: WebSocket) -> Optional[int]:
+    """Register a signaling socket with its stream; returns the viewer ID assigned to viewers"""
     # Initialize stream if it doesn't exist
     if stream_id not in streams:
         streams[stream_id] = {"broadcaster": [], "viewer": []}
         viewer_id_mappings[stream_id] = {}
+        viewer_sockets[stream_id] = {}
         next_viewer_ids[stream_id] = 1
     
     # Add connection to appropriate role list
@@ -327,46 +694,190 @@ async def webrtc_signaling(websocket: WebSocket, stream_id: str, role: str):
         viewer_id = next_viewer_ids[stream_id]
         next_viewer_ids[stream_id] += 1
         viewer_id_mappings[stream_id][websocket] = viewer_id
+        viewer_sockets[stream_id][viewer_id] = websocket
         print(f"[{stream_id}] Assigned viewer ID: {viewer_id}")
+    elif role == "broadcaster" and len(streams[stream_id]["broadcaster"]) == 1:
+        stream_started(stream_id)
+    return viewer_id
+
+def attach_stream_channel(subscriber, stream_id: str) -> bool:
+    """Give a multiplexed socket a viewer slot in a stream; False when it has too many"""
+    if stream_id in subscriber.channels:
+        return True
+    if len(subscriber.channels) >= MAX_MULTIPLEXED_STREAMS:
+        return False
+    channel = subscriber.channels[stream_id] = StreamChannel(subscriber, stream_id)
+    signaling_codecs[channel] = subscriber.codec
+    if subscriber.coalesce:
+        candidate_coalescer.enable(channel)
+    add_signaling_socket(stream_id, "viewer", channel)
+    return True
+
+def detach_stream_channel(subscriber, stream_id: str):
+    channel = subscriber.channels.pop(stream_id, None)
+    if channel is not None:
+        remove_signaling_socket(stream_id, "viewer", channel)
+
+def stream_started(stream_id: str):
+    """A stream got its broadcaster: attach watch-all sockets and announce it"""
+    for subscriber in signaling_mux.interested(stream_id):
+        attach_stream_channel(subscriber, stream_id)
+    signaling_mux.publish(stream_id, {"type": "stream-started", "streamId": stream_id})
+
+def stream_stopped(stream_id: str):
+    """A stream lost its last broadcaster: announce it and release watch-all slots"""
+    for subscriber in signaling_mux.publish(stream_id, {"type": "stream-stopped", "streamId": stream_id}):
+        # Sockets that asked for this stream by id keep waiting for a new broadcaster
+        if stream_id not in subscriber.streams:
+            detach_stream_channel(subscriber, stream_id)
+
+def remove_signaling_socket(stream_id: str, role: str, websocket: WebSocket):
+    """Remove a signaling websocket from its stream and drop the stream once empty"""
+    if stream_id in streams and role in streams[stream_id]:
+        if websocket in streams[stream_id][role]:
+            streams[stream_id][role].remove(websocket)
+            viewer_id = viewer_id_mappings.get(stream_id, {}).pop(websocket, None)
+            if viewer_id is not None:
+                viewer_sockets.get(stream_id, {}).pop(viewer_id, None)
+            signaling_codecs.pop(websocket, None)
+            candidate_coalescer.discard(websocket)
+            if role == "viewer" and viewer_id:
+                print(f"[{stream_id}] Viewer {viewer_id} removed from stream")
+            else:
+                print(f"[{stream_id}] {role} removed from stream")
+            if role == "broadcaster" and not streams[stream_id]["broadcaster"]:
+                stream_stopped(stream_id)
+        
+        # Clean up empty streams (releasing watch-all slots above may already have)
+        if (stream_id in streams and
+            not streams[stream_id]["broadcaster"] and 
+            not streams[stream_id]["viewer"]):
+            del streams[stream_id]
+            if stream_id in viewer_id_mappings:
+                del viewer_id_mappings[stream_id]
+            viewer_sockets.pop(stream_id, None)
+            if stream_id in next_viewer_ids:
+                del next_viewer_ids[stream_id]
+            print(f"[{stream_id}] Stream deleted - no active connections")
+
+async def close_signaling_stream(stream_id: str, code: int):
+    """Close every signaling socket of a stream and drop the stream"""
+    for role, sockets in list(streams.get(stream_id, {}).items()):
+        for websocket in list(sockets):
+            heartbeat.unregister(websocket)
+            remove_signaling_socket(stream_id, role, websocket)
+            try:
+                await websocket.close(code=code)
+            except Exception:
+                pass
+
+async def refuse_signaling_frame(websocket: WebSocket, frame_codec, limiter, message_type: str,
+                                 stream_id: Optional[str] = None):
+    """Tell a peer its frame was dropped by a rate limit, so it can retry rather than hang mid-negotiation"""
+    error = {"type": "error", "message": f"Rate limit exceeded ({limiter.scope}); {message_type} dropped"}
+    if stream_id is not None:
+        error["streamId"] = stream_id
+    try:
+        await protocol.send_message(websocket, frame_codec, error)
+    except Exception:
+        pass
+
+async def relay_to_broadcasters(stream_id: str, message, frame_codec, message_data: dict, candidate: bool = False):
+    """Forward a viewer's frame (already carrying its viewerId) to the stream's broadcasters"""
+    broadcasters = streams.get(stream_id, {}).get("broadcaster", [])
+    disconnected_broadcasters = []
+    
+    for broadcaster_ws in broadcasters:
+        try:
+            await relay_signal(broadcaster_ws, message, frame_codec, message_data, candidate)
+        except Exception as e:
+            print(f"[{stream_id}] Failed to send to broadcaster: {e}")
+            disconnected_broadcasters.append(broadcaster_ws)
+    
+    # Remove disconnected broadcasters
+    for broadcaster_ws in disconnected_broadcasters:
+        remove_signaling_socket(stream_id, "broadcaster", broadcaster_ws)
+
+# WebRTC Signaling endpoint
+@app.websocket("/signal/{stream_id}/{role}")
+async def webrtc_signaling(websocket: WebSocket, stream_id: str, role: str, coalesce: bool = False):
+    """WebRTC signaling endpoint for video streaming
+    
+    Connect with: ws://localhost:8000/signal/{stream_id}/{role}
+    Roles: 'broadcaster' or 'viewer'
+    
+    Supports one broadcaster and multiple viewers per stream.
+    Each viewer gets a unique ID for proper message routing.
+    Peers may negotiate different encodings; frames are re-encoded per target.
+    With ?coalesce=1 the socket may receive batched "ice-candidates" frames.
+    """
+    # Every socket of a stream shares one copy of its id
+    stream_id = sys.intern(stream_id)
+    codec = await protocol.accept(websocket)
+    signaling_codecs[websocket] = codec
+    if coalesce:
+        candidate_coalescer.enable(websocket)
+    print(f"[{stream_id}] {role} connected")
+    
+    viewer_id = add_signaling_socket(stream_id, role, websocket)
+    
+    async def reap_signaling_socket():
+        remove_signaling_socket(stream_id, role, websocket)
+    
+    heartbeat.register(websocket, "signaling", reap_signaling_socket)
+    peer_bucket = ratelimit.peer_limiter.new_bucket()
     
     try:
         while True:
             # Receive message from current role
-            message = await websocket.receive_text()
+            message = await protocol.receive_raw(websocket)
+            heartbeat.touch(websocket)
             
             if not message:
                 break
             
             try:
-                message_data = json.loads(message)
+                # Text frames are always JSON, whatever encoding was negotiated
+                frame_codec = protocol.JSON if isinstance(message, str) else codec
+                message_data = frame_codec.decode(message)
                 message_type = message_data.get("type", "unknown")
                 msg_viewer_id = message_data.get("viewerId")
+                metrics.signaling_messages.labels(role, metrics.signaling_type_label(message_type)).inc()
+                
+                # Heartbeat frames are answered here, never relayed and never rate limited
+                if message_type == "ping":
+                    await protocol.send_message(websocket, frame_codec, {"type": "pong"})
+                    continue
+                if message_type == "pong":
+                    continue
                 
-                print(f"[{stream_id}] {role} sent: {message_type}" + 
-                      (f" (viewer {msg_viewer_id})" if msg_viewer_id else ""))
+                limiter = ratelimit.allow_signaling(peer_bucket, stream_id, "signaling")
+                if limiter is not None:
+                    await refuse_signaling_frame(websocket, frame_codec, limiter, message_type, stream_id)
+                    continue
+                
+                # Candidates are trickled by the dozen; only log the rest
+                candidate = message_type == "ice-candidate"
+                if not candidate:
+                    print(f"[{stream_id}] {role} sent: {message_type}" + 
+                          (f" (viewer {msg_viewer_id})" if msg_viewer_id else ""))
                 
                 # Route messages based on type and role
                 if role == "broadcaster":
                     # Broadcaster messages go to specific viewer or all viewers
                     if msg_viewer_id is not None:
                         # Find viewer websocket by ID
-                        target_viewer = None
-                        for viewer_ws, vid in viewer_id_mappings.get(stream_id, {}).items():
-                            if vid == msg_viewer_id and viewer_ws in streams[stream_id].get("viewer", []):
-                                target_viewer = viewer_ws
-                                break
+                        target_viewer = viewer_sockets.get(stream_id, {}).get(msg_viewer_id)
                         
                         if target_viewer:
                             try:
-                                await target_viewer.send_text(message)
-                                print(f"[{stream_id}] Message sent to viewer {msg_viewer_id}")
+                                await relay_signal(target_viewer, message, frame_codec, message_data, candidate)
+                                if not candidate:
+                                    print(f"[{stream_id}] Message sent to viewer {msg_viewer_id}")
                             except Exception as e:
                                 print(f"[{stream_id}] Failed to send to viewer {msg_viewer_id}: {e}")
                                 # Remove disconnected viewer
-                                if target_viewer in streams[stream_id]["viewer"]:
-                                    streams[stream_id]["viewer"].remove(target_viewer)
-                                if target_viewer in viewer_id_mappings.get(stream_id, {}):
-                                    del viewer_id_mappings[stream_id][target_viewer]
+                                remove_signaling_socket(stream_id, "viewer", target_viewer)
                         else:
                             print(f"[{stream_id}] Viewer {msg_viewer_id} not found")
                     else:
@@ -376,9 +887,10 @@ async def webrtc_signaling(websocket: WebSocket, stream_id: str, role: str):
                         
                         for viewer_ws in viewers:
                             try:
-                                await viewer_ws.send_text(message)
-                                vid = viewer_id_mappings.get(stream_id, {}).get(viewer_ws, "unknown")
-                                print(f"[{stream_id}] Broadcast sent to viewer {vid}")
+                                await relay_signal(viewer_ws, message, frame_codec, message_data, candidate)
+                                if not candidate:
+                                    vid = viewer_id_mappings.get(stream_id, {}).get(viewer_ws, "unknown")
+                                    print(f"[{stream_id}] Broadcast sent to viewer {vid}")
                             except Exception as e:
                                 vid = viewer_id_mappings.get(stream_id, {}).get(viewer_ws, "unknown")
                                 print(f"[{stream_id}] Failed to send to viewer {vid}: {e}")
@@ -386,35 +898,19 @@ async def webrtc_signaling(websocket: WebSocket, stream_id: str, role: str):
                         
                         # Remove disconnected viewers
                         for viewer_ws in disconnected_viewers:
-                            if viewer_ws in streams[stream_id]["viewer"]:
-                                streams[stream_id]["viewer"].remove(viewer_ws)
-                            if viewer_ws in viewer_id_mappings.get(stream_id, {}):
-                                del viewer_id_mappings[stream_id][viewer_ws]
+                            remove_signaling_socket(stream_id, "viewer", viewer_ws)
                 
                 elif role == "viewer":
                     # Viewer messages go to broadcaster with viewer ID attached
                     if viewer_id is not None and "viewerId" not in message_data:
-                        # Add viewer ID to message
+                        # Add viewer ID to message, splicing it into the received frame where possible
                         message_data["viewerId"] = viewer_id
-                        message = json.dumps(message_data)
-                    
-                    broadcasters = streams[stream_id].get("broadcaster", [])
-                    disconnected_broadcasters = []
-                    
-                    for broadcaster_ws in broadcasters:
-                        try:
-                            await broadcaster_ws.send_text(message)
-                        except Exception as e:
-                            print(f"[{stream_id}] Failed to send to broadcaster: {e}")
-                            disconnected_broadcasters.append(broadcaster_ws)
+                        message = frame_codec.inject(message, "viewerId", viewer_id) or frame_codec.encode(message_data)
                     
-                    # Remove disconnected broadcasters
-                    for broadcaster_ws in disconnected_broadcasters:
-                        if broadcaster_ws in streams[stream_id]["broadcaster"]:
-                            streams[stream_id]["broadcaster"].remove(broadcaster_ws)
+                    await relay_to_broadcasters(stream_id, message, frame_codec, message_data, candidate)
             
-            except json.JSONDecodeError:
-                print(f"[{stream_id}] Invalid JSON received from {role}")
+            except ValueError:
+                print(f"[{stream_id}] Invalid frame received from {role}")
             except Exception as e:
                 print(f"[{stream_id}] Error processing message from {role}: {e}")
                     
@@ -423,27 +919,140 @@ async def webrtc_signaling(websocket: WebSocket, stream_id: str, role: str):
     except Exception as e:
         print(f"WebRTC signaling error for {role} in stream {stream_id}: {e}")
     finally:
-        # Remove this websocket from the appropriate role list
-        if stream_id in streams and role in streams[stream_id]:
-            if websocket in streams[stream_id][role]:
-                streams[stream_id][role].remove(websocket)
-                if role == "viewer" and viewer_id:
-                    print(f"[{stream_id}] Viewer {viewer_id} removed from stream")
-                    # Remove from viewer ID mapping
-                    if websocket in viewer_id_mappings.get(stream_id, {}):
-                        del viewer_id_mappings[stream_id][websocket]
-                else:
-                    print(f"[{stream_id}] {role} removed from stream")
+        heartbeat.unregister(websocket)
+        remove_signaling_socket(stream_id, role, websocket)
+        signaling_codecs.pop(websocket, None)
+        candidate_coalescer.discard(websocket)
+
+def subscribe_streams(subscriber, stream_ids: List[str], watch_all: bool) -> List[str]:
+    """Add streams (by id, or all live and future ones) to a multiplexed socket
+
+    Returns the subscribed streams that are live now; the client starts
+    negotiating with each (viewer-joined), exactly as after stream-started.
+    """
+    if watch_all:
+        subscriber.watch_all = True
+    for stream_id in stream_ids:
+        subscriber.streams.add(stream_id)
+        attach_stream_channel(subscriber, stream_id)
+    live = [stream_id for stream_id in live_streams() if subscriber.wants(stream_id)]
+    for stream_id in live:
+        attach_stream_channel(subscriber, stream_id)
+    return [stream_id for stream_id in live if stream_id in subscriber.channels]
+
+def unsubscribe_streams(subscriber, stream_ids: List[str], watch_all: bool):
+    if watch_all:
+        subscriber.watch_all = False
+    for stream_id in stream_ids:
+        subscriber.streams.discard(stream_id)
+    for stream_id in list(subscriber.channels):
+        if not subscriber.wants(stream_id):
+            detach_stream_channel(subscriber, stream_id)
+
+def remove_multiplexed_socket(websocket: WebSocket):
+    subscriber = signaling_mux.remove(websocket)
+    if subscriber is not None:
+        for stream_id in list(subscriber.channels):
+            detach_stream_channel(subscriber, stream_id)
+
+# Multiplexed viewer signaling
+@app.websocket("/signal/multi")
+async def multiplexed_signaling(websocket: WebSocket, coalesce: bool = False):
+    """Watch many streams over one signaling socket
+    
+    Connect with: ws://localhost:8000/signal/multi
+    
+    - {"type": "subscribe", "all": true} follows every live stream and any
+      that start later; {"type": "subscribe", "streams": ["s1", "s2"]}
+      follows streams by id. The reply is {"type": "streams", "streams": [...]}
+      listing the subscribed streams that are live now.
+    - {"type": "unsubscribe", "all": true} / {"type": "unsubscribe", "streams": [...]}
+    - The server pushes {"type": "stream-started", "streamId": ...} and
+      {"type": "stream-stopped", "streamId": ...} for followed streams.
+    - Signaling frames in both directions carry "streamId"; otherwise they
+      are the frames a /signal/{stream_id}/viewer socket exchanges.
+    """
+    codec = await protocol.accept(websocket)
+    subscriber = signaling_mux.add(websocket, codec, coalesce)
+    print("[multiplex] Viewer connected")
+    
+    async def reap_multiplexed_socket():
+        remove_multiplexed_socket(websocket)
+    
+    heartbeat.register(websocket, "signaling", reap_multiplexed_socket)
+    peer_bucket = ratelimit.peer_limiter.new_bucket()
+    
+    try:
+        while True:
+            message = await protocol.receive_raw(websocket)
+            heartbeat.touch(websocket)
+            
+            if not message:
+                break
             
-            # Clean up empty streams
-            if (not streams[stream_id]["broadcaster"] and 
-                not streams[stream_id]["viewer"]):
-                del streams[stream_id]
-                if stream_id in viewer_id_mappings:
-                    del viewer_id_mappings[stream_id]
-                if stream_id in next_viewer_ids:
-                    del next_viewer_ids[stream_id]
-                print(f"[{stream_id}] Stream deleted - no active connections")
+            try:
+                # Text frames are always JSON, whatever encoding was negotiated
+                frame_codec = protocol.JSON if isinstance(message, str) else codec
+                message_data = frame_codec.decode(message)
+                message_type = message_data.get("type", "unknown")
+                metrics.signaling_messages.labels("viewer", metrics.signaling_type_label(message_type)).inc()
+                
+                if message_type == "ping":
+                    await protocol.send_message(websocket, frame_codec, {"type": "pong"})
+                    continue
+                if message_type == "pong":
+                    continue
+                
+                if message_type in ("subscribe", "unsubscribe"):
+                    if not ratelimit.peer_limiter.allow_bucket(peer_bucket, "signaling"):
+                        await refuse_signaling_frame(websocket, frame_codec, ratelimit.peer_limiter, message_type)
+                        continue
+                    stream_ids = [str(stream_id) for stream_id in message_data.get("streams") or []]
+                    watch_all = bool(message_data.get("all"))
+                    if message_type == "subscribe":
+                        live = subscribe_streams(subscriber, stream_ids, watch_all)
+                        await protocol.send_message(websocket, frame_codec, {"type": "streams", "streams": live})
+                    else:
+                        unsubscribe_streams(subscriber, stream_ids, watch_all)
+                    continue
+                
+                stream_id = message_data.get("streamId")
+                channel = subscriber.channels.get(stream_id)
+                if channel is None:
+                    await protocol.send_message(websocket, frame_codec, {
+                        "type": "error",
+                        "message": "Not subscribed to stream",
+                        "streamId": stream_id
+                    })
+                    continue
+                limiter = ratelimit.allow_signaling(peer_bucket, stream_id, "signaling")
+                if limiter is not None:
+                    await refuse_signaling_frame(websocket, frame_codec, limiter, message_type, stream_id)
+                    continue
+                
+                candidate = message_type == "ice-candidate"
+                viewer_id = viewer_id_mappings.get(stream_id, {}).get(channel)
+                if not candidate:
+                    print(f"[{stream_id}] multiplexed viewer {viewer_id} sent: {message_type}")
+                if viewer_id is not None and "viewerId" not in message_data:
+                    message_data["viewerId"] = viewer_id
+                    message = frame_codec.inject(message, "viewerId", viewer_id) or frame_codec.encode(message_data)
+                
+                await relay_to_broadcasters(stream_id, message, frame_codec, message_data, candidate)
+            
+            except ValueError:
+                print("[multiplex] Invalid frame received")
+            except Exception as e:
+                print(f"[multiplex] Error processing message: {e}")
+    
+    except WebSocketDisconnect:
+        print("[multiplex] Viewer disconnected normally")
+    except Exception as e:
+        print(f"Multiplexed signaling error: {e}")
+    finally:
+        heartbeat.unregister(websocket)
+        remove_multiplexed_socket(websocket)
+        candidate_coalescer.discard(websocket)
 
 @app.post("/emojis/upload/{uid}", response_model=EmojiResponse)
 async def upload_emoji(
@@ -464,8 +1073,7 @@ async def upload_emoji(
     cursor = db.cursor()
     
     # Check if user exists and get user type
-    cursor.execute("SELECT uid, type FROM Users WHERE uid = ?", (uid,))
-    user_row = cursor.fetchone()
+    user_row = metadata.user(db, uid)
     if not user_row:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -529,6 +1137,9 @@ async def upload_emoji(
         (eid, name, filename, uid, 1 if isPremium else 0, create_time)
     )
     db.commit()
+    emoji_row = metadata.put_emoji({"eid": eid, "name": name, "filename": filename, "uploadedBy": uid,
+                                    "isPremium": 1 if isPremium else 0, "createAt": create_time})
+    emoji_index.add(emoji_row)
     
     return EmojiResponse(
         eid=eid,
@@ -567,6 +1178,33 @@ async def get_emojis(uid: Optional[str] = None, db: sqlite3.Connection = Depends
     
     return emojis
 
+@app.get("/emojis/search", response_model=List[EmojiResponse])
+async def search_emojis(prefix: str = "", uid: Optional[str] = None, limit: int = EMOJI_SEARCH_LIMIT,
+                        db: sqlite3.Connection = Depends(get_db)):
+    """Autocomplete: emojis whose name starts with prefix (case-insensitive), in name order
+    
+    Only emojis the user can send are returned: premium emojis are left out
+    unless uid is a premium user (same rule as emojis in chat).
+    """
+    if limit < 1 or limit > EMOJI_SEARCH_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {EMOJI_SEARCH_MAX_LIMIT}")
+    user_type = "normal"
+    if uid:
+        user_row = metadata.user(db, uid)
+        if not user_row:
+            raise HTTPException(status_code=404, detail="User not found")
+        user_type = user_row["type"]
+    
+    return [EmojiResponse(
+        eid=row["eid"],
+        name=row["name"],
+        filename=row["filename"],
+        uploadedBy=row["uploadedBy"],
+        createAt=row["createAt"],
+        url=f"/emojis/{row['filename']}",
+        isPremium=bool(row["isPremium"])
+    ) for row in emoji_index.search(prefix, user_type, limit)]
+
 @app.delete("/emojis/{eid}/{uid}")
 async def delete_emoji(eid: str, uid: str, db: sqlite3.Connection = Depends(get_db)):
     """Delete an emoji (only by the uploader)"""
@@ -587,6 +1225,8 @@ async def delete_emoji(eid: str, uid: str, db: sqlite3.Connection = Depends(get_
     # Delete from database
     cursor.execute("DELETE FROM Emoji WHERE eid = ?", (eid,))
     db.commit()
+    metadata.invalidate_emoji(emoji_row["name"])
+    emoji_index.remove(emoji_row["name"])
     
     return {"message": "Emoji deleted successfully"}
 
@@ -606,10 +1246,11 @@ async def create_user(user: UserCreate, db: sqlite3.Connection = Depends(get_db)
             (uid, user.uname, user.email, user.type)
         )
         db.commit()
+        bet_validation.add_user(uid)
         
         # Fetch created user
         cursor.execute("SELECT * FROM Users WHERE uid = ?", (uid,))
-        user_row = cursor.fetchone()
+        user_row = metadata.put_user(cursor.fetchone())
         
         return UserResponse(
             uid=user_row["uid"],
@@ -629,9 +1270,7 @@ async def create_user(user: UserCreate, db: sqlite3.Connection = Depends(get_db)
 @app.get("/users/{uid}", response_model=UserResponse)
 async def get_user(uid: str, db: sqlite3.Connection = Depends(get_db)):
     """Get user by ID"""
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM Users WHERE uid = ?", (uid,))
-    user_row = cursor.fetchone()
+    user_row = metadata.user(db, uid)
     
     if not user_row:
         raise HTTPException(status_code=404, detail="User not found")
@@ -651,13 +1290,11 @@ async def join_or_create_room(room_name: str, uid: str, room_data: Optional[Room
     cursor = db.cursor()
     
     # Check if user exists
-    cursor.execute("SELECT uid FROM Users WHERE uid = ?", (uid,))
-    if not cursor.fetchone():
+    if not metadata.user(db, uid):
         raise HTTPException(status_code=404, detail="User not found")
     
     # Check if room exists
-    cursor.execute("SELECT * FROM Room WHERE rname = ?", (room_name,))
-    room_row = cursor.fetchone()
+    room_row = metadata.room_by_name(db, room_name)
     
     is_new_room = False
     
@@ -677,16 +1314,21 @@ async def join_or_create_room(room_name: str, uid: str, room_data: Optional[Room
                 (rid, room_name, room_data.user_limit or 5, room_data.type, room_data.duration)
             )
             db.commit()
+            bet_validation.add_room(rid, room_data.type)
             is_new_room = True
             
             # Fetch created room
             cursor.execute("SELECT * FROM Room WHERE rid = ?", (rid,))
-            room_row = cursor.fetchone()
+            room_row = metadata.put_room(cursor.fetchone())
+            room_lifecycle.schedule_room(rid, room_row["createAt"], room_row["duration"])
         except sqlite3.IntegrityError:
             raise HTTPException(status_code=400, detail="Room name already exists")
     else:
         rid = room_row["rid"]
         
+        if room_row["closedAt"]:
+            raise HTTPException(status_code=410, detail="Room has closed")
+        
         # Check room capacity
         if room_row["user_limit"]:
             cursor.execute("SELECT COUNT(*) as count FROM RoomUser WHERE rid = ? AND leaveAt IS NULL", (rid,))
@@ -699,10 +1341,11 @@ async def join_or_create_room(room_name: str, uid: str, room_data: Optional[Room
     if cursor.fetchone():
         raise HTTPException(status_code=400, detail="User already in room")
     
-    # Add user to room
+    # Add user to room (an open session has no leaveAt; rejoining reopens the earlier row)
     cursor.execute(
-        "INSERT INTO RoomUser (uid, rid, joinAt, leaveAt, duration) VALUES (?, ?, ?, ?, ?)",
-        (uid, rid, datetime.now().isoformat(), datetime.now().isoformat(), 0.0)
+        "INSERT INTO RoomUser (uid, rid, joinAt, leaveAt, duration) VALUES (?, ?, ?, NULL, ?) "
+        "ON CONFLICT (uid, rid) DO UPDATE SET joinAt = excluded.joinAt, leaveAt = NULL",
+        (uid, rid, datetime.now().isoformat(), 0.0)
     )
     db.commit()
     
@@ -712,7 +1355,8 @@ async def join_or_create_room(room_name: str, uid: str, room_data: Optional[Room
         user_limit=room_row["user_limit"],
         type=room_row["type"],
         duration=room_row["duration"],
-        createAt=room_row["createAt"]
+        createAt=room_row["createAt"],
+        closedAt=room_row["closedAt"]
     )
     
     return RoomJoinResponse(
@@ -743,15 +1387,14 @@ async def leave_room(rid: str, uid: str, db: sqlite3.Connection = Depends(get_db
         (leave_time.isoformat(), duration, uid, rid)
     )
     db.commit()
+    rollups.record_session(rid, leave_time.isoformat(), duration)
     
     return {"message": f"Successfully left room", "duration": duration}
 
 @app.get("/rooms/{rid}", response_model=RoomResponse)
 async def get_room(rid: str, db: sqlite3.Connection = Depends(get_db)):
     """Get room details"""
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM Room WHERE rid = ?", (rid,))
-    room_row = cursor.fetchone()
+    room_row = metadata.room(db, rid)
     
     if not room_row:
         raise HTTPException(status_code=404, detail="Room not found")
@@ -762,7 +1405,8 @@ async def get_room(rid: str, db: sqlite3.Connection = Depends(get_db)):
         user_limit=room_row["user_limit"],
         type=room_row["type"],
         duration=room_row["duration"],
-        createAt=room_row["createAt"]
+        createAt=room_row["createAt"],
+        closedAt=room_row["closedAt"]
     )
 
 @app.get("/rooms/{rid}/users", response_model=List[UserResponse])
@@ -790,9 +1434,9 @@ async def get_room_users(rid: str, db: sqlite3.Connection = Depends(get_db)):
 
 @app.get("/rooms", response_model=List[RoomResponse])
 async def get_all_rooms(db: sqlite3.Connection = Depends(get_db)):
-    """Get all available rooms"""
+    """Get all open rooms (rooms whose duration has run out are left out)"""
     cursor = db.cursor()
-    cursor.execute("SELECT * FROM Room ORDER BY createAt DESC")
+    cursor.execute("SELECT * FROM Room WHERE closedAt IS NULL ORDER BY createAt DESC")
     
     rooms = []
     for row in cursor.fetchall():
@@ -802,7 +1446,8 @@ async def get_all_rooms(db: sqlite3.Connection = Depends(get_db)):
             user_limit=row["user_limit"],
             type=row["type"],
             duration=row["duration"],
-            createAt=row["createAt"]
+            createAt=row["createAt"],
+            closedAt=row["closedAt"]
         ))
     
     return rooms
@@ -821,18 +1466,18 @@ async def send_chat(rid: str, uid: str, chat: ChatCreate, db: sqlite3.Connection
     cursor = db.cursor()
     
     # Check if user exists and get user type
-    cursor.execute("SELECT uid, type FROM Users WHERE uid = ?", (uid,))
-    user_row = cursor.fetchone()
+    user_row = metadata.user(db, uid)
     if not user_row:
         raise HTTPException(status_code=404, detail="User not found")
     
     user_type = user_row["type"]
     
     # Get room info to check type
-    cursor.execute("SELECT type FROM Room WHERE rid = ?", (rid,))
-    room_row = cursor.fetchone()
+    room_row = metadata.room(db, rid)
     if not room_row:
         raise HTTPException(status_code=404, detail="Room not found")
+    if room_row["closedAt"]:
+        raise HTTPException(status_code=410, detail="Room has closed")
     
     room_type = room_row["type"]
     
@@ -847,8 +1492,7 @@ async def send_chat(rid: str, uid: str, chat: ChatCreate, db: sqlite3.Connection
     
     # Verify target user exists if specified
     if chat.targetUid:
-        cursor.execute("SELECT uid FROM Users WHERE uid = ?", (chat.targetUid,))
-        if not cursor.fetchone():
+        if not metadata.user(db, chat.targetUid):
             raise HTTPException(status_code=404, detail="Target user not found")
     
     # Process emojis in comment with user type consideration
@@ -856,13 +1500,15 @@ async def send_chat(rid: str, uid: str, chat: ChatCreate, db: sqlite3.Connection
     
     # Insert chat message with processed comment
     create_time = datetime.now().isoformat()
-    cursor.execute(
-        "INSERT INTO Chat (uid, rid, targetUid, comment, createAt) VALUES (?, ?, ?, ?, ?)",
-        (uid, rid, chat.targetUid, processed_comment, create_time)
-    )
-    db.commit()
+    with shard_router.room(db, rid) as chat_db:
+        chat_db.execute(
+            "INSERT INTO Chat (uid, rid, targetUid, comment, createAt) VALUES (?, ?, ?, ?, ?)",
+            (uid, rid, chat.targetUid, processed_comment, create_time)
+        )
+        chat_db.commit()
+    rollups.record_chat(rid, create_time, bool(chat.targetUid))
     
-    # Broadcast to WebSocket clients
+    # Deliver to WebSocket clients (the whole room, or sender and target)
     chat_message = {
         "type": "chat",
         "uid": uid,
@@ -872,7 +1518,7 @@ async def send_chat(rid: str, uid: str, chat: ChatCreate, db: sqlite3.Connection
         "timestamp": create_time
     }
     
-    await manager.broadcast_to_room(rid, chat_message)
+    await manager.deliver_chat(rid, chat_message)
     
     return ChatResponse(
         uid=uid,
@@ -883,16 +1529,18 @@ async def send_chat(rid: str, uid: str, chat: ChatCreate, db: sqlite3.Connection
     )
 
 @app.get("/rooms/{rid}/chat", response_model=List[ChatResponse])
-async def get_room_chat(rid: str, limit: int = 50, db: sqlite3.Connection = Depends(get_db)):
-    """Get chat messages from a room"""
-    cursor = db.cursor()
-    cursor.execute(
-        "SELECT * FROM Chat WHERE rid = ? ORDER BY createAt DESC LIMIT ?",
-        (rid, limit)
-    )
+async def get_room_chat(rid: str, limit: int = 50, before: Optional[str] = None, db: sqlite3.Connection = Depends(get_db)):
+    """Get chat messages from a room
     
+    Returns the newest `limit` messages created before `before` (default: now),
+    including archived ones. Page back by passing the first message's createAt.
+    """
+    if not archive.is_room_id(rid):
+        raise HTTPException(status_code=404, detail="Room not found")
     chats = []
-    for row in cursor.fetchall():
+    with shard_router.room(db, rid) as chat_db:
+        rows = archive.room_history(chat_db, rid, before, limit)
+    for row in rows:
         chats.append(ChatResponse(
             uid=row["uid"],
             rid=row["rid"],
@@ -903,6 +1551,84 @@ async def get_room_chat(rid: str, limit: int = 50, db: sqlite3.Connection = Depe
     
     return list(reversed(chats))  # Return in chronological order
 
+@app.get("/rooms/{rid}/chat/retention")
+async def get_chat_retention(rid: str, db: sqlite3.Connection = Depends(get_db)):
+    """Get how many days of a room's chat stay in the live table before archival"""
+    overrides = archive.retention_days(db)
+    return {
+        "rid": rid,
+        "retentionDays": overrides.get(rid, chat_archiver.default_retention_days),
+        "isDefault": rid not in overrides
+    }
+
+@app.put("/rooms/{rid}/chat/retention")
+async def set_chat_retention(rid: str, retention: ChatRetentionUpdate, db: sqlite3.Connection = Depends(get_db)):
+    """Set a room's chat retention in days (0 or less keeps its chat forever)"""
+    if not metadata.room(db, rid):
+        raise HTTPException(status_code=404, detail="Room not found")
+    cursor = db.cursor()
+    cursor.execute(
+        "INSERT INTO ChatRetention (rid, retentionDays) VALUES (?, ?) "
+        "ON CONFLICT (rid) DO UPDATE SET retentionDays = excluded.retentionDays",
+        (rid, retention.retentionDays)
+    )
+    db.commit()
+    return {"rid": rid, "retentionDays": retention.retentionDays, "isDefault": False}
+
+def search_chat_rows(db: sqlite3.Connection, q: str, rid: Optional[str], uid: Optional[str],
+                     since: Optional[str], until: Optional[str], limit: int) -> List[ChatSearchResult]:
+    """Run a full-text chat search, turning bad queries into 400s
+    
+    Room searches read the room's shard; others search every shard and merge
+    by score (each shard ranks against its own index statistics).
+    """
+    def fetch(conn: sqlite3.Connection) -> List[sqlite3.Row]:
+        return chat_search.search(conn, q, rid=rid, uid=uid, since=since, until=until, limit=limit)
+    
+    try:
+        if rid is not None:
+            with shard_router.room(db, rid) as chat_db:
+                rows = fetch(chat_db)
+        else:
+            rows = shard_router.map_all(db, fetch, key=lambda row: row["score"], reverse=True, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return [ChatSearchResult(
+        uid=row["uid"],
+        rid=row["rid"],
+        targetUid=row["targetUid"],
+        comment=row["comment"],
+        createAt=row["createAt"],
+        score=row["score"]
+    ) for row in rows]
+
+@app.get("/chat/search", response_model=List[ChatSearchResult])
+async def search_chat(q: str, rid: Optional[str] = None, uid: Optional[str] = None, since: Optional[str] = None,
+                      until: Optional[str] = None, limit: int = 50, db: sqlite3.Connection = Depends(get_db)):
+    """Full-text search over all chat, ranked by relevance
+    
+    Optionally scoped by room (rid), sender (uid) and createAt range (since/until, ISO timestamps).
+    Every word in q must match; end a word with * for a prefix match.
+    """
+    return search_chat_rows(db, q, rid, uid, since, until, limit)
+
+@app.get("/chat/search/status")
+async def get_chat_search_status(db: sqlite3.Connection = Depends(get_db)):
+    """Get progress of indexing chat that predates the search index"""
+    return chat_search.backfill_status(db)
+
+@app.get("/rooms/{rid}/chat/search", response_model=List[ChatSearchResult])
+async def search_room_chat(rid: str, q: str, uid: Optional[str] = None, since: Optional[str] = None,
+                           until: Optional[str] = None, limit: int = 50, db: sqlite3.Connection = Depends(get_db)):
+    """Full-text search within a room's chat, ranked by relevance"""
+    return search_chat_rows(db, q, rid, uid, since, until, limit)
+
+@app.get("/users/{uid}/chat/search", response_model=List[ChatSearchResult])
+async def search_user_chat(uid: str, q: str, rid: Optional[str] = None, since: Optional[str] = None,
+                           until: Optional[str] = None, limit: int = 50, db: sqlite3.Connection = Depends(get_db)):
+    """Full-text search over the messages a user sent, ranked by relevance"""
+    return search_chat_rows(db, q, rid, uid, since, until, limit)
+
 # Betting endpoints
 @app.post("/rooms/{rid}/bet/{uid}", response_model=BetResponse)
 async def place_bet(rid: str, uid: str, bet: BetCreate, db: sqlite3.Connection = Depends(get_db)):
@@ -915,15 +1641,15 @@ async def place_bet(rid: str, uid: str, bet: BetCreate, db: sqlite3.Connection =
     cursor = db.cursor()
     
     # Check if user exists
-    cursor.execute("SELECT uid FROM Users WHERE uid = ?", (uid,))
-    if not cursor.fetchone():
+    if not metadata.user(db, uid):
         raise HTTPException(status_code=404, detail="User not found")
     
     # Get room info to check type
-    cursor.execute("SELECT type FROM Room WHERE rid = ?", (rid,))
-    room_row = cursor.fetchone()
+    room_row = metadata.room(db, rid)
     if not room_row:
         raise HTTPException(status_code=404, detail="Room not found")
+    if room_row["closedAt"]:
+        raise HTTPException(status_code=410, detail="Room has closed")
     
     if room_row["type"] != "competitive":
         raise HTTPException(status_code=403, detail="Betting is only allowed in competitive rooms")
@@ -932,12 +1658,17 @@ async def place_bet(rid: str, uid: str, bet: BetCreate, db: sqlite3.Connection =
         raise HTTPException(status_code=400, detail="Bet amount must be positive")
     
     # Insert bet (no room membership required for competitive rooms)
-    create_time = datetime.now().isoformat()
-    cursor.execute(
-        "INSERT INTO Bet (uid, rid, bet, createAt) VALUES (?, ?, ?, ?)",
-        (uid, rid, bet.bet, create_time)
-    )
-    db.commit()
+    create_time = next_bet_timestamp()
+    with shard_router.room(db, rid) as bet_db:
+        bet_db.execute(
+            "INSERT INTO Bet (uid, rid, bet, createAt) VALUES (?, ?, ?, ?)",
+            (uid, rid, bet.bet, create_time)
+        )
+        bet_db.commit()
+    
+    bet_aggregator.add(uid, rid, bet.bet)
+    rollups.record_bet(rid, create_time, bet.bet)
+    pot_pusher.notify(rid)
     
     return BetResponse(
         uid=uid,
@@ -946,17 +1677,118 @@ async def place_bet(rid: str, uid: str, bet: BetCreate, db: sqlite3.Connection =
         createAt=create_time
     )
 
+@app.post("/bets/bulk", response_model=BulkBetResponse)
+async def place_bets_bulk(payload: BulkBetCreate, db: sqlite3.Connection = Depends(get_db)):
+    """Place many bets in one request
+    
+    Rules are the same as for single bets. Users and rooms are validated
+    against cached id sets, bets carrying an idempotencyKey that was already
+    accepted are reported as duplicates instead of being inserted again, and
+    all accepted bets are written in a single transaction.
+    """
+    if len(payload.bets) > MAX_BULK_BETS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_BETS} bets per request")
+    
+    items = payload.bets
+    results: List[Optional[BulkBetResult]] = [None] * len(items)
+    bet_validation.resolve(db, (item.uid for item in items), (item.rid for item in items))
+    
+    # Keys not in memory may still have been recorded by an earlier request
+    unseen_keys = list({item.idempotencyKey for item in items
+                        if item.idempotencyKey and bet_idempotency.get(item.idempotencyKey) is None})
+    if unseen_keys:
+        bet_idempotency.lookup_db(db, unseen_keys)
+    
+    bet_rows = []
+    key_rows = []
+    # Keys accepted earlier in this request: {idempotencyKey: createAt}
+    batch_keys: Dict[str, str] = {}
+    for index, item in enumerate(items):
+        key = item.idempotencyKey
+        if key:
+            previous = bet_idempotency.get(key)
+            if previous is not None or key in batch_keys:
+                results[index] = BulkBetResult(
+                    index=index,
+                    status="duplicate",
+                    createAt=previous["createAt"] if previous else batch_keys[key]
+                )
+                continue
+        
+        if item.uid not in bet_validation.users:
+            detail = "User not found"
+        elif item.rid not in bet_validation.room_types:
+            detail = "Room not found"
+        elif item.rid in bet_validation.closed_rooms:
+            detail = "Room has closed"
+        elif bet_validation.room_types[item.rid] != "competitive":
+            detail = "Betting is only allowed in competitive rooms"
+        elif item.bet < 0:
+            detail = "Bet amount must be positive"
+        else:
+            detail = None
+        if detail:
+            results[index] = BulkBetResult(index=index, status="rejected", detail=detail)
+            continue
+        
+        create_time = next_bet_timestamp()
+        bet_rows.append((item.uid, item.rid, item.bet, create_time))
+        if key:
+            batch_keys[key] = create_time
+            key_rows.append((key, item.uid, item.rid, item.bet, create_time))
+        results[index] = BulkBetResult(index=index, status="accepted", createAt=create_time)
+    
+    if bet_rows:
+        # Bets grouped by the file they are stored in: {path: [row, ...]}
+        shard_rows: Dict[str, list] = {}
+        for row in bet_rows:
+            shard_rows.setdefault(shard_router.path_for(row[1]), []).append(row)
+        cursor = db.cursor()
+        try:
+            # Keys go in first so a conflict is found before any shard commits;
+            # the primary commits last (a crash in between can only lose keys)
+            cursor.executemany(
+                "INSERT INTO BetIdempotency (idempotencyKey, uid, rid, bet, createAt) VALUES (?, ?, ?, ?, ?)",
+                key_rows
+            )
+            for rows in shard_rows.values():
+                with shard_router.room(db, rows[0][1]) as bet_db:
+                    bet_db.executemany("INSERT INTO Bet (uid, rid, bet, createAt) VALUES (?, ?, ?, ?)", rows)
+                    if bet_db is not db:
+                        bet_db.commit()
+            db.commit()
+        except sqlite3.IntegrityError as e:
+            # A concurrent request recorded one of the keys first; the client can retry safely
+            db.rollback()
+            raise HTTPException(status_code=409, detail=f"Bulk bet conflict, retry the request: {e}")
+        
+        for key, uid, rid, amount, create_time in key_rows:
+            bet_idempotency.put(key, {"uid": uid, "rid": rid, "bet": amount, "createAt": create_time})
+        for uid, rid, amount, create_time in bet_rows:
+            bet_aggregator.add(uid, rid, amount)
+            rollups.record_bet(rid, create_time, amount)
+        for rid in {row[1] for row in bet_rows}:
+            pot_pusher.notify(rid)
+    
+    statuses = [result.status for result in results]
+    return BulkBetResponse(
+        accepted=statuses.count("accepted"),
+        duplicates=statuses.count("duplicate"),
+        rejected=statuses.count("rejected"),
+        results=results
+    )
+
 @app.get("/rooms/{rid}/bets", response_model=List[BetResponse])
 async def get_room_bets(rid: str, db: sqlite3.Connection = Depends(get_db)):
     """Get all bets in a room"""
-    cursor = db.cursor()
-    cursor.execute(
-        "SELECT * FROM Bet WHERE rid = ? ORDER BY createAt DESC",
-        (rid,)
-    )
+    with shard_router.room(db, rid) as bet_db:
+        rows = bet_db.execute(
+            "SELECT * FROM Bet WHERE rid = ? ORDER BY createAt DESC",
+            (rid,)
+        ).fetchall()
     
     bets = []
-    for row in cursor.fetchall():
+    for row in rows:
         bets.append(BetResponse(
             uid=row["uid"],
             rid=row["rid"],
@@ -966,17 +1798,25 @@ async def get_room_bets(rid: str, db: sqlite3.Connection = Depends(get_db)):
     
     return bets
 
+@app.get("/rooms/{rid}/bets/summary")
+async def get_room_bet_summary(rid: str, uid: Optional[str] = None):
+    """Get the running pot summary for a room (served from memory)
+    
+    Includes total, bet count, bettor count, average, max and the bet
+    distribution. Pass uid to also get that user's stake, share and odds.
+    """
+    return bet_aggregator.room_summary(rid, uid)
+
 @app.get("/users/{uid}/bets", response_model=List[BetResponse])
 async def get_user_bets(uid: str, db: sqlite3.Connection = Depends(get_db)):
-    """Get all bets by a user"""
-    cursor = db.cursor()
-    cursor.execute(
-        "SELECT * FROM Bet WHERE uid = ? ORDER BY createAt DESC",
-        (uid,)
+    """Get all bets by a user (gathered from every shard)"""
+    rows = shard_router.query_all(
+        db, "SELECT * FROM Bet WHERE uid = ? ORDER BY createAt DESC", (uid,),
+        key=lambda row: row["createAt"], reverse=True
     )
     
     bets = []
-    for row in cursor.fetchall():
+    for row in rows:
         bets.append(BetResponse(
             uid=row["uid"],
             rid=row["rid"],
@@ -986,11 +1826,326 @@ async def get_user_bets(uid: str, db: sqlite3.Connection = Depends(get_db)):
     
     return bets
 
+@app.get("/users/{uid}/bets/summary")
+async def get_user_bet_summary(uid: str):
+    """Get a user's running bet total and count across all rooms (served from memory)"""
+    return bet_aggregator.user_summary(uid)
+
+# Analytics: read only the rollup tables, never Chat, Bet or RoomUser
+def rollup_query(query, *args, **kwargs):
+    """Run an analytics query, turning bad parameters into 400s"""
+    try:
+        return query(*args, **kwargs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/analytics/chat")
+async def get_chat_analytics(rid: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                             granularity: str = "hour", db: sqlite3.Connection = Depends(get_db)):
+    """Chat messages (and directed messages) per hour or day, for one room or all
+    
+    since/until are ISO timestamps (since is rounded down to its hour, until is exclusive).
+    Counts lag writes by up to the rollup flush interval.
+    """
+    return rollup_query(analytics.chat_series, db, rid, since, until, granularity)
+
+@app.get("/analytics/bets")
+async def get_bet_analytics(rid: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                            granularity: str = "hour", db: sqlite3.Connection = Depends(get_db)):
+    """Bet count, volume, average and largest bet per hour or day"""
+    return rollup_query(analytics.bet_series, db, rid, since, until, granularity)
+
+@app.get("/analytics/sessions")
+async def get_session_analytics(rid: Optional[str] = None, roomType: Optional[str] = None,
+                                since: Optional[str] = None, until: Optional[str] = None,
+                                granularity: str = "hour", db: sqlite3.Connection = Depends(get_db)):
+    """Finished room sessions with total and average duration per hour or day (by when they ended)"""
+    return rollup_query(analytics.session_series, db, rid, roomType, since, until, granularity)
+
+@app.get("/analytics/sessions/by-type")
+async def get_session_analytics_by_type(since: Optional[str] = None, until: Optional[str] = None,
+                                        db: sqlite3.Connection = Depends(get_db)):
+    """Session count and average duration per room type"""
+    return rollup_query(analytics.sessions_by_room_type, db, since, until)
+
+@app.get("/analytics/rooms/top")
+async def get_top_rooms(metric: str = "messages", since: Optional[str] = None, until: Optional[str] = None,
+                        limit: int = 10, db: sqlite3.Connection = Depends(get_db)):
+    """Rooms ranked by messages, bets, volume, sessions or duration over a time range"""
+    return rollup_query(analytics.top_rooms, db, metric, since, until, limit)
+
+# Recordings
+def recording_response(row) -> RecordingResponse:
+    return RecordingResponse(
+        sid=row["sid"],
+        uid=row["uid"],
+        startedAt=row["startedAt"],
+        endedAt=row["endedAt"],
+        segments=row["segments"],
+        duration=row["duration"],
+        bytes=row["bytes"],
+        playlist=recordings.playlist_url(row["sid"])
+    )
+
+@app.get("/recordings", response_model=List[RecordingResponse])
+async def list_recordings(uid: Optional[str] = None, limit: int = 50, db: sqlite3.Connection = Depends(get_db)):
+    """List recording sessions, newest first (optionally one broadcaster's)"""
+    cursor = db.cursor()
+    limit = max(1, min(limit, 500))
+    if uid is None:
+        cursor.execute("SELECT * FROM RecordingSession ORDER BY startedAt DESC LIMIT ?", (limit,))
+    else:
+        cursor.execute("SELECT * FROM RecordingSession WHERE uid = ? ORDER BY startedAt DESC LIMIT ?", (uid, limit))
+    return [recording_response(row) for row in cursor.fetchall()]
+
+@app.get("/recordings/{sid}", response_model=RecordingResponse)
+async def get_recording(sid: str, db: sqlite3.Connection = Depends(get_db)):
+    """Get one recording session"""
+    cursor = db.cursor()
+    cursor.execute("SELECT * FROM RecordingSession WHERE sid = ?", (sid,))
+    row = cursor.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    return recording_response(row)
+
+@app.get("/leaderboard/{uid}/recording", response_model=RecordingResponse)
+async def get_leaderboard_recording(uid: str, db: sqlite3.Connection = Depends(get_db)):
+    """Get the recording linked from a user's LeaderBoard entry"""
+    cursor = db.cursor()
+    cursor.execute("SELECT recording FROM LeaderBoard WHERE uid = ?", (uid,))
+    row = cursor.fetchone()
+    if not row or not row["recording"]:
+        raise HTTPException(status_code=404, detail="No recording for this user")
+    cursor.execute("SELECT * FROM RecordingSession WHERE sid = ?", (recordings.playlist_sid(row["recording"]),))
+    session = cursor.fetchone()
+    if not session:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    return recording_response(session)
+
+@app.get("/recordings/{sid}/index.m3u8")
+async def get_recording_playlist(sid: str, db: sqlite3.Connection = Depends(get_db)):
+    """HLS playlist of a recording (EVENT while still recording, VOD once ended)"""
+    cursor = db.cursor()
+    cursor.execute("SELECT endedAt FROM RecordingSession WHERE sid = ?", (sid,))
+    session = cursor.fetchone()
+    if not session:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    cursor.execute("SELECT seq, duration FROM RecordingSegment WHERE sid = ? ORDER BY seq", (sid,))
+    playlist = recordings.build_playlist(cursor.fetchall(), session["endedAt"] is not None)
+    return Response(content=playlist, media_type=recordings.PLAYLIST_MEDIA_TYPE,
+                    headers={"Cache-Control": "no-cache" if session["endedAt"] is None else "max-age=3600"})
+
+@app.get("/recordings/{sid}/{seq}.ts")
+async def get_recording_segment(sid: str, seq: int, request: Request):
+    """Serve one recorded segment; honours single byte ranges (Range: bytes=start-end)"""
+    if not recordings.is_session_id(sid) or seq < 0:
+        raise HTTPException(status_code=404, detail="Segment not found")
+    path = recordings.segment_path(sid, seq, recording_indexer.recordings_dir)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Segment not found")
+    return RangeFileResponse(path, recordings.SEGMENT_MEDIA_TYPE, request.headers.get("range"),
+                             headers={"Cache-Control": "max-age=86400, immutable"})
+
+# Admin: recording indexer
+@app.get("/admin/recordings")
+async def get_recording_indexer_stats():
+    """Get recording indexer stats (scans, segments indexed, sessions started/ended, live sessions)"""
+    return recording_indexer.stats()
+
+@app.post("/admin/recordings/scan")
+async def run_recording_scan():
+    """Scan the HLS directory now; returns the number of new segments indexed"""
+    return {"segments": await recording_indexer.run_once()}
+
 # Health check
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    """200 once the database is migrated and the caches are warm, 503 before
+    
+    Unlike /health (is the process serving at all), this tells a load
+    balancer whether a restarted worker should get traffic yet.
+    """
+    status = startup_tracker.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of DB, HTTP, fan-out, signaling and event-loop metrics"""
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+# Admin: event-loop profiling
+@app.get("/admin/profiler")
+async def get_profiler_report(top: int = 20):
+    """Get event-loop stalls (with stacks, attributed to route/WS handlers) and sampled hot stacks"""
+    return loop_profiler.report(top)
+
+@app.post("/admin/profiler/sampling/start")
+async def start_profiler_sampling(interval_ms: float = 5.0):
+    """Start the sampling profiler on the event-loop thread (clears previous samples)"""
+    loop_profiler.start_sampling(interval_ms)
+    return {"message": "Sampling started", "interval_ms": loop_profiler.sample_interval * 1000.0}
+
+@app.post("/admin/profiler/sampling/stop")
+async def stop_profiler_sampling():
+    """Stop the sampling profiler; samples stay available in the report"""
+    loop_profiler.stop_sampling()
+    return {"message": "Sampling stopped", "samples": loop_profiler.sample_count}
+
+@app.post("/admin/profiler/reset")
+async def reset_profiler():
+    """Clear recorded stalls and samples"""
+    loop_profiler.reset()
+    return {"message": "Profiler reset"}
+
+@app.get("/lifecycle")
+async def lifecycle_stats():
+    """Get room lifecycle scheduler stats (rooms scheduled to close, next expiry, rooms closed)"""
+    return room_lifecycle.stats()
+
+# Admin: chat archival
+@app.get("/admin/chat/archive")
+async def get_chat_archive_stats():
+    """Get chat archival stats (passes, rows archived, segments compacted, longest write lock)"""
+    return chat_archiver.stats()
+
+@app.post("/admin/chat/archive/run")
+async def run_chat_archive():
+    """Run an archival pass now; returns messages moved per room"""
+    moved = await chat_archiver.run_once()
+    return {"rooms": moved, "messages": sum(moved.values())}
+
+# Admin: ingress rate limits
+@app.get("/admin/ratelimits")
+async def get_rate_limits():
+    """Get rate limits per scope (user, room, stream, peer) with allowed/rejected counts"""
+    return ratelimit.stats()
+
+@app.put("/admin/ratelimits/{scope}")
+async def update_rate_limit(scope: str, update: RateLimitUpdate):
+    """Change one scope's limit (sustained messages per second and burst) at runtime"""
+    limiter = ratelimit.limiters.get(scope)
+    if limiter is None:
+        raise HTTPException(status_code=404, detail="Unknown rate limit scope")
+    if update.rate <= 0 or update.burst < 1:
+        raise HTTPException(status_code=400, detail="rate must be positive and burst at least 1")
+    limiter.configure(update.rate, update.burst)
+    return {"scope": scope, **limiter.stats()}
+
+# Admin: admission control
+@app.get("/admin/admission")
+async def get_admission_stats():
+    """Get each traffic class's limits, in-flight and queued requests, admitted and shed counts"""
+    return admission.stats()
+
+@app.put("/admin/admission/{name}")
+async def update_admission_class(name: str, update: AdmissionUpdate):
+    """Change one traffic class's concurrency, queue, deadline and lag threshold at runtime"""
+    traffic = admission.classes.get(name)
+    if traffic is None:
+        raise HTTPException(status_code=404, detail="Unknown traffic class")
+    if min(update.limit, update.queue_limit, update.deadline, update.shed_lag) < 0:
+        raise HTTPException(status_code=400, detail="Limits, deadline and shed_lag must not be negative")
+    traffic.configure(update.limit, update.queue_limit, update.deadline, update.shed_lag)
+    return {"class": name, **traffic.stats()}
+
+@app.get("/admin/shards")
+async def get_shard_stats():
+    """Get the Chat/Bet shard layout and the size of each file"""
+    return shard_router.stats()
+
+@app.get("/admin/analytics")
+async def get_rollup_stats():
+    """Get pending rollup deltas, flush counts and backfill state"""
+    return rollups.stats()
+
+@app.post("/admin/analytics/rebuild")
+async def rebuild_rollups():
+    """Recount every rollup from the raw tables (one full scan of Chat, Bet and RoomUser)"""
+    await rollups.rebuild()
+    return rollups.stats()
+
+# Admin: database snapshots
+@app.get("/admin/backups")
+async def get_backup_stats():
+    """Get snapshot counts, the last snapshot's manifest and the snapshots on disk"""
+    return backups.stats()
+
+@app.post("/admin/backups/run")
+async def run_backup():
+    """Take a snapshot now (online; writes continue); returns its manifest"""
+    try:
+        return await backups.run_once()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Snapshot failed: {e}")
+
+@app.get("/admin/assets")
+async def get_asset_stats():
+    """Get the pre-rendered asset cache's size and hit counts"""
+    return asset_cache.stats()
+
+@app.post("/admin/assets/clear")
+async def clear_assets():
+    """Re-render pages and scripts on next request (after editing templates)"""
+    asset_cache.clear()
+    return asset_cache.stats()
+
+# Admin: user/room metadata cache
+@app.get("/admin/cache")
+async def get_metadata_cache_stats():
+    """Get user/room metadata cache sizes, hit rates, expirations and evictions"""
+    return metadata.stats()
+
+@app.post("/admin/cache/clear")
+async def clear_metadata_cache():
+    """Drop every cached user and room row (e.g. after editing the database by hand)"""
+    metadata.clear()
+    return {"message": "Metadata cache cleared"}
+
+@app.get("/admin/replay")
+async def get_replay_stats():
+    """Get the chat replay window: epoch, retained frames, resumes, frames replayed and gaps"""
+    return replay.stats()
+
+@app.get("/debug/registry")
+async def get_registry_stats():
+    """Get open-socket registry sizes: chat connections and their approximate bytes, signaling tables"""
+    viewers = sum(len(sockets) for sockets in viewer_sockets.values())
+    signaling_tables = (sys.getsizeof(streams) + sys.getsizeof(viewer_id_mappings) + sys.getsizeof(viewer_sockets) +
+                        sys.getsizeof(next_viewer_ids) + sys.getsizeof(signaling_codecs) +
+                        sum(sys.getsizeof(roles) + sum(sys.getsizeof(sockets) for sockets in roles.values())
+                            for roles in streams.values()) +
+                        sum(sys.getsizeof(mapping) for mapping in viewer_id_mappings.values()) +
+                        sum(sys.getsizeof(mapping) for mapping in viewer_sockets.values()))
+    return {
+        "chat": manager.registry.stats(),
+        "signaling": {
+            "streams": len(streams),
+            "broadcasters": sum(len(roles.get("broadcaster", [])) for roles in streams.values()),
+            "viewers": viewers,
+            "sockets": len(signaling_codecs),
+            "multiplexed": signaling_mux.stats(),
+            "bytes": {
+                "tables": signaling_tables,
+                "per_socket": signaling_tables // len(signaling_codecs) if signaling_codecs else 0
+            }
+        },
+        "heartbeat_tracked": len(heartbeat.connections)
+    }
+
+@app.get("/signal/multi/stats")
+async def multiplexed_signaling_stats():
+    """Get multiplexed signaling stats (sockets, watch-all sockets, attached stream slots, events sent)"""
+    return {"live_streams": live_streams(), **signaling_mux.stats()}
+
+@app.get("/heartbeat")
+async def heartbeat_stats():
+    """Get server-side heartbeat stats (tracked sockets, pings sent, reaped counts)"""
+    return heartbeat.stats()
+
 # WebRTC stream management
 @app.get("/streams")
 async def get_active_streams():
@@ -1024,22 +2179,26 @@ async def get_active_streams():
 
 # WebSocket endpoint
 @app.websocket("/ws/{room_id}/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
+async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str,
+                             resume_from: Optional[int] = None, epoch: Optional[str] = None):
     """WebSocket endpoint for real-time chat
     
     Connect with: ws://localhost:8000/ws/{room_id}/{user_id}
+    Reconnect with: ws://localhost:8000/ws/{room_id}/{user_id}?resume_from={last seq}&epoch={epoch}
     
     Messages format:
     - Incoming: {"type": "chat", "comment": "Hello!", "targetUid": null}
-    - Outgoing: {"type": "chat", "uid": "user123", "comment": "Hello!", "timestamp": "..."}
+    - Outgoing: {"type": "chat", "uid": "user123", "comment": "Hello!", "timestamp": "...", "seq": 42}
+    - On connect, after any replayed frames: {"type": "sync", "seq": 42, "epoch": "...", "replayed": 3, "complete": true}
     """
+    # Every socket in a room shares one copy of its id (see connections.py)
+    room_id = sys.intern(room_id)
+    user_id = sys.intern(user_id)
+    
     # Verify user exists (create new connection for this thread)
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    conn = connect_db(DATABASE_PATH)
     
-    cursor.execute("SELECT uid, type FROM Users WHERE uid = ?", (user_id,))
-    user_row = cursor.fetchone()
+    user_row = metadata.user(conn, user_id)
     
     if not user_row:
         await websocket.close(code=4004, reason="User not found")
@@ -1049,34 +2208,55 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
     user_type = user_row["type"]
     
     # Verify room exists
-    cursor.execute("SELECT rid, type FROM Room WHERE rid = ?", (room_id,))
-    room_row = cursor.fetchone()
+    room_row = metadata.room(conn, room_id)
     
     if not room_row:
         await websocket.close(code=4004, reason="Room not found")
         conn.close()
         return
     
+    if room_row["closedAt"]:
+        await websocket.close(code=ROOM_CLOSED_CODE, reason="Room closed")
+        conn.close()
+        return
+    
     room_type = room_row["type"]
     conn.close()
     
     # Connect user to room
-    await manager.connect(websocket, room_id, user_id)
+    codec = await manager.connect(websocket, room_id, user_id, resume_from, epoch)
+    throttled = False
     
     try:
         while True:
             # Receive message from client
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
+            data = await protocol.receive_raw(websocket)
+            heartbeat.touch(websocket)
+            
+            message_data = protocol.JSON.decode(data) if isinstance(data, str) else codec.decode(data)
             
             if message_data.get("type") == "chat":
+                # Only chat counts against the limits (not pings or heartbeat pongs); over-limit
+                # messages are dropped before the database is touched and the client is told
+                # once per run of dropped messages
+                limiter = ratelimit.allow_chat(user_id, room_id, "ws")
+                if limiter is not None:
+                    if not throttled:
+                        throttled = True
+                        await manager.send_to_user(user_id, {
+                            "type": "error",
+                            "message": f"Rate limit exceeded ({limiter.scope})",
+                            "timestamp": datetime.now().isoformat()
+                        })
+                    continue
+                throttled = False
+                
                 # Handle chat message
                 comment = message_data.get("comment", "")
                 target_uid = message_data.get("targetUid")
                 
                 # Create new database connection for each message (thread-safe)
-                conn = sqlite3.connect(DATABASE_PATH)
-                conn.row_factory = sqlite3.Row
+                conn = connect_db(DATABASE_PATH)
                 cursor = conn.cursor()
                 
                 # Check room membership for casual rooms
@@ -1093,8 +2273,7 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
                 
                 # Verify target user if specified
                 if target_uid:
-                    cursor.execute("SELECT uid FROM Users WHERE uid = ?", (target_uid,))
-                    if not cursor.fetchone():
+                    if not metadata.user(conn, target_uid):
                         await manager.send_to_user(user_id, {
                             "type": "error",
                             "message": "Target user not found",
@@ -1108,14 +2287,16 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
                 
                 # Save to database
                 create_time = datetime.now().isoformat()
-                cursor.execute(
-                    "INSERT INTO Chat (uid, rid, targetUid, comment, createAt) VALUES (?, ?, ?, ?, ?)",
-                    (user_id, room_id, target_uid, processed_comment, create_time)
-                )
-                conn.commit()
+                with shard_router.room(conn, room_id) as chat_conn:
+                    chat_conn.execute(
+                        "INSERT INTO Chat (uid, rid, targetUid, comment, createAt) VALUES (?, ?, ?, ?, ?)",
+                        (user_id, room_id, target_uid, processed_comment, create_time)
+                    )
+                    chat_conn.commit()
                 conn.close()
+                rollups.record_chat(room_id, create_time, bool(target_uid))
                 
-                # Broadcast message to all users in room
+                # Deliver to the room, or only to sender and target for targeted messages
                 chat_message = {
                     "type": "chat",
                     "uid": user_id,
@@ -1125,7 +2306,7 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
                     "timestamp": create_time
                 }
                 
-                await manager.broadcast_to_room(room_id, chat_message)
+                await manager.deliver_chat(room_id, chat_message)
                 
             elif message_data.get("type") == "ping":
                 # Handle ping/keepalive
@@ -1136,11 +2317,11 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
     
     except WebSocketDisconnect:
         # Handle client disconnect
-        await manager.disconnect_user(user_id)
+        await manager.disconnect_user(user_id, websocket)
     except Exception as e:
         # Handle other errors
         print(f"WebSocket error for user {user_id}: {e}")
-        await manager.disconnect_user(user_id)
+        await manager.disconnect_user(user_id, websocket)
 
 # Get connected users in a room
 @app.get("/rooms/{rid}/connected-users")
@@ -1149,8 +2330,7 @@ async def get_connected_users(rid: str, db: sqlite3.Connection = Depends(get_db)
     cursor = db.cursor()
     
     # Verify room exists
-    cursor.execute("SELECT rid FROM Room WHERE rid = ?", (rid,))
-    if not cursor.fetchone():
+    if not metadata.room(db, rid):
         raise HTTPException(status_code=404, detail="Room not found")
     
     connected_user_ids = manager.get_room_users(rid)
@@ -1178,5 +2358,12 @@ async def get_connected_users(rid: str, db: sqlite3.Connection = Depends(get_db)
     
     return users
 
+# Mount static files for emoji serving (after the routes, so /emojis/upload/... and
+# DELETE /emojis/... are not swallowed by the mount)
+app.mount("/emojis", StaticFiles(directory=EMOJI_UPLOAD_DIR), name="emojis")
+
+startup_tracker.mark("imported")
+
 if __name__ == "__main__":
-    import uvicornuvicorn.run(app, host="0.0.0.0", port=8000)
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws_per_message_deflate=True)
@@ -0,0 +1,267 @@
+import asyncio
+import gzip
+import json
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+CHAT_ARCHIVE_DIR = "chat_archive"
+
+# Messages older than this are moved out of the Chat table (days; per-room overrides in
+# ChatRetention). 0 keeps chat forever, so archival is opt-in per room: archived messages
+# leave chat search and are not recounted by a rollup rebuild.
+DEFAULT_RETENTION_DAYS = 0.0
+# Seconds between archival passes
+ARCHIVE_INTERVAL = 300.0
+# Rows read and appended to segments per chunk
+ARCHIVE_CHUNK_SIZE = 500
+# Rows deleted per transaction. Each delete also updates the ChatSearch index
+# (~40us a row), so 50 keeps the write lock to a few milliseconds.
+ARCHIVE_DELETE_BATCH = 50
+# Pause between chunks so chat writes can get the lock (seconds)
+ARCHIVE_CHUNK_PAUSE = 0.01
+
+ARCHIVE_FIELDS = ("uid", "rid", "targetUid", "comment", "createAt")
+
+# Room ids name a directory under CHAT_ARCHIVE_DIR, so only plain ids (no separators or dots) have segments
+_ROOM_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def is_room_id(rid: str) -> bool:
+    return _ROOM_ID_PATTERN.match(rid or "") is not None
+
+
+def segment_path(rid: str, day: str, base_dir: str = CHAT_ARCHIVE_DIR) -> str:
+    """Archive segment for one room and day (YYYY-MM-DD)"""
+    if not is_room_id(rid):
+        raise ValueError(f"Invalid room id: {rid!r}")
+    return os.path.join(base_dir, rid, f"{day}.jsonl.gz")
+
+
+def append_segment(path: str, rows: List[dict]):
+    """Append rows to a segment as a new gzip member (readers see one stream)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = "".join(json.dumps(row, separators=(",", ":")) + "\n" for row in rows).encode()
+    with open(path, "ab") as f:
+        f.write(gzip.compress(data))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_segment(path: str) -> List[dict]:
+    try:
+        with gzip.open(path, "rt") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def compact_segment(path: str) -> int:
+    """Rewrite a finished segment as one sorted, de-duplicated gzip member
+
+    Appends from interrupted passes can repeat rows; Chat's key (uid, rid,
+    createAt) identifies them. Returns the number of rows kept.
+    """
+    rows = {(row["uid"], row["createAt"]): row for row in read_segment(path)}
+    ordered = sorted(rows.values(), key=lambda row: row["createAt"])
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wt") as f:
+        for row in ordered:
+            f.write(json.dumps(row, separators=(",", ":")) + "\n")
+    os.replace(tmp_path, path)
+    return len(ordered)
+
+
+def room_segment_days(rid: str, base_dir: str = CHAT_ARCHIVE_DIR) -> List[str]:
+    """Archived days for a room, newest first"""
+    if not is_room_id(rid):
+        return []
+    try:
+        names = os.listdir(os.path.join(base_dir, rid))
+    except FileNotFoundError:
+        return []
+    return sorted((name[:-len(".jsonl.gz")] for name in names if name.endswith(".jsonl.gz")), reverse=True)
+
+
+def read_archived_chat(rid: str, before: Optional[str], limit: int, base_dir: str = CHAT_ARCHIVE_DIR) -> List[dict]:
+    """Newest archived messages of a room created before `before`, newest first"""
+    results: List[dict] = []
+    seen = set()
+    for day in room_segment_days(rid, base_dir):
+        if before is not None and day > before[:10]:
+            continue
+        rows = [row for row in read_segment(segment_path(rid, day, base_dir))
+                if before is None or row["createAt"] < before]
+        for row in sorted(rows, key=lambda row: row["createAt"], reverse=True):
+            key = (row["uid"], row["createAt"])
+            if key in seen:
+                continue
+            seen.add(key)
+            results.append(row)
+            if len(results) >= limit:
+                return results
+    return results
+
+
+def room_history(conn: sqlite3.Connection, rid: str, before: Optional[str], limit: int,
+                 base_dir: str = CHAT_ARCHIVE_DIR) -> List[dict]:
+    """One page of a room's chat, newest first, across the Chat table and the archive
+
+    Archived messages are always older than the ones still in Chat, so the
+    archive is only read when the table runs out before the page is full.
+    """
+    cursor = conn.cursor()
+    if before is None:
+        cursor.execute("SELECT * FROM Chat WHERE rid = ? ORDER BY createAt DESC LIMIT ?", (rid, limit))
+    else:
+        cursor.execute("SELECT * FROM Chat WHERE rid = ? AND createAt < ? ORDER BY createAt DESC LIMIT ?",
+                       (rid, before, limit))
+    page = [{field: row[field] for field in ARCHIVE_FIELDS} for row in cursor.fetchall()]
+    if len(page) < limit:
+        older_than = page[-1]["createAt"] if page else before
+        page.extend(read_archived_chat(rid, older_than, limit - len(page), base_dir))
+    return page
+
+
+def retention_days(conn: sqlite3.Connection) -> Dict[str, float]:
+    """Per-room retention overrides: {rid: days}"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT rid, retentionDays FROM ChatRetention")
+    return {row["rid"]: row["retentionDays"] for row in cursor.fetchall()}
+
+
+class ChatArchiver:
+    """Moves chat past its room's retention into per-room, per-day archive segments
+
+    Each chunk is read without a write lock, appended (and fsynced) to its
+    segments, and only then deleted from Chat by rowid in short
+    transactions, so a crash can repeat rows in a segment but never lose
+    them. Segments for days that are fully archived are compacted afterwards.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], base_dir: str = CHAT_ARCHIVE_DIR,
+                 default_retention_days: float = DEFAULT_RETENTION_DAYS, chunk_size: int = ARCHIVE_CHUNK_SIZE,
+                 connect_room: Optional[Callable[[str], sqlite3.Connection]] = None):
+        self.connect = connect
+        # Opens the database holding a room's Chat rows (its shard, when sharded)
+        self.connect_room = connect_room or (lambda rid: connect())
+        self.base_dir = base_dir
+        self.default_retention_days = default_retention_days
+        self.chunk_size = chunk_size
+        self.passes = 0
+        self.rows_archived = 0
+        self.segments_compacted = 0
+        self.max_lock_ms = 0.0
+        self.last_pass: Optional[str] = None
+        self._running = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def _archive_chunk(self, rid: str, cutoff: str, touched: set) -> int:
+        conn = self.connect_room(rid)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT rowid, uid, rid, targetUid, comment, createAt FROM Chat "
+                "WHERE rid = ? AND createAt < ? ORDER BY createAt LIMIT ?",
+                (rid, cutoff, self.chunk_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                return 0
+            by_day: Dict[str, List[dict]] = {}
+            for row in rows:
+                by_day.setdefault(row["createAt"][:10], []).append({field: row[field] for field in ARCHIVE_FIELDS})
+            for day, day_rows in by_day.items():
+                path = segment_path(rid, day, self.base_dir)
+                append_segment(path, day_rows)
+                touched.add(path)
+
+            rowids = [(row["rowid"],) for row in rows]
+            for i in range(0, len(rowids), ARCHIVE_DELETE_BATCH):
+                started = time.perf_counter()
+                cursor.executemany("DELETE FROM Chat WHERE rowid = ?", rowids[i:i + ARCHIVE_DELETE_BATCH])
+                conn.commit()
+                self.max_lock_ms = max(self.max_lock_ms, (time.perf_counter() - started) * 1000.0)
+            return len(rows)
+        finally:
+            conn.close()
+
+    def _rooms(self) -> Dict[str, str]:
+        """Cutoff createAt per room: {rid: cutoff}"""
+        conn = self.connect()
+        try:
+            overrides = retention_days(conn)
+            cursor = conn.cursor()
+            cursor.execute("SELECT rid FROM Room")
+            now = datetime.now()
+            cutoffs = {}
+            for row in cursor.fetchall():
+                if not is_room_id(row["rid"]):
+                    continue  # No archive directory can be named after it
+                days = overrides.get(row["rid"], self.default_retention_days)
+                if days > 0:
+                    cutoffs[row["rid"]] = (now - timedelta(days=days)).isoformat()
+            return cutoffs
+        finally:
+            conn.close()
+
+    async def run_once(self) -> dict:
+        """One archival pass over every room; returns rows moved per room"""
+        async with self._running:
+            moved: Dict[str, int] = {}
+            cutoffs = await asyncio.to_thread(self._rooms)
+            for rid, cutoff in cutoffs.items():
+                touched: set = set()
+                while True:
+                    count = await asyncio.to_thread(self._archive_chunk, rid, cutoff, touched)
+                    if not count:
+                        break
+                    moved[rid] = moved.get(rid, 0) + count
+                    self.rows_archived += count
+                    await asyncio.sleep(ARCHIVE_CHUNK_PAUSE)
+                # Days before the cutoff's day receive no more rows
+                for path in touched:
+                    if os.path.basename(path)[:10] < cutoff[:10]:
+                        await asyncio.to_thread(compact_segment, path)
+                        self.segments_compacted += 1
+            self.passes += 1
+            self.last_pass = datetime.now().isoformat()
+            if moved:
+                print(f"[archive] Moved {sum(moved.values())} chat messages from {len(moved)} rooms to {self.base_dir}")
+            return moved
+
+    async def run(self, interval: float = ARCHIVE_INTERVAL):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"[archive] Archival pass failed: {e}")
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float = ARCHIVE_INTERVAL):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "archive_dir": self.base_dir,
+            "default_retention_days": self.default_retention_days,
+            "chunk_size": self.chunk_size,
+            "passes": self.passes,
+            "last_pass": self.last_pass,
+            "rows_archived": self.rows_archived,
+            "segments_compacted": self.segments_compacted,
+            "max_write_lock_ms": round(self.max_lock_ms, 3)
+        }
@@ -0,0 +1,172 @@
+"""Pre-rendered, precompressed signaling assets and viewer pages
+
+Each template is rendered once per parameter set, minified, compressed
+(gzip, and brotli when installed) and kept in memory with a strong ETag per
+encoding. Serving is then a dict lookup, Accept-Encoding negotiation and a
+memory copy, or a 304 when the client already has the bytes.
+"""
+import gzip
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available
+    brotli = None
+
+# Rendered variants kept (pages are cached per stream id / stream set), least recently used evicted
+ASSET_CACHE_SIZE = 1024
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+# For URLs carrying the asset's version (?v=), whose bytes never change
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Everything else is revalidated on each use, which costs a 304 when unchanged
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+HTML_COMMENT = re.compile(r"<!--(?!\[if).*?-->", re.DOTALL)
+
+
+def minify_js(text: str) -> str:
+    """Line-level minification: indentation, blank lines and whole-line // comments
+
+    Line breaks are kept (automatic semicolon insertion depends on them),
+    and lines inside multi-line template literals are left untouched.
+    """
+    lines = []
+    in_template = False
+    for line in text.splitlines():
+        if in_template:
+            lines.append(line)
+        else:
+            stripped = line.strip()
+            if stripped and not stripped.startswith("//"):
+                lines.append(stripped)
+        if len(re.findall(r"(?<!\\)`", line)) % 2:
+            in_template = not in_template
+    return "\n".join(lines) + "\n"
+
+
+def minify_html(text: str) -> str:
+    """Drop comments, indentation and blank lines; inline scripts get minify_js()"""
+    text = HTML_COMMENT.sub("", text)
+    parts = re.split(r"(<script[^>]*>.*?</script>)", text, flags=re.DOTALL | re.IGNORECASE)
+    for i, part in enumerate(parts):
+        if i % 2:
+            opening, _, rest = part.partition(">")
+            script, _, closing = rest.rpartition("</")
+            parts[i] = f"{opening}>{minify_js(script).rstrip()}</{closing}"
+        else:
+            parts[i] = "\n".join(line.strip() for line in part.splitlines() if line.strip())
+    return "\n".join(part for part in parts if part) + "\n"
+
+
+def accepted_encodings(header: Optional[str]) -> Dict[str, float]:
+    """{coding: q} from an Accept-Encoding header"""
+    encodings = {}
+    for item in (header or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        encodings[coding.strip().lower()] = q
+    return encodings
+
+
+class Asset:
+    """One rendered asset: its bytes per content coding and their ETags"""
+    __slots__ = ("media_type", "version", "bodies", "etags")
+
+    def __init__(self, body: bytes, media_type: str):
+        self.media_type = media_type
+        # Identifies the content; used in ?v= URLs and the ETags
+        self.version = hashlib.sha256(body).hexdigest()[:16]
+        # {coding: bytes}, only codings that came out smaller
+        self.bodies: Dict[str, bytes] = {"identity": body}
+        compressed = gzip.compress(body, GZIP_LEVEL, mtime=0)
+        if len(compressed) < len(body):
+            self.bodies["gzip"] = compressed
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+            if len(compressed) < len(body):
+                self.bodies["br"] = compressed
+        # Strong validators differ per coding, since the bytes do
+        self.etags = {coding: f'"{self.version}"' if coding == "identity" else f'"{self.version}-{coding}"'
+                      for coding in self.bodies}
+
+    def negotiate(self, accept_encoding: Optional[str]) -> str:
+        accepted = accepted_encodings(accept_encoding)
+        for coding in ("br", "gzip"):
+            if coding in self.bodies and accepted.get(coding, accepted.get("*", 0.0)) > 0:
+                return coding
+        return "identity"
+
+    def response(self, request: Request, cache_control: str = REVALIDATE_CACHE_CONTROL) -> Response:
+        coding = self.negotiate(request.headers.get("accept-encoding"))
+        etag = self.etags[coding]
+        headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            if etag in tags or "*" in tags:
+                return Response(status_code=304, headers=headers)
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        return Response(content=self.bodies[coding], media_type=self.media_type, headers=headers)
+
+    def size(self) -> int:
+        return sum(len(body) for body in self.bodies.values())
+
+
+class AssetCache:
+    """Rendered templates keyed by (template, parameters)
+
+    templates is the app's Jinja2Templates; rendering uses its environment
+    directly since nothing in these templates depends on the request.
+    """
+
+    def __init__(self, templates, max_size: int = ASSET_CACHE_SIZE):
+        self.templates = templates
+        self.max_size = max_size
+        self.assets: "OrderedDict[Tuple, Asset]" = OrderedDict()
+        self.hits = 0
+        self.renders = 0
+
+    def render(self, name: str, media_type: str, **context) -> Asset:
+        key = (name, tuple(sorted(context.items())))
+        asset = self.assets.get(key)
+        if asset is not None:
+            self.assets.move_to_end(key)
+            self.hits += 1
+            return asset
+        text = self.templates.get_template(name).render(**context)
+        minify = minify_html if name.endswith(".html") else minify_js
+        asset = self.assets[key] = Asset(minify(text).encode("utf-8"), media_type)
+        self.renders += 1
+        while len(self.assets) > self.max_size:
+            self.assets.popitem(last=False)
+        return asset
+
+    def clear(self):
+        """Forget every rendering, e.g. after editing templates on a running server"""
+        self.assets.clear()
+
+    def stats(self) -> dict:
+        return {
+            "assets": len(self.assets),
+            "max_size": self.max_size,
+            "bytes": sum(asset.size() for asset in self.assets.values()),
+            "hits": self.hits,
+            "renders": self.renders,
+            "encodings": ["br", "gzip"] if brotli is not None else ["gzip"]
+        }
@@ -0,0 +1,406 @@
+"""Online snapshots of the SQLite databases, and the CLI to list, verify and restore them
+
+Snapshots are taken with SQLite's online backup API while the server keeps
+writing: the copy advances BACKUP_STEP_PAGES pages per step in a worker
+thread, pausing between steps so writers get the lock back, and a copy is
+only ever a state some commit left the database in. A commit from another
+connection between two steps restarts the copy, so under steady writes each
+retry takes bigger steps and the last attempt copies in one step (one read
+lock for the whole file, still off the event loop).
+
+Each snapshot is a directory named after its start time holding one gzipped
+copy per database file (the primary and, when sharded, every shard file)
+and a manifest.json with their sizes and SHA-256, written last. Shard files
+are copied one after another, so they are each consistent but not taken at
+the same instant.
+
+    cd backend
+    python backup.py create
+    python backup.py list
+    python backup.py verify 20261019T120000123456
+    python backup.py restore 20261019T120000123456    # with the server stopped
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import Callable, List, Optional
+
+BACKUP_DIR = "backups"
+
+# Seconds between scheduled snapshots
+BACKUP_INTERVAL = 3600.0
+# Complete snapshots kept; older ones are deleted after each new one
+BACKUP_KEEP = 24
+# Pages copied per backup step (4 KiB pages, so 1 MiB) and pause between steps (seconds)
+BACKUP_STEP_PAGES = 256
+BACKUP_STEP_PAUSE = 0.005
+# Copies restarted by concurrent commits before the rest is copied in one step;
+# each retry takes BACKUP_STEP_GROWTH times bigger steps than the last
+BACKUP_MAX_ATTEMPTS = 4
+BACKUP_STEP_GROWTH = 4
+
+MANIFEST_NAME = "manifest.json"
+PARTIAL_SUFFIX = ".partial"
+COPY_CHUNK_SIZE = 1 << 20
+
+
+class BackupRestarted(Exception):
+    """The source changed mid-copy, so SQLite started the copy over"""
+
+
+def copy_database(source_path: str, target_path: str, step_pages: int = BACKUP_STEP_PAGES,
+                  pause: float = BACKUP_STEP_PAUSE, max_attempts: int = BACKUP_MAX_ATTEMPTS) -> dict:
+    """Copy a live database to target_path with the online backup API
+
+    Returns the pages copied, attempts made and the longest single step
+    (how long the copy held its read lock at once).
+    """
+    source = sqlite3.connect(source_path, check_same_thread=False)
+    target = sqlite3.connect(target_path)
+    longest_step = 0.0
+    try:
+        for attempt in range(1, max_attempts + 1):
+            pages = step_pages * BACKUP_STEP_GROWTH ** (attempt - 1) if attempt < max_attempts else -1
+            remaining: List[int] = []
+            step_started = time.perf_counter()
+
+            def progress(status, left, total):
+                nonlocal step_started, longest_step
+                longest_step = max(longest_step, time.perf_counter() - step_started)
+                if remaining and left > remaining[-1]:
+                    raise BackupRestarted()
+                remaining.append(left)
+                time.sleep(pause)
+                step_started = time.perf_counter()
+
+            try:
+                source.backup(target, pages=pages, progress=progress)
+            except BackupRestarted:
+                continue
+            longest_step = max(longest_step, time.perf_counter() - step_started)
+            page_count = target.execute("PRAGMA page_count").fetchone()[0]
+            return {"pages": page_count, "attempts": attempt, "max_step_ms": round(longest_step * 1000.0, 3)}
+    finally:
+        target.close()
+        source.close()
+
+
+def compress_file(path: str, target_path: str) -> str:
+    """gzip path into target_path (fsynced); returns the SHA-256 of the uncompressed bytes"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as src, open(target_path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as dst:
+            while True:
+                chunk = src.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                dst.write(chunk)
+        raw.flush()
+        os.fsync(raw.fileno())
+    return digest.hexdigest()
+
+
+def decompress_file(path: str, target_path: str) -> str:
+    """gunzip path into target_path; returns the SHA-256 of what was written"""
+    digest = hashlib.sha256()
+    with gzip.open(path, "rb") as src, open(target_path, "wb") as dst:
+        while True:
+            chunk = src.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            dst.write(chunk)
+    return digest.hexdigest()
+
+
+def integrity_check(path: str) -> str:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def create_snapshot(paths: List[str], base_dir: str = BACKUP_DIR, **copy_options) -> dict:
+    """Snapshot every database in paths into a new directory under base_dir; returns its manifest"""
+    started = time.perf_counter()
+    created_at = datetime.now()
+    name = created_at.strftime("%Y%m%dT%H%M%S%f")
+    partial_dir = os.path.join(base_dir, name + PARTIAL_SUFFIX)
+    os.makedirs(partial_dir)
+    files = []
+    for path in paths:
+        file_name = os.path.basename(path)
+        copy_path = os.path.join(partial_dir, file_name)
+        copied = copy_database(path, copy_path, **copy_options)
+        sha256 = compress_file(copy_path, copy_path + ".gz")
+        files.append({
+            "name": file_name,
+            "path": path,
+            "bytes": os.path.getsize(copy_path),
+            "compressed_bytes": os.path.getsize(copy_path + ".gz"),
+            "sha256": sha256,
+            **copied
+        })
+        os.remove(copy_path)
+    manifest = {
+        "name": name,
+        "created_at": created_at.isoformat(),
+        "seconds": round(time.perf_counter() - started, 3),
+        "files": files
+    }
+    with open(os.path.join(partial_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial_dir, os.path.join(base_dir, name))
+    return manifest
+
+
+def list_snapshots(base_dir: str = BACKUP_DIR) -> List[dict]:
+    """Manifests of the complete snapshots, newest first"""
+    try:
+        names = os.listdir(base_dir)
+    except FileNotFoundError:
+        return []
+    manifests = []
+    for name in sorted(names, reverse=True):
+        if name.endswith(PARTIAL_SUFFIX):
+            continue
+        try:
+            with open(os.path.join(base_dir, name, MANIFEST_NAME)) as f:
+                manifests.append(json.load(f))
+        except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+            continue
+    return manifests
+
+
+def rotate_snapshots(base_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> List[str]:
+    """Delete all but the newest keep snapshots, and partial ones left by interrupted runs"""
+    complete = [manifest["name"] for manifest in list_snapshots(base_dir)]
+    removed = complete[keep:]
+    removed += [name for name in os.listdir(base_dir) if name.endswith(PARTIAL_SUFFIX)
+                and complete and name[:-len(PARTIAL_SUFFIX)] < complete[0]]
+    for name in removed:
+        shutil.rmtree(os.path.join(base_dir, name), ignore_errors=True)
+    return removed
+
+
+def snapshot_dir(name: str, base_dir: str = BACKUP_DIR) -> str:
+    """A snapshot's directory from its name (or a path to it)"""
+    return name if os.path.isdir(name) else os.path.join(base_dir, name)
+
+
+def read_manifest(directory: str) -> dict:
+    with open(os.path.join(directory, MANIFEST_NAME)) as f:
+        return json.load(f)
+
+
+def verify_snapshot(directory: str) -> List[str]:
+    """Decompress each file of a snapshot and check its checksum and integrity; returns the problems found"""
+    problems = []
+    for entry in read_manifest(directory)["files"]:
+        compressed = os.path.join(directory, entry["name"] + ".gz")
+        scratch = os.path.join(directory, entry["name"] + ".verify")
+        try:
+            if decompress_file(compressed, scratch) != entry["sha256"]:
+                problems.append(f"{entry['name']}: checksum mismatch")
+                continue
+            result = integrity_check(scratch)
+            if result != "ok":
+                problems.append(f"{entry['name']}: integrity_check: {result}")
+        except (OSError, EOFError, sqlite3.DatabaseError) as e:
+            problems.append(f"{entry['name']}: {e}")
+        finally:
+            if os.path.exists(scratch):
+                os.remove(scratch)
+    return problems
+
+
+def restore_snapshot(directory: str, target_dir: Optional[str] = None, keep_current: bool = True) -> List[str]:
+    """Write a snapshot's databases back to their paths (or into target_dir)
+
+    The server must be stopped: the in-memory state it rebuilds at startup
+    (bet totals, caches, indexes) would not match the restored files. Each
+    file is verified before anything is replaced and copied in with the
+    backup API, so a leftover journal of the old file cannot be replayed
+    into it. The current files are kept as <path>.pre-restore unless
+    keep_current is False. Returns the paths written.
+    """
+    problems = verify_snapshot(directory)
+    if problems:
+        raise ValueError("Snapshot failed verification: " + "; ".join(problems))
+    restored = []
+    for entry in read_manifest(directory)["files"]:
+        path = os.path.join(target_dir, entry["name"]) if target_dir else entry["path"]
+        if keep_current and os.path.exists(path):
+            copy_database(path, path + ".pre-restore", max_attempts=1)
+        scratch = path + ".restore"
+        decompress_file(os.path.join(directory, entry["name"] + ".gz"), scratch)
+        try:
+            source = sqlite3.connect(scratch)
+            target = sqlite3.connect(path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+        finally:
+            os.remove(scratch)
+        restored.append(path)
+    return restored
+
+
+class BackupScheduler:
+    """Takes a snapshot every interval and rotates old ones
+
+    The copy and compression run in a worker thread, so the event loop keeps
+    serving while a snapshot is taken.
+    """
+
+    def __init__(self, paths: Callable[[], List[str]], base_dir: str = BACKUP_DIR,
+                 keep: int = BACKUP_KEEP, step_pages: int = BACKUP_STEP_PAGES):
+        # Database files to snapshot (read each run, so a new shard layout is picked up)
+        self.paths = paths
+        self.base_dir = base_dir
+        self.keep = keep
+        self.step_pages = step_pages
+        self.snapshots_taken = 0
+        self.snapshots_removed = 0
+        self.failures = 0
+        self.last_snapshot: Optional[dict] = None
+        # Unix time the last snapshot completed
+        self.last_success: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._running = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def _snapshot(self) -> dict:
+        manifest = create_snapshot(self.paths(), self.base_dir, step_pages=self.step_pages)
+        self.snapshots_removed += len(rotate_snapshots(self.base_dir, self.keep))
+        return manifest
+
+    async def run_once(self) -> dict:
+        """Take a snapshot now; returns its manifest"""
+        async with self._running:
+            try:
+                manifest = await asyncio.to_thread(self._snapshot)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                raise
+            self.snapshots_taken += 1
+            self.last_snapshot = manifest
+            self.last_success = time.time()
+            print(f"[backup] Snapshot {manifest['name']}: {len(manifest['files'])} files, "
+                  f"{sum(entry['compressed_bytes'] for entry in manifest['files'])} bytes in {manifest['seconds']}s")
+            return manifest
+
+    async def run(self, interval: float = BACKUP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"[backup] Snapshot failed: {e}")
+
+    def start(self, interval: float = BACKUP_INTERVAL):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "backup_dir": self.base_dir,
+            "keep": self.keep,
+            "step_pages": self.step_pages,
+            "snapshots_taken": self.snapshots_taken,
+            "snapshots_removed": self.snapshots_removed,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_snapshot": self.last_snapshot,
+            "snapshots": [{"name": manifest["name"], "created_at": manifest["created_at"],
+                           "compressed_bytes": sum(entry["compressed_bytes"] for entry in manifest["files"])}
+                          for manifest in list_snapshots(self.base_dir)]
+        }
+
+
+def database_paths() -> List[str]:
+    """The primary database and, when sharded, every shard file"""
+    from db import DATABASE_PATH
+    from shards import ShardRouter
+    router = ShardRouter(DATABASE_PATH)
+    return [DATABASE_PATH] + (router.paths() if router.enabled else [])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=BACKUP_DIR, help="snapshot directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="take a snapshot of the live databases")
+    create.add_argument("--keep", type=int, default=BACKUP_KEEP)
+    commands.add_parser("list", help="list complete snapshots, newest first")
+    verify = commands.add_parser("verify", help="check a snapshot's checksums and integrity")
+    verify.add_argument("snapshot", help="snapshot name or directory")
+    restore = commands.add_parser("restore", help="restore a snapshot (stop the server first)")
+    restore.add_argument("snapshot", help="snapshot name or directory, or 'latest'")
+    restore.add_argument("--target-dir", help="write the databases here instead of their original paths")
+    restore.add_argument("--discard-current", action="store_true",
+                         help="do not keep the current files as <path>.pre-restore")
+    args = parser.parse_args(argv)
+
+    if args.command == "create":
+        manifest = create_snapshot(database_paths(), args.dir)
+        rotate_snapshots(args.dir, args.keep)
+        print(json.dumps(manifest, indent=2))
+    elif args.command == "list":
+        for manifest in list_snapshots(args.dir):
+            size = sum(entry["compressed_bytes"] for entry in manifest["files"])
+            print(f"{manifest['name']}  {manifest['created_at']}  {len(manifest['files'])} files  {size} bytes")
+    else:
+        name = args.snapshot
+        if name == "latest":
+            snapshots = list_snapshots(args.dir)
+            if not snapshots:
+                print(f"No snapshots in {args.dir}", file=sys.stderr)
+                return 1
+            name = snapshots[0]["name"]
+        directory = snapshot_dir(name, args.dir)
+        if not os.path.exists(os.path.join(directory, MANIFEST_NAME)):
+            print(f"No complete snapshot at {directory}", file=sys.stderr)
+            return 1
+        if args.command == "verify":
+            problems = verify_snapshot(directory)
+            for problem in problems:
+                print(problem, file=sys.stderr)
+            print(f"{name}: {'FAILED' if problems else 'ok'}")
+            return 1 if problems else 0
+        try:
+            restored = restore_snapshot(directory, args.target_dir, keep_current=not args.discard_current)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        for path in restored:
+            print(f"Restored {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""Signaling latency under an HTTP flood, with and without admission control
+
+One broadcaster and one viewer hold a signaling stream while --flooders
+concurrent clients hammer the REST API for --seconds (chat history pages,
+room listings, bets and chat posts). The viewer sends a ping every
+--probe-interval seconds; latency is ping -> pong over /signal. Flooders
+that get a 503 wait out its Retry-After, as well-behaved clients do. Runs
+once with admission control off and once with the default classes, and
+reports the flood's completed/shed requests and the per-class counters.
+
+    cd backend
+    python benchmarks/bench_admission.py --flooders 200 --seconds 5
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from harness import ASGIClient, Recorder, quiet, sandbox
+from run_benchmarks import create_room, create_users
+
+
+async def flood(client, args, admitted_on: bool) -> dict:
+    import admission
+    if admitted_on:
+        for name, limits in admission.CLASS_LIMITS.items():
+            admission.classes[name].configure(*limits)
+    else:
+        for traffic in admission.classes.values():
+            traffic.configure(0, 0, 0.0, 0.0)
+    before = admission.stats()
+
+    uids = await create_users(client, 20, "flooder")
+    rooms = [await create_room(client, uids[0]) for _ in range(5)]
+    for i in range(200):
+        await client.request("POST", f"/rooms/{rooms[i % len(rooms)]}/chat/{uids[i % len(uids)]}", {"comment": f"seed {i}"})
+
+    recorder = Recorder("admission_on" if admitted_on else "admission_off")
+    stream_id = f"bench_{uuid.uuid4().hex[:8]}"
+    broadcaster = await client.websocket(f"/signal/{stream_id}/broadcaster")
+    viewer = await client.websocket(f"/signal/{stream_id}/viewer")
+    statuses = {}
+    deadline = time.perf_counter() + args.seconds
+
+    async def flooder(seed: int):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            rid = rng.choice(rooms)
+            uid = rng.choice(uids)
+            pick = rng.random()
+            if pick < 0.5:
+                response = await client.request("GET", f"/rooms/{rid}/chat?limit=50")
+            elif pick < 0.7:
+                response = await client.request("GET", "/rooms")
+            elif pick < 0.9:
+                response = await client.request("POST", f"/rooms/{rid}/bet/{uid}", {"bet": 1.0})
+            else:
+                response = await client.request("POST", f"/rooms/{rid}/chat/{uid}", {"comment": "flood"})
+            statuses[str(response.status)] = statuses.get(str(response.status), 0) + 1
+            if response.status == 503:
+                await asyncio.sleep(float(response.headers.get("retry-after", "1")))
+
+    async def probe():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await viewer.send_text(json.dumps({"type": "ping"}))
+            while True:
+                frame = json.loads(await asyncio.wait_for(viewer.receive(), timeout=args.seconds + 30))
+                if frame.get("type") == "pong":
+                    break
+            recorder.record(time.perf_counter() - started)
+            await asyncio.sleep(args.probe_interval)
+
+    recorder.start()
+    try:
+        await asyncio.gather(probe(), *(flooder(seed) for seed in range(args.flooders)))
+    except asyncio.TimeoutError:
+        recorder.errors += 1
+    recorder.stop()
+    await viewer.close()
+    await broadcaster.close()
+
+    after = admission.stats()
+    classes = {}
+    for name, traffic in after.items():
+        classes[name] = {
+            "admitted": traffic["admitted"] - before[name]["admitted"],
+            "rejected": {reason: count - before[name]["rejected"][reason]
+                         for reason, count in traffic["rejected"].items()}
+        }
+    recorder.extra = {
+        "flooders": args.flooders,
+        "flood_statuses": statuses,
+        "flood_completed_per_second": round(
+            sum(count for status, count in statuses.items() if status != "503") / args.seconds, 1),
+        "classes": classes
+    }
+    return recorder.result()
+
+
+async def run(args) -> list:
+    import api
+    results = []
+    async with ASGIClient(api.app) as client:
+        for admitted_on in (False, True):
+            results.append(await flood(client, args, admitted_on))
+            # Let the loop-lag probe settle before the next run
+            await asyncio.sleep(1.0)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--flooders", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--probe-interval", type=float, default=0.02)
+    args = parser.parse_args()
+
+    with sandbox():
+        with quiet():
+            import ratelimit
+            # Measure admission control, not per-user chat limits
+            for limiter in ratelimit.limiters.values():
+                limiter.configure(float("inf"), float("inf"))
+            results = asyncio.run(run(args))
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
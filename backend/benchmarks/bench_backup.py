@@ -0,0 +1,174 @@
+"""Online snapshots under a chat write load, and a consistency check of each
+
+Seeds --seed-rows chat messages (so the database spans many backup steps),
+then --chatters clients each post numbered messages back to back over
+POST /rooms/{rid}/chat/{uid} for --seconds while the backup scheduler takes
+--snapshots snapshots. A viewer pings /health to catch event-loop stalls.
+Chat latency is reported without a snapshot running and while one runs.
+
+Every snapshot is then verified (checksums, PRAGMA integrity_check) and
+checked for consistency: each chatter's messages in it must be exactly
+1..n with no gaps (a client only posts its next message once the previous
+one committed), and the ChatSearch index must hold exactly the Chat rows,
+which its triggers update in the same transaction. The newest snapshot is
+restored into a scratch directory and compared with its manifest. Exits
+non-zero if any check fails.
+
+    cd backend
+    python benchmarks/bench_backup.py --chatters 20 --seconds 5 --snapshots 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from harness import ASGIClient, Recorder, percentile, quiet, sandbox
+from run_benchmarks import create_room, create_users
+
+
+def seed_chat(path: str, rid: str, uid: str, rows: int):
+    conn = sqlite3.connect(path)
+    try:
+        conn.executemany(
+            "INSERT INTO Chat (uid, rid, targetUid, comment, createAt) VALUES (?, ?, NULL, ?, ?)",
+            ((uid, rid, f"seed {i} " + "x" * 200, f"2000-01-01T00:00:00.{i:09d}") for i in range(rows))
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def check_snapshot(backup, directory: str, chatters: list) -> list:
+    """Consistency problems in one snapshot's primary database"""
+    problems = backup.verify_snapshot(directory)
+    if problems:
+        return problems
+    manifest = backup.read_manifest(directory)
+    entry = manifest["files"][0]
+    scratch = os.path.join(directory, entry["name"] + ".check")
+    backup.decompress_file(os.path.join(directory, entry["name"] + ".gz"), scratch)
+    conn = sqlite3.connect(scratch)
+    try:
+        for uid in chatters:
+            numbers = sorted(int(row[0].split()[1]) for row in
+                             conn.execute("SELECT comment FROM Chat WHERE uid = ?", (uid,)))
+            if numbers != list(range(1, len(numbers) + 1)):
+                problems.append(f"{manifest['name']}: chatter {uid} has gaps ({len(numbers)} messages)")
+        chat_rows = conn.execute("SELECT COUNT(*) FROM Chat").fetchone()[0]
+        indexed = conn.execute("SELECT COUNT(*) FROM ChatSearch").fetchone()[0]
+        if chat_rows != indexed:
+            problems.append(f"{manifest['name']}: {chat_rows} Chat rows but {indexed} indexed")
+    finally:
+        conn.close()
+        os.remove(scratch)
+    return problems
+
+
+async def run(args) -> dict:
+    import api
+    import backup
+    async with ASGIClient(api.app) as client:
+        owner = (await create_users(client, 1, "owner"))[0]
+        rid = await create_room(client, owner)
+        chatters = await create_users(client, args.chatters, "chatter")
+        await asyncio.to_thread(seed_chat, api.DATABASE_PATH, rid, owner, args.seed_rows)
+        # Let the loop-lag probe settle so admission control is not shedding from setup
+        await asyncio.sleep(1.0)
+
+        recorder = Recorder("backup")
+        quiet_latencies, backup_latencies, health_latencies = [], [], []
+        snapshotting = False
+        statuses = {}
+        deadline = time.perf_counter() + args.seconds
+
+        async def chatter(uid: str):
+            number = 0
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = await client.request("POST", f"/rooms/{rid}/chat/{uid}", {"comment": f"msg {number + 1}"})
+                if response.status != 200:
+                    statuses[str(response.status)] = statuses.get(str(response.status), 0) + 1
+                    await asyncio.sleep(0.01)
+                    continue
+                number += 1
+                (backup_latencies if snapshotting else quiet_latencies).append(time.perf_counter() - started)
+
+        async def probe():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                await client.request("GET", "/health")
+                health_latencies.append(time.perf_counter() - started)
+                await asyncio.sleep(0.01)
+
+        manifests = []
+
+        async def snapshots():
+            nonlocal snapshotting
+            gap = args.seconds / (args.snapshots + 1)
+            for _ in range(args.snapshots):
+                await asyncio.sleep(gap)
+                snapshotting = True
+                started = time.perf_counter()
+                manifests.append(await api.backups.run_once())
+                recorder.record(time.perf_counter() - started)
+                snapshotting = False
+
+        recorder.start()
+        await asyncio.gather(probe(), snapshots(), *(chatter(uid) for uid in chatters))
+        recorder.stop()
+
+    problems = []
+    for manifest in manifests:
+        problems += check_snapshot(backup, os.path.join(backup.BACKUP_DIR, manifest["name"]), chatters)
+    restore_dir = tempfile.mkdtemp(prefix="publicpooper_restore_")
+    latest = manifests[-1]
+    restored = backup.restore_snapshot(os.path.join(backup.BACKUP_DIR, latest["name"]), restore_dir)
+    if backup.integrity_check(restored[0]) != "ok" or os.path.getsize(restored[0]) != latest["files"][0]["bytes"]:
+        problems.append(f"{latest['name']}: restored copy does not match its manifest")
+    recorder.errors += len(problems)
+
+    recorder.extra = {
+        "chatters": args.chatters,
+        "messages": len(quiet_latencies) + len(backup_latencies),
+        "rejected_statuses": statuses,
+        "snapshots": [{key: manifest[key] for key in ("name", "seconds")} | {
+            "bytes": manifest["files"][0]["bytes"],
+            "compressed_bytes": manifest["files"][0]["compressed_bytes"],
+            "attempts": manifest["files"][0]["attempts"],
+            "max_step_ms": manifest["files"][0]["max_step_ms"]
+        } for manifest in manifests],
+        "chat_p50_ms": round(percentile(quiet_latencies, 50) * 1000.0, 3),
+        "chat_p99_ms": round(percentile(quiet_latencies, 99) * 1000.0, 3),
+        "chat_during_backup_p50_ms": round(percentile(backup_latencies, 50) * 1000.0, 3),
+        "chat_during_backup_p99_ms": round(percentile(backup_latencies, 99) * 1000.0, 3),
+        "health_max_ms": round(max(health_latencies, default=0.0) * 1000.0, 3),
+        "problems": problems
+    }
+    return recorder.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chatters", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--snapshots", type=int, default=3)
+    parser.add_argument("--seed-rows", type=int, default=50000)
+    args = parser.parse_args()
+
+    with sandbox():
+        with quiet():
+            import ratelimit
+            # Measure the backup, not per-user chat limits
+            for limiter in ratelimit.limiters.values():
+                limiter.configure(float("inf"), float("inf"))
+            result = asyncio.run(run(args))
+    print(json.dumps(result))
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
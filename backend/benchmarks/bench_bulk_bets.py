@@ -0,0 +1,97 @@
+"""Load test for POST /bets/bulk
+
+Runs the API in-process against a throwaway database and offers bets at a
+fixed rate in bulk batches, then reports the sustained bets per second and
+per-request latency as JSON.
+
+    cd backend
+    python benchmarks/bench_bulk_bets.py --rate 10000 --seconds 5 --batch 500
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from harness import ASGIClient, Recorder, quiet, sandbox
+from run_benchmarks import create_room, create_users
+
+
+async def run(app, args) -> dict:
+    recorder = Recorder("bulk_bets_load")
+    async with ASGIClient(app) as client:
+        users = await create_users(client, args.users, "bettor")
+        rooms = [await create_room(client, users[i % len(users)]) for i in range(args.rooms)]
+
+        accepted = duplicates = offered = 0
+        sent_keys = []
+        duplicate_every = max(1, int(1 / args.duplicates)) if args.duplicates > 0 else 0
+        interval = args.batch / args.rate
+        recorder.start()
+        next_send = recorder.started
+        while time.perf_counter() - recorder.started < args.seconds:
+            bets = []
+            for i in range(args.batch):
+                n = offered + i
+                if sent_keys and duplicate_every and n % duplicate_every == 0:
+                    key = sent_keys[n % len(sent_keys)]  # Simulated client retry
+                else:
+                    key = uuid.uuid4().hex
+                bets.append({
+                    "uid": users[n % len(users)],
+                    "rid": rooms[n % len(rooms)],
+                    "bet": float(n % 100 + 1),
+                    "idempotencyKey": key
+                })
+            sent_keys.extend(bet["idempotencyKey"] for bet in bets[:10])
+
+            started = time.perf_counter()
+            response = await client.request("POST", "/bets/bulk", {"bets": bets})
+            recorder.record(time.perf_counter() - started)
+            offered += len(bets)
+            if response.status == 200:
+                body = response.json()
+                accepted += body["accepted"]
+                duplicates += body["duplicates"]
+            else:
+                recorder.errors += 1
+
+            # Pace to the target rate; fall behind if the server can't keep up
+            next_send += interval
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        recorder.stop()
+
+    elapsed = recorder.finished - recorder.started
+    recorder.extra = {
+        "target_rate": args.rate,
+        "batch": args.batch,
+        "bets_offered": offered,
+        "bets_accepted": accepted,
+        "bets_duplicate": duplicates,
+        "bets_per_second": round(offered / elapsed, 1),
+        "met_target": offered / elapsed >= args.rate * 0.95
+    }
+    return recorder.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=int, default=10000, help="target bets per second")
+    parser.add_argument("--seconds", type=float, default=5.0, help="test duration")
+    parser.add_argument("--batch", type=int, default=500, help="bets per bulk request")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--duplicates", type=float, default=0.05, help="fraction of retried idempotency keys")
+    args = parser.parse_args()
+
+    with sandbox():
+        with quiet():
+            import api
+            result = asyncio.run(run(api.app, args))
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Chat fan-out cost with heavy @-mention traffic, directed vs room-wide delivery
+
+R rooms x N chatters on /ws/{room_id}/{user_id}; every chatter sends M
+messages, a share of them (--mention-ratio) with a targetUid naming another
+chatter in the room. Runs once with DIRECTED_CHAT_DELIVERY on (targeted
+messages go to sender and target only) and once with it off (every message
+goes to the whole room, as before). Latency is send -> own message received;
+frames_delivered counts frames received over all sockets.
+
+    cd backend
+    python benchmarks/bench_fanout.py --rooms 4 --chatters 50 --messages 20 --mention-ratio 0.8
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from harness import ASGIClient, Recorder, quiet, sandbox
+from run_benchmarks import create_room, create_users
+
+
+async def fanout(client, args, directed: bool) -> dict:
+    import api
+    api.DIRECTED_CHAT_DELIVERY = directed
+    recorder = Recorder("fanout_directed" if directed else "fanout_broadcast")
+    rooms = []
+    for _ in range(args.rooms):
+        uids = await create_users(client, args.chatters, "chatter")
+        rooms.append((await create_room(client, uids[0]), uids))
+
+    sockets = []
+    for rid, uids in rooms:
+        for uid in uids:
+            sockets.append((rid, uid, uids, await client.websocket(f"/ws/{rid}/{uid}")))
+
+    delivered = 0
+    pending = {}
+    done = asyncio.Event()
+    expected = len(sockets) * args.messages
+
+    async def reader(uid, ws):
+        nonlocal delivered
+        while True:
+            try:
+                frame = json.loads(await ws.receive())
+            except Exception:
+                return
+            if frame.get("type") != "chat":
+                continue
+            delivered += 1
+            sent_at = pending.pop(frame.get("comment"), None) if frame.get("uid") == uid else None
+            if sent_at is not None:
+                recorder.record(time.perf_counter() - sent_at)
+                if len(recorder.latencies) >= expected:
+                    done.set()
+
+    async def writer(uid, uids, ws, rng):
+        others = [other for other in uids if other != uid]
+        for _ in range(args.messages):
+            token = uuid.uuid4().hex
+            target = rng.choice(others) if others and rng.random() < args.mention_ratio else None
+            pending[token] = time.perf_counter()
+            await ws.send_text(json.dumps({"type": "chat", "comment": token, "targetUid": target}))
+            await asyncio.sleep(0)
+
+    readers = [asyncio.create_task(reader(uid, ws)) for _, uid, _, ws in sockets]
+    # Let the join notifications settle before measuring
+    await asyncio.sleep(0.1)
+    delivered = 0
+    rng = random.Random(args.seed)
+    recorder.start()
+    await asyncio.gather(*(writer(uid, uids, ws, random.Random(rng.random())) for _, uid, uids, ws in sockets))
+    try:
+        await asyncio.wait_for(done.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        recorder.errors = len(pending)
+    recorder.stop()
+
+    for _, _, _, ws in sockets:
+        await ws.close()
+    for task in readers:
+        task.cancel()
+    elapsed = max(recorder.finished - recorder.started, 1e-9)
+    recorder.extra = {
+        "rooms": args.rooms, "chatters_per_room": args.chatters, "messages_per_chatter": args.messages,
+        "mention_ratio": args.mention_ratio,
+        "frames_delivered": delivered,
+        "frames_per_message": round(delivered / max(expected, 1), 2),
+        "frames_per_second": round(delivered / elapsed, 1)
+    }
+    return recorder.result()
+
+
+async def run(args) -> list:
+    import api
+    results = []
+    async with ASGIClient(api.app) as client:
+        for directed in (False, True):
+            results.append(await fanout(client, args, directed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=4)
+    parser.add_argument("--chatters", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--mention-ratio", type=float, default=0.8, help="share of messages with a targetUid")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    with sandbox():
+        with quiet():
+            import ratelimit
+            # Measure fan-out, not ingress limits
+            for limiter in ratelimit.limiters.values():
+                limiter.configure(float("inf"), float("inf"))
+            results = asyncio.run(run(args))
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Wire-size and CPU cost of the WebSocket encodings
+
+Encodes a representative mix of chat, presence, pot and signaling messages
+with JSON (pp.json.v1) and the compact MessagePack encoding (pp.msgpack.v1),
+each with and without per-message deflate, and reports bytes and encode/decode
+microseconds per message as JSON.
+
+    cd backend
+    python benchmarks/bench_protocol.py --messages 20000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import zlib
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol  # noqa: E402
+
+
+def sample_messages(count: int) -> list:
+    now = datetime.now().isoformat()
+    candidate = {"candidate": "candidate:842163049 1 udp 1677729535 203.0.113.7 54321 typ srflx raddr 0.0.0.0 rport 0 "
+                              "generation 0 ufrag sXk2 network-cost 999",
+                 "sdpMid": "0", "sdpMLineIndex": 0}
+    templates = [
+        {"type": "chat", "uid": "user-3f2a", "rid": "room-81c0", "targetUid": None,
+         "comment": "that was a great play :fire:", "timestamp": now},
+        {"type": "user_joined", "user_id": "user-3f2a", "message": "User user-3f2a joined the room", "timestamp": now},
+        {"type": "pot_update", "rid": "room-81c0", "total": 1250, "count": 37, "bettors": 12, "timestamp": now},
+        {"type": "ice-candidate", "candidate": candidate, "viewerId": 4},
+        {"type": "pong", "timestamp": now},
+    ]
+    return [templates[i % len(templates)] for i in range(count)]
+
+
+def deflate(payload) -> bytes:
+    """Raw-deflate one frame the way permessage-deflate does (no context takeover)"""
+    if isinstance(payload, str):
+        payload = payload.encode()
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)[:-4]
+
+
+def measure(codec, messages: list, compress: bool) -> dict:
+    started = time.perf_counter()
+    encoded = [codec.encode(message) for message in messages]
+    encode_seconds = time.perf_counter() - started
+
+    raw_bytes = sum(len(payload.encode() if isinstance(payload, str) else payload) for payload in encoded)
+    wire_bytes = raw_bytes
+    compress_seconds = 0.0
+    if compress:
+        started = time.perf_counter()
+        wire_bytes = sum(len(deflate(payload)) for payload in encoded)
+        compress_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for payload in encoded:
+        codec.decode(payload)
+    decode_seconds = time.perf_counter() - started
+
+    count = len(messages)
+    return {
+        "encoding": codec.name + ("+deflate" if compress else ""),
+        "bytes_per_message": round(wire_bytes / count, 1),
+        "encode_us": round((encode_seconds + compress_seconds) / count * 1e6, 2),
+        "decode_us": round(decode_seconds / count * 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+
+    if protocol.COMPACT is None:
+        sys.exit("msgpack is not installed; pip install -r requirements.txt")
+
+    messages = sample_messages(args.messages)
+    results = [measure(codec, messages, compress)
+               for codec in (protocol.JSON, protocol.COMPACT) for compress in (False, True)]
+    baseline = results[0]["bytes_per_message"]
+    for result in results:
+        result["size_vs_json"] = round(result["bytes_per_message"] / baseline, 3)
+    print(json.dumps({"messages": args.messages, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Recording indexer and segment serving against fixture HLS output
+
+Writes SRS-style fixture segments ({stream}-{seq}.ts, written as .tmp and
+renamed, plus a rolling {stream}.m3u8) into a scratch HLS directory, points
+the API's recording indexer at it, and reports how long indexing takes, then
+fetches playlists and random byte ranges of recorded segments, checking every
+byte against the fixture. Pass --hls-dir to index real SRS output instead.
+
+    cd backend
+    python benchmarks/bench_recordings.py --streams 4 --segments 60 --segment-kb 512
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+from harness import ASGIClient, Recorder, quiet, sandbox
+
+TS_PACKET_SIZE = 188
+HLS_WINDOW = 6
+
+
+def fixture_segment(stream: str, seq: int, size: int) -> bytes:
+    """Deterministic MPEG-TS-shaped bytes: 188-byte packets, each a sync byte and its own label"""
+    return b"".join(b"\x47" + f"{stream}-{seq}-{i}".encode().ljust(TS_PACKET_SIZE - 1, b".")
+                    for i in range(max(1, size // TS_PACKET_SIZE)))
+
+
+def write_fixture_segments(hls_dir: str, stream: str, count: int, size: int, duration: float = 2.0,
+                           start_seq: int = 0, mtime_start: float = None) -> dict:
+    """Write count segments the way SRS does; returns {seq: bytes}"""
+    app_dir = os.path.join(hls_dir, "live")
+    os.makedirs(app_dir, exist_ok=True)
+    written = {}
+    if mtime_start is None:
+        # Far enough back that the session has ended by the time it is indexed
+        mtime_start = time.time() - count * duration - 3600
+    for i in range(count):
+        seq = start_seq + i
+        data = fixture_segment(stream, seq, size)
+        path = os.path.join(app_dir, f"{stream}-{seq}.ts")
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        mtime = mtime_start + i * duration
+        os.utime(path, (mtime, mtime))
+        written[seq] = data
+    window = range(max(start_seq, start_seq + count - HLS_WINDOW), start_seq + count)
+    with open(os.path.join(app_dir, f"{stream}.m3u8"), "w") as f:
+        f.write(f"#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-MEDIA-SEQUENCE:{window.start}\n"
+                f"#EXT-X-TARGETDURATION:{int(duration) + 1}\n")
+        for seq in window:
+            f.write(f"#EXTINF:{duration:.3f}, no desc\n{stream}-{seq}.ts\n")
+    return written
+
+
+async def run(api, args) -> dict:
+    fixtures = {}
+    hls_dir = args.hls_dir or os.path.abspath("hls_fixtures")
+    if not args.hls_dir:
+        for n in range(args.streams):
+            fixtures[f"stream{n}"] = write_fixture_segments(hls_dir, f"stream{n}", args.segments, args.segment_kb * 1024)
+
+    recorder = Recorder("recordings")
+    async with ASGIClient(api.app) as client:
+        # Scan explicitly so it can be timed
+        await api.recording_indexer.stop()
+        api.recording_indexer.hls_dir = hls_dir
+        started = time.perf_counter()
+        indexed = await api.recording_indexer.run_once()
+        index_seconds = time.perf_counter() - started
+        # A second scan of the same files must find nothing new
+        rescanned = await api.recording_indexer.run_once()
+
+        sessions = (await client.request("GET", "/recordings?limit=500")).json()
+        for session in sessions:
+            response = await client.request("GET", session["playlist"])
+            if response.status != 200 or "#EXT-X-ENDLIST" not in response.body.decode():
+                recorder.errors += 1
+
+        served = 0
+        rng = random.Random(0)
+        recorder.start()
+        for _ in range(args.ranges if sessions else 0):
+            session = rng.choice(sessions)
+            seq = rng.randrange(args.segments)
+            size = args.segment_kb * 1024 // TS_PACKET_SIZE * TS_PACKET_SIZE
+            start = rng.randrange(size)
+            end = min(size - 1, start + rng.randrange(1, args.range_kb * 1024))
+            began = time.perf_counter()
+            response = await client.request("GET", f"/recordings/{session['sid']}/{seq}.ts",
+                                            headers={"Range": f"bytes={start}-{end}"})
+            recorder.record(time.perf_counter() - began)
+            expected = fixtures.get(session["uid"], {}).get(seq)
+            if response.status != 206 or (expected is not None and response.body != expected[start:end + 1]):
+                recorder.errors += 1
+            served += len(response.body)
+        recorder.stop()
+
+    recorder.extra = {
+        "segments_indexed": indexed,
+        "rescan_indexed": rescanned,
+        "index_ms": round(index_seconds * 1000.0, 3),
+        "segments_per_second": round(indexed / max(index_seconds, 1e-9), 1),
+        "sessions": len(sessions),
+        "bytes_served": served,
+        "mb_per_second": round(served / max(recorder.finished - recorder.started, 1e-9) / 1e6, 1)
+    }
+    return recorder.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hls-dir", help="index this HLS output directory instead of generated fixtures")
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--segments", type=int, default=60, help="segments per stream")
+    parser.add_argument("--segment-kb", type=int, default=512)
+    parser.add_argument("--ranges", type=int, default=500, help="byte-range requests to time")
+    parser.add_argument("--range-kb", type=int, default=256, help="largest range requested")
+    args = parser.parse_args()
+
+    with sandbox():
+        with quiet():
+            import api
+            result = asyncio.run(run(api, args))
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Bytes per idle chat connection in the connection registry
+
+Registers --connections idle connections spread over --rooms rooms, once in
+the previous layout (a {room: {user: websocket}} dict plus a dict per user)
+and once in connections.ConnectionRegistry, and reports the bytes each
+allocated per connection (tracemalloc). Room and user ids are built fresh per
+connection, as they are when parsed from each socket's URL. The websockets
+themselves are placeholders allocated beforehand, so only registry overhead
+is counted.
+
+Then opens --sockets real idle chat sockets in-process and reports the
+registry's own view from GET /debug/registry. Those figures include the
+sockets' Starlette and harness objects, so they are an upper bound.
+
+    cd backend
+    python benchmarks/bench_registry.py --connections 100000 --rooms 1000 --sockets 2000
+"""
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+import uuid
+
+from harness import ASGIClient, Recorder, quiet, rss_bytes, sandbox
+from run_benchmarks import create_room, create_users
+
+
+def fresh(text: str) -> str:
+    """An equal but distinct string object, like one parsed out of a request path"""
+    return "".join(list(text))
+
+
+def legacy_layout(entries, codec) -> dict:
+    active_connections = {}
+    user_connections = {}
+    for user_id, room_id, websocket in entries:
+        user_id, room_id = fresh(user_id), fresh(room_id)
+        if room_id not in active_connections:
+            active_connections[room_id] = {}
+        active_connections[room_id][user_id] = websocket
+        user_connections[user_id] = {"room_id": room_id, "websocket": websocket, "codec": codec}
+    return {"active_connections": active_connections, "user_connections": user_connections}
+
+
+def compact_layout(entries, codec):
+    from connections import ConnectionRegistry
+    registry = ConnectionRegistry()
+    for user_id, room_id, websocket in entries:
+        registry.add(fresh(user_id), fresh(room_id), websocket, codec)
+    return registry
+
+
+def measure(build, entries, codec) -> dict:
+    tracemalloc.start()
+    started = time.perf_counter()
+    layout = build(entries, codec)
+    seconds = time.perf_counter() - started
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {"bytes": allocated, "bytes_per_connection": round(allocated / len(entries), 1),
+              "build_seconds": round(seconds, 3)}
+    del layout
+    return result
+
+
+async def idle_sockets(count: int) -> dict:
+    import api
+    async with ASGIClient(api.app) as client:
+        owner = (await create_users(client, 1, "owner"))[0]
+        rooms = [await create_room(client, owner) for _ in range(max(1, count // 100))]
+        uids = await create_users(client, count, "idle")
+        rss_before = rss_bytes()
+        sockets = []
+        for index, uid in enumerate(uids):
+            ws = await client.websocket(f"/ws/{rooms[index % len(rooms)]}/{uid}")
+            sockets.append(ws)
+        # Let the join notifications drain
+        await asyncio.sleep(0.5)
+        rss_after = rss_bytes()
+        registry = (await client.request("GET", "/debug/registry")).json()
+        for ws in sockets:
+            await ws.close()
+    return {
+        "sockets": count,
+        "rss_per_socket": round((rss_after - rss_before) / max(count, 1), 1),
+        "registry": registry["chat"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=100000)
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--sockets", type=int, default=2000, help="real in-process sockets (0 to skip)")
+    args = parser.parse_args()
+
+    with sandbox():
+        with quiet():
+            import protocol
+            room_ids = [str(uuid.uuid4()) for _ in range(args.rooms)]
+            entries = [(str(uuid.uuid4()), room_ids[i % len(room_ids)], object()) for i in range(args.connections)]
+            recorder = Recorder("registry")
+            recorder.start()
+            legacy = measure(legacy_layout, entries, protocol.JSON)
+            compact = measure(compact_layout, entries, protocol.JSON)
+            recorder.stop()
+            live = asyncio.run(idle_sockets(args.sockets)) if args.sockets else {}
+
+    recorder.extra = {
+        "connections": args.connections,
+        "rooms": args.rooms,
+        "legacy": legacy,
+        "compact": compact,
+        "saved_per_connection": round(legacy["bytes_per_connection"] - compact["bytes_per_connection"], 1),
+        "live": live
+    }
+    print(json.dumps(recorder.result()))
+
+
+if __name__ == "__main__":
+    main()
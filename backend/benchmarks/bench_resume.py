@@ -0,0 +1,127 @@
+"""Reconnect storm: resume_from replay against a full history reload
+
+N listeners join a room, note the seq and epoch from their "sync" frame and
+drop. While they are away M chat messages are posted. Then all of them
+reconnect at once, first with ?resume_from= (latency = connect to "sync",
+the missed frames replayed before it), then the way a client without
+sequence numbers does: a plain connect plus GET /rooms/{rid}/chat. Reports
+both latencies and the frames and bytes each approach moves.
+
+    cd backend
+    python benchmarks/bench_resume.py --clients 200 --messages 50
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from harness import ASGIClient, Recorder, percentile, quiet, sandbox
+from run_benchmarks import create_room, create_users
+
+
+async def connect_until_sync(client, path: str):
+    """(socket, sync frame, frames before it, bytes received)"""
+    ws = await client.websocket(path)
+    frames = 0
+    received = 0
+    while True:
+        raw = await ws.receive()
+        received += len(raw)
+        frame = json.loads(raw)
+        if frame.get("type") == "sync":
+            return ws, frame, frames, received
+        frames += 1
+
+
+async def storm(client, args):
+    senders = await create_users(client, 1, "sender")
+    listeners = await create_users(client, args.clients, "listener")
+    rid = await create_room(client, senders[0], user_limit=args.clients + 1)
+
+    positions = {}
+    for uid in listeners:
+        ws, sync, _, _ = await connect_until_sync(client, f"/ws/{rid}/{uid}")
+        positions[uid] = (sync["seq"], sync["epoch"])
+        await ws.close()
+
+    for i in range(args.messages):
+        await client.request("POST", f"/rooms/{rid}/chat/{senders[0]}", {"comment": f"missed message {i}"})
+
+    recorder = Recorder("resume")
+    replayed = []
+    replay_bytes = 0
+
+    async def resume(uid):
+        nonlocal replay_bytes
+        seq, epoch = positions[uid]
+        started = time.perf_counter()
+        ws, sync, frames, received = await connect_until_sync(client, f"/ws/{rid}/{uid}?resume_from={seq}&epoch={epoch}")
+        recorder.record(time.perf_counter() - started)
+        if not sync["complete"] or frames < args.messages:
+            recorder.errors += 1
+        replayed.append(frames)
+        replay_bytes += received
+        return ws
+
+    recorder.start()
+    sockets = await asyncio.gather(*(resume(uid) for uid in listeners))
+    recorder.stop()
+    await asyncio.gather(*(ws.close() for ws in sockets))
+
+    reload_latencies = []
+    reload_bytes = 0
+
+    async def reload(uid):
+        nonlocal reload_bytes
+        started = time.perf_counter()
+        ws, _, _, received = await connect_until_sync(client, f"/ws/{rid}/{uid}")
+        response = await client.request("GET", f"/rooms/{rid}/chat?limit={args.history}")
+        reload_latencies.append(time.perf_counter() - started)
+        reload_bytes += received + len(response.body)
+        return ws
+
+    reload_started = time.perf_counter()
+    sockets = await asyncio.gather(*(reload(uid) for uid in listeners))
+    reload_seconds = time.perf_counter() - reload_started
+    await asyncio.gather(*(ws.close() for ws in sockets))
+
+    stats = (await client.request("GET", "/admin/replay")).json()
+    recorder.extra = {
+        "clients": args.clients,
+        "missed_messages": args.messages,
+        "replayed_frames_per_client": round(sum(replayed) / max(len(replayed), 1), 1),
+        "replay_bytes": replay_bytes,
+        "gaps": stats["gaps"],
+        "reload_seconds": round(reload_seconds, 3),
+        "reload_p50_ms": round(percentile(reload_latencies, 50) * 1000, 3),
+        "reload_p99_ms": round(percentile(reload_latencies, 99) * 1000, 3),
+        "reload_bytes": reload_bytes
+    }
+    return recorder.result()
+
+
+async def run(args) -> dict:
+    import api
+    async with ASGIClient(api.app) as client:
+        return await storm(client, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=50, help="chat messages posted while the clients are away")
+    parser.add_argument("--history", type=int, default=50, help="page size of the history reload")
+    args = parser.parse_args()
+
+    with sandbox():
+        with quiet():
+            import ratelimit
+            # One sender posts every missed message; lift its limits
+            for limiter in ratelimit.limiters.values():
+                limiter.configure(float("inf"), float("inf"))
+            result = asyncio.run(run(args))
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Chat/Bet write throughput against the shard count
+
+Concurrent writer threads (standing in for server workers) each commit chat
+messages and bets one row per transaction, the way the API writes them, to
+rooms spread over the shard layout. Every shard count runs against a fresh
+database; 0 is the unsharded layout (everything in the primary file). Reports
+rows per second and commit latency per shard count, and checks that every
+row landed in the file its room routes to.
+
+    cd backend
+    python benchmarks/bench_shards.py --shards 0,1,2,4,8 --writers 8 --seconds 5
+"""
+import argparse
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from harness import Recorder, quiet, sandbox
+
+
+def writer(router, rids, deadline: float, seed: int, latencies: list, counts: dict):
+    """Write until deadline, keeping one connection per file"""
+    rng = random.Random(seed)
+    connections = {}
+    uid = f"writer{seed}"
+    errors = 0
+    try:
+        while time.perf_counter() < deadline:
+            rid = rng.choice(rids)
+            path = router.path_for(rid)
+            conn = connections.get(path)
+            if conn is None:
+                conn = connections[path] = router.connect(rid, timeout=30)
+            now = time.time()
+            started = time.perf_counter()
+            try:
+                if rng.random() < 0.5:
+                    conn.execute("INSERT INTO Chat (uid, rid, targetUid, comment, createAt) VALUES (?, ?, ?, ?, ?)",
+                                 (uid, rid, None, "hello " * rng.randint(1, 20), f"{now:.9f}-{uuid.uuid4().hex}"))
+                else:
+                    conn.execute("INSERT INTO Bet (uid, rid, bet, createAt) VALUES (?, ?, ?, ?)",
+                                 (uid, rid, rng.uniform(1, 100), f"{now:.9f}-{uuid.uuid4().hex}"))
+                conn.commit()
+            except sqlite3.OperationalError:
+                conn.rollback()
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+    finally:
+        for conn in connections.values():
+            conn.close()
+        counts[seed] = errors
+
+
+def misplaced_rows(router) -> int:
+    """Rows stored in a file other than the one their room routes to"""
+    misplaced = 0
+    for path in router.paths():
+        conn = sqlite3.connect(path)
+        try:
+            for table in ("Chat", "Bet"):
+                for (rid,) in conn.execute(f"SELECT DISTINCT rid FROM {table}"):
+                    if router.path_for(rid) != path:
+                        misplaced += 1
+        finally:
+            conn.close()
+    return misplaced
+
+
+def run(shard_count: int, args) -> dict:
+    import db
+    from shards import ShardRouter
+
+    with quiet():
+        db.init_database()
+    router = ShardRouter(db.DATABASE_PATH, shard_count)
+    router.init()
+    rids = [str(uuid.uuid4()) for _ in range(args.rooms)]
+
+    recorder = Recorder(f"shards_{shard_count}")
+    per_thread = [[] for _ in range(args.writers)]
+    errors: dict = {}
+    recorder.start()
+    deadline = recorder.started + args.seconds
+    threads = [threading.Thread(target=writer, args=(router, rids, deadline, seed, per_thread[seed], errors))
+               for seed in range(args.writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recorder.stop()
+    for latencies in per_thread:
+        recorder.latencies.extend(latencies)
+    recorder.errors = sum(errors.values())
+
+    rows = 0
+    for path in router.paths():
+        conn = sqlite3.connect(path)
+        try:
+            rows += sum(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ("Chat", "Bet"))
+        finally:
+            conn.close()
+    if rows != len(recorder.latencies):
+        recorder.errors += abs(rows - len(recorder.latencies))
+    recorder.errors += misplaced_rows(router)
+    recorder.extra = {"shard_count": shard_count, "writers": args.writers, "rooms": args.rooms, "rows": rows}
+    return recorder.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", default="0,1,2,4,8", help="comma-separated shard counts (0 = unsharded)")
+    parser.add_argument("--writers", type=int, default=8, help="concurrent writer threads")
+    parser.add_argument("--rooms", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=5.0, help="write time per shard count")
+    args = parser.parse_args()
+
+    for shard_count in (int(count) for count in args.shards.split(",")):
+        with sandbox():
+            result = run(shard_count, args)
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
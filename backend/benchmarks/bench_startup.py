@@ -0,0 +1,130 @@
+"""Worker startup time: process spawn to first served request, and to ready
+
+Seeds a scratch database, then repeatedly starts a fresh uvicorn worker on it
+and polls until /health answers (first served request) and until /ready
+returns 200 (migrated, aggregates rebuilt, caches prewarmed). Latencies in
+the report are spawn-to-first-request per run; ready_* fields cover
+spawn-to-ready, and phases are the worker's own timings from /ready.
+
+    cd backend
+    python benchmarks/bench_startup.py --runs 5 --users 5000 --rooms 1000 --emojis 200
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime
+
+from harness import BACKEND_DIR, Recorder, percentile, quiet, sandbox
+
+
+def seed(users: int, rooms: int, emojis: int):
+    """Fill the scratch database directly (no server needed)"""
+    import db
+    with quiet():
+        db.init_database()
+    conn = db.connect()
+    now = datetime.now().isoformat()
+    uids = [str(uuid.uuid4()) for _ in range(users)]
+    conn.executemany("INSERT INTO Users (uid, uname, email, type, createAt) VALUES (?, ?, ?, ?, ?)",
+                     [(uid, f"user{i}", f"user{i}@bench.local", "premium" if i % 10 == 0 else "normal", now)
+                      for i, uid in enumerate(uids)])
+    rids = [str(uuid.uuid4()) for _ in range(rooms)]
+    conn.executemany("INSERT INTO Room (rid, rname, user_limit, type, duration, createAt) VALUES (?, ?, ?, ?, ?, ?)",
+                     [(rid, f"room{i}", 50, "competitive", 86400, now) for i, rid in enumerate(rids)])
+    if rids:
+        conn.executemany("INSERT OR IGNORE INTO RoomUser (uid, rid, joinAt, duration) VALUES (?, ?, ?, 0)",
+                         [(uid, rids[i % len(rids)], now) for i, uid in enumerate(uids)])
+    conn.executemany("INSERT INTO Emoji (eid, name, filename, uploadedBy, isPremium, createAt) VALUES (?, ?, ?, ?, ?, ?)",
+                     [(str(uuid.uuid4()), f"emoji{i}", f"emoji{i}.png", uids[0] if uids else None, i % 2, now)
+                      for i in range(emojis)])
+    conn.commit()
+    conn.close()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get(url: str):
+    """(status, body) or None while the server is not accepting connections"""
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return None
+
+
+def start_once(timeout: float) -> dict:
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        first_request = ready = None
+        phases = {}
+        while time.perf_counter() - started < timeout:
+            if first_request is None:
+                if get(f"http://127.0.0.1:{port}/health") is not None:
+                    first_request = time.perf_counter() - started
+            else:
+                status, body = get(f"http://127.0.0.1:{port}/ready") or (None, b"")
+                if status == 200:
+                    ready = time.perf_counter() - started
+                    phases = json.loads(body)
+                    break
+            time.sleep(0.002)
+        return {"first_request": first_request, "ready": ready, "status": phases}
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--emojis", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=60.0, help="give up on a run after this many seconds")
+    args = parser.parse_args()
+
+    with sandbox():
+        seed(args.users, args.rooms, args.emojis)
+        recorder = Recorder("startup")
+        ready_times = []
+        last_status = {}
+        recorder.start()
+        for _ in range(args.runs):
+            run = start_once(args.timeout)
+            if run["first_request"] is None or run["ready"] is None:
+                recorder.errors += 1
+                continue
+            recorder.record(run["first_request"])
+            ready_times.append(run["ready"])
+            last_status = run["status"]
+        recorder.stop()
+
+    recorder.extra = {
+        "ready_p50_ms": round(percentile(ready_times, 50) * 1000, 3),
+        "ready_max_ms": round(max(ready_times, default=0.0) * 1000, 3),
+        "phases": last_status.get("phases", {}),
+        "prewarmed": last_status.get("prewarmed", {})
+    }
+    print(json.dumps(recorder.result()))
+
+
+if __name__ == "__main__":
+    main()
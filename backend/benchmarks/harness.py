@@ -0,0 +1,327 @@
+"""Shared pieces of the benchmark suite
+
+- sandbox(): run the API from a scratch directory with a fresh database
+- ASGIClient: drives the FastAPI app in-process over raw ASGI (HTTP and
+  WebSocket), so thousands of concurrent synthetic users share one event
+  loop without any extra client dependencies
+- LiveClient: same interface against a running uvicorn (--url)
+- Recorder: throughput, latency percentiles and memory per scenario
+"""
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from typing import List, Optional, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux), falling back to peak RSS"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextlib.contextmanager
+def sandbox():
+    """Chdir into a scratch copy of the backend's runtime files and import api there"""
+    workdir = tempfile.mkdtemp(prefix="publicpooper_bench_")
+    shutil.copy(os.path.join(BACKEND_DIR, "schema.ddl"), workdir)
+    shutil.copytree(os.path.join(BACKEND_DIR, "templates"), os.path.join(workdir, "templates"))
+    previous = os.getcwd()
+    os.chdir(workdir)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    try:
+        yield workdir
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Send the server's print() logging to /dev/null while measuring"""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def encode_multipart(fields: dict, files: dict) -> Tuple[bytes, str]:
+    """Build a multipart/form-data body: files = {name: (filename, content_type, bytes)}"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content_type, content) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + content + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class Response:
+    def __init__(self, status: int, body: bytes, headers: Optional[dict] = None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class ASGIWebSocket:
+    """Client side of an in-process ASGI WebSocket"""
+
+    def __init__(self, app, path: str, subprotocols: Optional[List[str]] = None):
+        raw_path, _, query = path.partition("?")
+        self.scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "http_version": "1.1",
+            "path": raw_path, "raw_path": raw_path.encode(), "query_string": query.encode(),
+            "root_path": "", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 0),
+            "server": ("bench", 80), "subprotocols": subprotocols or []
+        }
+        self.app = app
+        self.to_app: asyncio.Queue = asyncio.Queue()
+        self.from_app: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.subprotocol = None
+
+    async def connect(self):
+        await self.to_app.put({"type": "websocket.connect"})
+        self.task = asyncio.create_task(self.app(self.scope, self.to_app.get, self.from_app.put))
+        message = await self.from_app.get()
+        if message["type"] != "websocket.accept":
+            self.closed = True
+            raise ConnectionError(f"WebSocket rejected: {message}")
+        self.subprotocol = message.get("subprotocol")
+        return self
+
+    async def send_text(self, text: str):
+        await self.to_app.put({"type": "websocket.receive", "text": text})
+
+    async def send_bytes(self, data: bytes):
+        await self.to_app.put({"type": "websocket.receive", "bytes": data})
+
+    async def receive(self):
+        """Next text or bytes frame from the server"""
+        while True:
+            message = await self.from_app.get()
+            if message["type"] == "websocket.send":
+                return message.get("text") if message.get("text") is not None else message.get("bytes")
+            if message["type"] == "websocket.close":
+                self.closed = True
+                raise ConnectionError("WebSocket closed by server")
+
+    async def receive_json(self):
+        return json.loads(await self.receive())
+
+    async def close(self):
+        if self.task is None:
+            return
+        await self.to_app.put({"type": "websocket.disconnect", "code": 1000})
+        try:
+            await asyncio.wait_for(self.task, timeout=5)
+        except (asyncio.TimeoutError, Exception):
+            self.task.cancel()
+        self.task = None
+
+
+class ASGIClient:
+    """Drive an ASGI app in-process, including its lifespan events"""
+
+    def __init__(self, app):
+        self.app = app
+        self._lifespan_queue: asyncio.Queue = asyncio.Queue()
+        self._lifespan_task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self):
+        sent: asyncio.Queue = asyncio.Queue()
+        await self._lifespan_queue.put({"type": "lifespan.startup"})
+        self._lifespan_task = asyncio.create_task(
+            self.app({"type": "lifespan", "asgi": {"version": "3.0"}}, self._lifespan_queue.get, sent.put))
+        self._lifespan_sent = sent
+        message = await sent.get()
+        if message["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"Startup failed: {message}")
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._lifespan_queue.put({"type": "lifespan.shutdown"})
+        await self._lifespan_sent.get()
+        await self._lifespan_task
+
+    async def request(self, method: str, path: str, json_body=None, body: bytes = b"",
+                      content_type: Optional[str] = None, headers: Optional[dict] = None) -> Response:
+        raw_path, _, query = path.partition("?")
+        header_list = [(b"host", b"bench")]
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            content_type = "application/json"
+        if content_type:
+            header_list.append((b"content-type", content_type.encode()))
+        header_list.append((b"content-length", str(len(body)).encode()))
+        for name, value in (headers or {}).items():
+            header_list.append((name.lower().encode(), value.encode()))
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+            "scheme": "http", "path": raw_path, "raw_path": raw_path.encode(), "query_string": query.encode(),
+            "root_path": "", "headers": header_list, "client": ("127.0.0.1", 0), "server": ("bench", 80)
+        }
+        request_sent = False
+        disconnect = asyncio.Event()
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        status = 500
+        response_headers = {}
+        chunks = []
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers.update((k.decode().lower(), v.decode()) for k, v in message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        try:
+            await self.app(scope, receive, send)
+        except Exception:
+            # Unhandled server errors surface as a 500, as they would behind uvicorn
+            status = 500
+        finally:
+            disconnect.set()
+        return Response(status, b"".join(chunks), response_headers)
+
+    async def websocket(self, path: str, subprotocols: Optional[List[str]] = None) -> ASGIWebSocket:
+        return await ASGIWebSocket(self.app, path, subprotocols).connect()
+
+
+class LiveWebSocket:
+    """websockets-library connection with the ASGIWebSocket interface"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.subprotocol = connection.subprotocol
+
+    async def send_text(self, text: str):
+        await self.connection.send(text)
+
+    async def send_bytes(self, data: bytes):
+        await self.connection.send(data)
+
+    async def receive(self):
+        return await self.connection.recv()
+
+    async def receive_json(self):
+        return json.loads(await self.receive())
+
+    async def close(self):
+        await self.connection.close()
+
+
+class LiveClient:
+    """Same interface as ASGIClient, against a running server (e.g. uvicorn api:app)"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def request(self, method: str, path: str, json_body=None, body: bytes = b"",
+                      content_type: Optional[str] = None, headers: Optional[dict] = None) -> Response:
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            content_type = "application/json"
+        request = urllib.request.Request(self.base_url + path, data=body if method != "GET" else None, method=method)
+        if content_type:
+            request.add_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            request.add_header(name, value)
+
+        def do_request():
+            try:
+                with urllib.request.urlopen(request) as response:
+                    return Response(response.status, response.read(), dict(response.headers.items()))
+            except urllib.error.HTTPError as e:
+                return Response(e.code, e.read(), dict(e.headers.items()))
+
+        return await asyncio.to_thread(do_request)
+
+    async def websocket(self, path: str, subprotocols: Optional[List[str]] = None) -> LiveWebSocket:
+        import websockets
+        url = "ws" + self.base_url[len("http"):] + path
+        return LiveWebSocket(await websockets.connect(url, subprotocols=subprotocols, max_size=None))
+
+
+class Recorder:
+    """Per-scenario operation latencies, throughput and memory"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.extra = {}
+        self.started = 0.0
+        self.finished = 0.0
+        self.rss_before = 0
+
+    def start(self):
+        self.rss_before = rss_bytes()
+        self.started = time.perf_counter()
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def record(self, seconds: float):
+        self.latencies.append(seconds)
+
+    def result(self) -> dict:
+        elapsed = max(self.finished - self.started, 1e-9)
+        rss_after = rss_bytes()
+        result = {
+            "scenario": self.name,
+            "operations": len(self.latencies),
+            "errors": self.errors,
+            "seconds": round(elapsed, 3),
+            "throughput": round(len(self.latencies) / elapsed, 1),
+            "p50_ms": round(percentile(self.latencies, 50) * 1000, 3),
+            "p99_ms": round(percentile(self.latencies, 99) * 1000, 3),
+            "max_ms": round(max(self.latencies, default=0.0) * 1000, 3),
+            "rss_bytes": rss_after,
+            "rss_delta_bytes": rss_after - self.rss_before
+        }
+        result.update(self.extra)
+        return result
@@ -0,0 +1,413 @@
+"""End-to-end benchmark suite for the PublicPooper API
+
+Drives api.py in-process over ASGI (default, fresh scratch database) or a
+running server with --url, using scripted synthetic users:
+
+- chat:      N rooms x M chatters on /ws/{room_id}/{user_id}; latency is
+             send -> own broadcast received
+- signaling: S streams, one broadcaster and V viewers on /signal/...;
+             latency is viewer-joined -> offer received, then answer and
+             ICE candidates are relayed
+- rest:      join / bet / leave request mix
+- emoji:     premium users uploading small PNGs
+- bulk_bets: POST /bets/bulk batches
+
+Results are printed as one JSON document (and written to --output), with
+throughput, p50/p99 latency and RSS per scenario so runs can be compared
+over time. In --url mode memory figures describe the client process only.
+
+    cd backend
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --scenario chat --rooms 50 --chatters 20
+    python benchmarks/run_benchmarks.py --url http://localhost:8000
+"""
+import argparse
+import asyncio
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+import uuid
+
+from harness import ASGIClient, LiveClient, Recorder, encode_multipart, percentile, quiet, sandbox, BACKEND_DIR
+
+SCENARIOS = ["chat", "signaling", "rest", "emoji", "bulk_bets"]
+# Attempts per setup request refused with 503
+SETUP_RETRIES = 10
+
+
+async def setup_request(client, method: str, path: str, json_body=None):
+    """Request made while setting a scenario up, retried while admission control
+    is still shedding load left over from the previous scenario (503)"""
+    for _ in range(SETUP_RETRIES):
+        response = await client.request(method, path, json_body)
+        if response.status != 503:
+            break
+        retry_after = response.headers.get("retry-after") or response.headers.get("Retry-After") or "1"
+        await asyncio.sleep(float(retry_after))
+    return response
+
+
+async def create_users(client, count: int, prefix: str, user_type: str = "normal"):
+    uids = []
+    for _ in range(count):
+        name = f"{prefix}_{uuid.uuid4().hex[:10]}"
+        response = await setup_request(client, "POST", "/users",
+                                       {"uname": name, "email": f"{name}@example.com", "type": user_type})
+        uids.append(response.json()["uid"])
+    return uids
+
+
+async def create_room(client, uid: str, room_type: str = "competitive", user_limit: int = 1000) -> str:
+    name = f"room_{uuid.uuid4().hex[:10]}"
+    response = await setup_request(client, "POST", f"/rooms/{name}/join/{uid}", {
+        "rname": name, "type": room_type, "user_limit": user_limit, "duration": 3600.0
+    })
+    return response.json()["room"]["rid"]
+
+
+async def chat_scenario(client, args) -> dict:
+    recorder = Recorder("chat")
+    rooms = []
+    for _ in range(args.rooms):
+        uids = await create_users(client, args.chatters, "chatter")
+        rooms.append((await create_room(client, uids[0]), uids))
+
+    sockets = []
+    for rid, uids in rooms:
+        for uid in uids:
+            sockets.append((rid, uid, await client.websocket(f"/ws/{rid}/{uid}")))
+
+    delivered = 0
+    pending = {}
+    done = asyncio.Event()
+    expected = len(sockets) * args.messages
+
+    async def reader(uid, ws):
+        nonlocal delivered
+        while True:
+            try:
+                frame = json.loads(await ws.receive())
+            except Exception:
+                return
+            if frame.get("type") != "chat":
+                continue
+            delivered += 1
+            sent_at = pending.pop(frame.get("comment"), None) if frame.get("uid") == uid else None
+            if sent_at is not None:
+                recorder.record(time.perf_counter() - sent_at)
+                if len(recorder.latencies) >= expected:
+                    done.set()
+
+    async def writer(ws):
+        for _ in range(args.messages):
+            token = uuid.uuid4().hex
+            pending[token] = time.perf_counter()
+            await ws.send_text(json.dumps({"type": "chat", "comment": token, "targetUid": None}))
+            await asyncio.sleep(args.think_time)
+
+    readers = [asyncio.create_task(reader(uid, ws)) for _, uid, ws in sockets]
+    recorder.start()
+    await asyncio.gather(*(writer(ws) for _, _, ws in sockets))
+    try:
+        await asyncio.wait_for(done.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        recorder.errors = len(pending)
+    recorder.stop()
+
+    for _, _, ws in sockets:
+        await ws.close()
+    for task in readers:
+        task.cancel()
+    recorder.extra = {
+        "rooms": args.rooms, "chatters_per_room": args.chatters, "messages_per_chatter": args.messages,
+        "deliveries": delivered, "deliveries_per_second": round(delivered / max(recorder.finished - recorder.started, 1e-9), 1)
+    }
+    return recorder.result()
+
+
+async def signaling_scenario(client, args) -> dict:
+    recorder = Recorder("signaling")
+    relayed = {"candidates": 0, "answers": 0, "frames": 0}
+    broadcasters = []
+    # Time from joining until the offer and every broadcaster candidate arrived, per viewer
+    setup_times = []
+    query = "?coalesce=1" if args.coalesce else ""
+
+    async def receive_messages(ws, timeout=None):
+        """Next frame as a list of messages (coalesced frames are unpacked)"""
+        frame = json.loads(await asyncio.wait_for(ws.receive(), timeout=timeout))
+        relayed["frames"] += 1
+        return frame["messages"] if frame.get("type") == "ice-candidates" else [frame]
+
+    async def broadcaster_loop(ws):
+        while True:
+            try:
+                messages = await receive_messages(ws)
+            except Exception:
+                return
+            for frame in messages:
+                await handle_broadcaster_message(ws, frame)
+
+    async def handle_broadcaster_message(ws, frame):
+        if frame.get("type") == "viewer-joined":
+            await ws.send_text(json.dumps({"type": "offer", "sdp": "v=0 bench", "viewerId": frame["viewerId"]}))
+            for i in range(args.candidates):
+                await ws.send_text(json.dumps({
+                    "type": "ice-candidate", "viewerId": frame["viewerId"],
+                    "candidate": {"candidate": f"candidate:{i} 1 udp 2122260223 10.0.0.1 {50000 + i} typ host",
+                                  "sdpMid": "0", "sdpMLineIndex": 0}
+                }))
+        elif frame.get("type") == "answer":
+            relayed["answers"] += 1
+        elif frame.get("type") == "ice-candidate":
+            relayed["candidates"] += 1
+
+    async def viewer(stream_id):
+        ws = await client.websocket(f"/signal/{stream_id}/viewer{query}")
+        started = time.perf_counter()
+        await ws.send_text(json.dumps({"type": "viewer-joined"}))
+        candidates = 0
+        offered = False
+        try:
+            while not offered or candidates < args.candidates:
+                for frame in await receive_messages(ws, timeout=args.timeout):
+                    if frame.get("type") == "ice-candidate":
+                        candidates += 1
+                    elif frame.get("type") == "offer":
+                        offered = True
+                        recorder.record(time.perf_counter() - started)
+                        await ws.send_text(json.dumps({"type": "answer", "sdp": "v=0 bench answer"}))
+                        for i in range(args.candidates):
+                            await ws.send_text(json.dumps({
+                                "type": "ice-candidate",
+                                "candidate": {"candidate": f"candidate:{i} 1 udp 2122260223 10.0.0.2 {40000 + i} typ host",
+                                              "sdpMid": "0", "sdpMLineIndex": 0}
+                            }))
+            setup_times.append(time.perf_counter() - started)
+        except (asyncio.TimeoutError, ConnectionError):
+            recorder.errors += 1
+        return ws
+
+    stream_ids = [f"bench_{uuid.uuid4().hex[:8]}" for _ in range(args.streams)]
+    for stream_id in stream_ids:
+        ws = await client.websocket(f"/signal/{stream_id}/broadcaster{query}")
+        broadcasters.append((ws, asyncio.create_task(broadcaster_loop(ws))))
+
+    recorder.start()
+    viewers = await asyncio.gather(*(viewer(stream_id) for stream_id in stream_ids for _ in range(args.viewers)))
+    # Let the last answers and candidates drain to the broadcasters
+    deadline = time.perf_counter() + args.timeout
+    expected_candidates = len(viewers) * args.candidates
+    while relayed["candidates"] < expected_candidates and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    recorder.stop()
+
+    for ws in viewers:
+        await ws.close()
+    for ws, task in broadcasters:
+        await ws.close()
+        task.cancel()
+    recorder.extra = {
+        "streams": args.streams, "viewers_per_stream": args.viewers, "candidates_per_peer": args.candidates,
+        "answers_relayed": relayed["answers"], "candidates_relayed": relayed["candidates"],
+        "coalesce": args.coalesce, "frames_received": relayed["frames"],
+        "setup_p50_ms": round(percentile(setup_times, 50) * 1000, 3),
+        "setup_p99_ms": round(percentile(setup_times, 99) * 1000, 3)
+    }
+    return recorder.result()
+
+
+async def rest_scenario(client, args) -> dict:
+    recorder = Recorder("rest")
+    statuses = {}
+    uids = await create_users(client, args.rest_users, "rest")
+    owner = (await create_users(client, 1, "owner"))[0]
+    rooms = [await create_room(client, owner) for _ in range(args.rest_rooms)]
+
+    async def timed(method, path, body=None):
+        started = time.perf_counter()
+        response = await client.request(method, path, body)
+        recorder.record(time.perf_counter() - started)
+        statuses[str(response.status)] = statuses.get(str(response.status), 0) + 1
+        if response.status >= 500:
+            recorder.errors += 1
+
+    async def user_session(index, uid):
+        for i in range(args.rest_iterations):
+            rid = rooms[(index + i) % len(rooms)]
+            await timed("POST", f"/rooms/{rid}/bet/{uid}", {"bet": float(i % 50 + 1)})
+            await timed("GET", f"/rooms/{rid}/bets/summary")
+            await timed("GET", f"/rooms/{rid}/chat?limit=20")
+        await timed("GET", "/rooms")
+
+    recorder.start()
+    for index, uid in enumerate(uids):
+        # Each user joins one room and leaves it at the end (RoomUser is keyed on uid+rid)
+        rid = rooms[index % len(rooms)]
+        response = await setup_request(client, "GET", f"/rooms/{rid}")
+        rname = response.json()["rname"]
+        await timed("POST", f"/rooms/{rname}/join/{uid}")
+    await asyncio.gather(*(user_session(index, uid) for index, uid in enumerate(uids)))
+    for index, uid in enumerate(uids):
+        await timed("POST", f"/rooms/{rooms[index % len(rooms)]}/leave/{uid}")
+    recorder.stop()
+    recorder.extra = {"users": args.rest_users, "rooms": args.rest_rooms, "statuses": statuses}
+    return recorder.result()
+
+
+def make_png(seed: int, size: int) -> bytes:
+    from PIL import Image
+    image = Image.new("RGBA", (size, size), ((seed * 37) % 256, (seed * 91) % 256, (seed * 53) % 256, 255))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+async def emoji_scenario(client, args) -> dict:
+    recorder = Recorder("emoji")
+    uids = await create_users(client, args.uploaders, "uploader", "premium")
+    images = [make_png(i, args.emoji_size) for i in range(8)]
+
+    async def uploader(index, uid):
+        for i in range(args.uploads):
+            body, content_type = encode_multipart({}, {"file": ("emoji.png", "image/png", images[i % len(images)])})
+            name = f"e{index}_{i}_{uuid.uuid4().hex[:6]}"
+            started = time.perf_counter()
+            response = await client.request("POST", f"/emojis/upload/{uid}?name={name}", body=body, content_type=content_type)
+            recorder.record(time.perf_counter() - started)
+            if response.status != 200:
+                recorder.errors += 1
+
+    recorder.start()
+    await asyncio.gather(*(uploader(index, uid) for index, uid in enumerate(uids)))
+    recorder.stop()
+    started = time.perf_counter()
+    await client.request("GET", "/emojis")
+    recorder.extra = {
+        "uploaders": args.uploaders, "uploads_per_user": args.uploads, "image_px": args.emoji_size,
+        "list_emojis_ms": round((time.perf_counter() - started) * 1000, 3)
+    }
+    return recorder.result()
+
+
+async def bulk_bets_scenario(client, args) -> dict:
+    recorder = Recorder("bulk_bets")
+    uids = await create_users(client, 50, "bettor")
+    rooms = [await create_room(client, uids[0]) for _ in range(10)]
+    accepted = offered = 0
+    recorder.start()
+    for batch in range(args.bulk_batches):
+        bets = [{
+            "uid": uids[(batch + i) % len(uids)], "rid": rooms[(batch + i) % len(rooms)],
+            "bet": float(i % 100 + 1), "idempotencyKey": uuid.uuid4().hex
+        } for i in range(args.bulk_size)]
+        started = time.perf_counter()
+        response = await client.request("POST", "/bets/bulk", {"bets": bets})
+        recorder.record(time.perf_counter() - started)
+        offered += len(bets)
+        if response.status == 200:
+            accepted += response.json()["accepted"]
+        else:
+            recorder.errors += 1
+    recorder.stop()
+    recorder.extra = {
+        "batch": args.bulk_size, "bets_offered": offered, "bets_accepted": accepted,
+        "bets_per_second": round(offered / max(recorder.finished - recorder.started, 1e-9), 1)
+    }
+    return recorder.result()
+
+
+SCENARIO_FUNCTIONS = {
+    "chat": chat_scenario,
+    "signaling": signaling_scenario,
+    "rest": rest_scenario,
+    "emoji": emoji_scenario,
+    "bulk_bets": bulk_bets_scenario,
+}
+
+
+async def run(args, client) -> list:
+    results = []
+    async with client:
+        for name in args.scenario or SCENARIOS:
+            with quiet():
+                results.append(await SCENARIO_FUNCTIONS[name](client, args))
+            print(json.dumps(results[-1]), file=sys.stderr)
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="run only these (repeatable)")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for in-flight frames")
+    parser.add_argument("--no-rate-limits", action="store_true",
+                        help="lift ingress rate limits (in-process only) to measure raw throughput")
+    parser.add_argument("--no-admission", action="store_true",
+                        help="turn admission control off (in-process only) so nothing is shed")
+    chat = parser.add_argument_group("chat")
+    chat.add_argument("--rooms", type=int, default=10)
+    chat.add_argument("--chatters", type=int, default=10)
+    chat.add_argument("--messages", type=int, default=20)
+    chat.add_argument("--think-time", type=float, default=0.0, help="seconds between a chatter's messages")
+    signaling = parser.add_argument_group("signaling")
+    signaling.add_argument("--streams", type=int, default=5)
+    signaling.add_argument("--viewers", type=int, default=10)
+    signaling.add_argument("--candidates", type=int, default=10)
+    signaling.add_argument("--coalesce", action="store_true", help="peers opt in to coalesced ICE candidates")
+    rest = parser.add_argument_group("rest")
+    rest.add_argument("--rest-users", type=int, default=50)
+    rest.add_argument("--rest-rooms", type=int, default=10)
+    rest.add_argument("--rest-iterations", type=int, default=10)
+    emoji = parser.add_argument_group("emoji")
+    emoji.add_argument("--uploaders", type=int, default=5)
+    emoji.add_argument("--uploads", type=int, default=10)
+    emoji.add_argument("--emoji-size", type=int, default=256)
+    bulk = parser.add_argument_group("bulk_bets")
+    bulk.add_argument("--bulk-batches", type=int, default=20)
+    bulk.add_argument("--bulk-size", type=int, default=500)
+    args = parser.parse_args()
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "mode": "live" if args.url else "in-process",
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    if args.url:
+        report["results"] = asyncio.run(run(args, LiveClient(args.url)))
+    else:
+        with sandbox():
+            with quiet():
+                import api
+                import ratelimit
+                import admission
+            if args.no_rate_limits:
+                for limiter in ratelimit.limiters.values():
+                    limiter.configure(float("inf"), float("inf"))
+            if args.no_admission:
+                for traffic in admission.classes.values():
+                    traffic.configure(0, 0, 0.0, 0.0)
+            report["results"] = asyncio.run(run(args, ASGIClient(api.app)))
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import asyncio
+import bisect
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+# Upper bounds of the bet distribution buckets (last bucket is open-ended)
+BET_BUCKETS = [1.0, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0]
+
+# Minimum seconds between pot updates pushed to the same room
+POT_PUSH_INTERVAL = 0.5
+
+# Idempotency keys remembered in memory (older keys are still found in the DB)
+IDEMPOTENCY_CACHE_SIZE = 100000
+
+# Max host parameters per IN (...) lookup
+SQL_CHUNK_SIZE = 500
+
+_last_bet_time: Optional[datetime] = None
+
+
+def next_bet_timestamp() -> str:
+    """Strictly increasing createAt for Bet rows
+
+    Bet is keyed on (uid, rid, createAt), so two bets in the same microsecond
+    would collide; bump the clock by one microsecond when that happens.
+    """
+    global _last_bet_time
+    now = datetime.now()
+    if _last_bet_time is not None and now <= _last_bet_time:
+        now = _last_bet_time + timedelta(microseconds=1)
+    _last_bet_time = now
+    return now.isoformat()
+
+
+class RoomBetTotals:
+    """Running bet totals for one room"""
+    __slots__ = ("total", "count", "max_bet", "user_totals", "buckets")
+
+    def __init__(self):
+        self.total = 0.0
+        self.count = 0
+        self.max_bet = 0.0
+        # Stake per bettor: {uid: total}
+        self.user_totals: Dict[str, float] = {}
+        self.buckets = [0] * (len(BET_BUCKETS) + 1)
+
+
+class BetAggregator:
+    """In-memory per-room and per-user bet totals
+
+    Rebuilt from the Bet table at startup and updated on every accepted bet,
+    so pot size, bettor counts and distributions are read without touching
+    the database.
+    """
+
+    def __init__(self):
+        # Per-room totals: {rid: RoomBetTotals}
+        self.rooms: Dict[str, RoomBetTotals] = {}
+        # Per-user totals across rooms: {uid: [total, count]}
+        self.users: Dict[str, List[float]] = {}
+
+    def add(self, uid: str, rid: str, amount: float):
+        """Fold one bet into the running totals"""
+        room = self.rooms.get(rid)
+        if room is None:
+            room = self.rooms[rid] = RoomBetTotals()
+        room.total += amount
+        room.count += 1
+        if amount > room.max_bet:
+            room.max_bet = amount
+        room.user_totals[uid] = room.user_totals.get(uid, 0.0) + amount
+        room.buckets[bisect.bisect_left(BET_BUCKETS, amount)] += 1
+
+        user = self.users.get(uid)
+        if user is None:
+            user = self.users[uid] = [0.0, 0]
+        user[0] += amount
+        user[1] += 1
+
+    def rebuild(self, *conns: sqlite3.Connection):
+        """Reset and reload totals from the Bet table of each database (every shard when sharded)"""
+        self.rooms = {}
+        self.users = {}
+        for conn in conns:
+            cursor = conn.cursor()
+            cursor.execute("SELECT uid, rid, bet FROM Bet")
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                for uid, rid, amount in rows:
+                    self.add(uid, rid, amount or 0.0)
+
+    def room_summary(self, rid: str, uid: Optional[str] = None) -> dict:
+        """Pot summary for a room, optionally with one user's stake and share"""
+        room = self.rooms.get(rid) or RoomBetTotals()
+        summary = {
+            "rid": rid,
+            "total": room.total,
+            "count": room.count,
+            "bettors": len(room.user_totals),
+            "average": room.total / room.count if room.count else 0.0,
+            "max": room.max_bet,
+            "buckets": self.bucket_counts(room)
+        }
+        if uid is not None:
+            stake = room.user_totals.get(uid, 0.0)
+            summary["user"] = {
+                "uid": uid,
+                "stake": stake,
+                "share": stake / room.total if room.total else 0.0,
+                # Pari-mutuel payout multiplier if this user's side wins
+                "odds": room.total / stake if stake else None
+            }
+        return summary
+
+    def user_summary(self, uid: str) -> dict:
+        """Bet totals for a user across all rooms"""
+        total, count = self.users.get(uid, (0.0, 0))
+        return {"uid": uid, "total": total, "count": count}
+
+    @staticmethod
+    def bucket_counts(room: RoomBetTotals) -> List[dict]:
+        """Label the distribution buckets of a room"""
+        buckets = []
+        lower = 0.0
+        for upper, count in zip(BET_BUCKETS + [None], room.buckets):
+            buckets.append({"min": lower, "max": upper, "count": count})
+            lower = upper
+        return buckets
+
+
+class PotUpdatePusher:
+    """Throttled pot-update broadcasts
+
+    Bursts of bets in one room collapse into at most one push per
+    `interval` seconds; the push always carries the latest totals.
+    """
+
+    def __init__(self, aggregator: BetAggregator, send: Callable[[str, dict], Awaitable[None]],
+                 interval: float = POT_PUSH_INTERVAL):
+        self.aggregator = aggregator
+        self.send = send
+        self.interval = interval
+        # Rooms with a push already scheduled
+        self.pending: Set[str] = set()
+        # Last push time per room: {rid: monotonic seconds}
+        self.last_push: Dict[str, float] = {}
+
+    def notify(self, rid: str):
+        """Schedule a pot update for a room unless one is already pending"""
+        if rid in self.pending:
+            return
+        self.pending.add(rid)
+        delay = self.last_push.get(rid, 0.0) + self.interval - time.monotonic()
+        loop = asyncio.get_running_loop()
+        loop.call_later(max(0.0, delay), lambda: asyncio.ensure_future(self._flush(rid)))
+
+    async def _flush(self, rid: str):
+        self.pending.discard(rid)
+        self.last_push[rid] = time.monotonic()
+        summary = self.aggregator.room_summary(rid)
+        try:
+            await self.send(rid, {
+                "type": "pot_update",
+                "rid": rid,
+                "total": summary["total"],
+                "count": summary["count"],
+                "bettors": summary["bettors"],
+                "timestamp": datetime.now().isoformat()
+            })
+        except Exception as e:
+            print(f"[bets] Failed to push pot update for room {rid}: {e}")
+
+
+class BetValidationCache:
+    """Known users and room types used to validate bets without per-bet queries
+
+    Loaded at startup and kept current by user/room creation. Ids missing from
+    the cache are looked up in one batched query, so rows created by another
+    process are still found.
+    """
+
+    def __init__(self):
+        self.users: Set[str] = set()
+        # Room types: {rid: "casual" | "competitive"}
+        self.room_types: Dict[str, str] = {}
+        # Rooms whose duration has run out
+        self.closed_rooms: Set[str] = set()
+
+    def load(self, conn: sqlite3.Connection):
+        """Reset and reload from the Users and Room tables"""
+        cursor = conn.cursor()
+        cursor.execute("SELECT uid FROM Users")
+        self.users = {row[0] for row in cursor.fetchall()}
+        cursor.execute("SELECT rid, type, closedAt FROM Room")
+        rows = cursor.fetchall()
+        self.room_types = {row[0]: row[1] for row in rows}
+        self.closed_rooms = {row[0] for row in rows if row[2]}
+
+    def add_user(self, uid: str):
+        self.users.add(uid)
+
+    def add_room(self, rid: str, room_type: str):
+        self.room_types[rid] = room_type
+
+    def close_room(self, rid: str):
+        self.closed_rooms.add(rid)
+
+    def resolve(self, conn: sqlite3.Connection, uids: Iterable[str], rids: Iterable[str]):
+        """Fill the cache for any of uids/rids not seen yet"""
+        cursor = conn.cursor()
+        missing_uids = [uid for uid in set(uids) if uid not in self.users]
+        for i in range(0, len(missing_uids), SQL_CHUNK_SIZE):
+            chunk = missing_uids[i:i + SQL_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f"SELECT uid FROM Users WHERE uid IN ({placeholders})", chunk)
+            self.users.update(row[0] for row in cursor.fetchall())
+
+        missing_rids = [rid for rid in set(rids) if rid not in self.room_types]
+        for i in range(0, len(missing_rids), SQL_CHUNK_SIZE):
+            chunk = missing_rids[i:i + SQL_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f"SELECT rid, type, closedAt FROM Room WHERE rid IN ({placeholders})", chunk)
+            for row in cursor.fetchall():
+                self.room_types[row[0]] = row[1]
+                if row[2]:
+                    self.closed_rooms.add(row[0])
+
+
+class IdempotencyCache:
+    """Bounded LRU of idempotency key -> original bet result"""
+
+    def __init__(self, max_size: int = IDEMPOTENCY_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[dict]:
+        result = self.entries.get(key)
+        if result is not None:
+            self.entries.move_to_end(key)
+        return result
+
+    def put(self, key: str, result: dict):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def lookup_db(self, conn: sqlite3.Connection, keys: List[str]) -> Dict[str, dict]:
+        """Find keys recorded by earlier requests that fell out of memory"""
+        found: Dict[str, dict] = {}
+        cursor = conn.cursor()
+        for i in range(0, len(keys), SQL_CHUNK_SIZE):
+            chunk = keys[i:i + SQL_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(
+                f"SELECT idempotencyKey, uid, rid, bet, createAt FROM BetIdempotency WHERE idempotencyKey IN ({placeholders})",
+                chunk
+            )
+            for key, uid, rid, amount, create_time in cursor.fetchall():
+                found[key] = {"uid": uid, "rid": rid, "bet": amount, "createAt": create_time}
+                self.put(key, found[key])
+        return found
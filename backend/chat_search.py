@@ -0,0 +1,125 @@
+import asyncio
+import re
+import sqlite3
+from typing import List, Optional
+
+# Chat rows indexed per backfill transaction; keeps each write lock short
+BACKFILL_CHUNK_SIZE = 2000
+# Pause between backfill chunks so chat writes can get the lock (seconds)
+BACKFILL_PAUSE = 0.05
+# Upper bound on results per search request
+MAX_SEARCH_RESULTS = 200
+
+# Words in a search string; a trailing * makes the word a prefix match
+_TERM_PATTERN = re.compile(r"[\w]+\*?", re.UNICODE)
+
+
+def build_match_query(query: str) -> str:
+    """Turn free text into an FTS5 MATCH expression
+
+    Each word becomes a quoted term (all must match), so user input can never
+    be parsed as FTS5 operators or column filters. Raises ValueError when the
+    text contains no searchable words.
+    """
+    terms = []
+    for term in _TERM_PATTERN.findall(query):
+        if term.endswith("*"):
+            terms.append(f'"{term[:-1]}"*')
+        else:
+            terms.append(f'"{term}"')
+    if not terms:
+        raise ValueError("Search query must contain at least one word")
+    return " ".join(terms)
+
+
+def search(conn: sqlite3.Connection, query: str, rid: Optional[str] = None, uid: Optional[str] = None,
+           since: Optional[str] = None, until: Optional[str] = None, limit: int = 50) -> List[sqlite3.Row]:
+    """Chat messages matching query, best match first
+
+    rid/uid scope the search to a room or sender; since/until bound createAt
+    (ISO timestamps, inclusive). Rows carry uid, rid, targetUid, comment,
+    createAt and score (higher is more relevant).
+    """
+    conditions = ["ChatSearch MATCH ?"]
+    params: list = [build_match_query(query)]
+    if rid is not None:
+        conditions.append("rid = ?")
+        params.append(rid)
+    if uid is not None:
+        conditions.append("uid = ?")
+        params.append(uid)
+    if since is not None:
+        conditions.append("createAt >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("createAt <= ?")
+        params.append(until)
+    params.append(max(1, min(limit, MAX_SEARCH_RESULTS)))
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT uid, rid, targetUid, comment, createAt, -bm25(ChatSearch) AS score FROM ChatSearch "
+        f"WHERE {' AND '.join(conditions)} ORDER BY bm25(ChatSearch), createAt DESC LIMIT ?",
+        params
+    )
+    return cursor.fetchall()
+
+
+def backfill_status(conn: sqlite3.Connection) -> dict:
+    cursor = conn.cursor()
+    cursor.execute("SELECT lastRowid, targetRowid FROM ChatSearchBackfill WHERE id = 1")
+    row = cursor.fetchone()
+    if row is None:
+        return {"complete": True, "last_rowid": 0, "target_rowid": 0}
+    return {
+        "complete": row["lastRowid"] >= row["targetRowid"],
+        "last_rowid": row["lastRowid"],
+        "target_rowid": row["targetRowid"]
+    }
+
+
+def backfill_chunk(conn: sqlite3.Connection, chunk_size: int = BACKFILL_CHUNK_SIZE) -> bool:
+    """Index the next chunk of Chat rows written before the index existed
+
+    Rows newer than the recorded target are indexed by the Chat triggers.
+    Each chunk is its own short transaction. Returns True once done.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT lastRowid, targetRowid FROM ChatSearchBackfill WHERE id = 1")
+    row = cursor.fetchone()
+    if row is None or row["lastRowid"] >= row["targetRowid"]:
+        return True
+    last, target = row["lastRowid"], row["targetRowid"]
+    cursor.execute(
+        "SELECT MAX(rowid) FROM (SELECT rowid FROM Chat WHERE rowid > ? AND rowid <= ? ORDER BY rowid LIMIT ?)",
+        (last, target, chunk_size)
+    )
+    upper = cursor.fetchone()[0] or target
+    cursor.execute(
+        "INSERT INTO ChatSearch (rowid, comment, uid, rid, targetUid, createAt) "
+        "SELECT rowid, comment, uid, rid, targetUid, createAt FROM Chat WHERE rowid > ? AND rowid <= ?",
+        (last, upper)
+    )
+    cursor.execute("UPDATE ChatSearchBackfill SET lastRowid = ? WHERE id = 1", (upper,))
+    conn.commit()
+    return upper >= target
+
+
+async def run_backfill(connect, chunk_size: int = BACKFILL_CHUNK_SIZE):
+    """Backfill the search index in chunks off the event loop
+
+    connect opens a new database connection; one is used per chunk so the
+    worker thread never shares a connection with the loop.
+    """
+    def step() -> bool:
+        conn = connect()
+        try:
+            return backfill_chunk(conn, chunk_size)
+        finally:
+            conn.close()
+
+    chunks = 0
+    while not await asyncio.to_thread(step):
+        chunks += 1
+        await asyncio.sleep(BACKFILL_PAUSE)
+    if chunks:
+        print(f"[chat_search] Backfill complete after {chunks + 1} chunks")
@@ -0,0 +1,137 @@
+"""Compact registry of open chat WebSockets
+
+Each socket is one __slots__ record behind a small integer handle, its
+index in a flat slot list (handles of closed sockets are reused). Users map
+to their socket's handle and rooms to a set of handles, so a connection
+costs one record plus a few table slots instead of a dict of its own. Room
+and user ids are interned, so the thousands of sockets in a room share one
+copy of its id (and so do the replay log and other tables keyed on it).
+"""
+import sys
+from typing import Dict, List, Optional, Set
+
+
+class ChatConnection:
+    """One chat socket: who, where, and how to encode frames for it"""
+    __slots__ = ("handle", "user_id", "room_id", "websocket", "codec")
+
+    def __init__(self, handle: int, user_id: str, room_id: str, websocket, codec):
+        self.handle = handle
+        self.user_id = user_id
+        self.room_id = room_id
+        self.websocket = websocket
+        self.codec = codec
+
+
+class ConnectionRegistry:
+    """Chat connections by handle, by user (one socket each) and by room"""
+
+    def __init__(self):
+        # Connection by handle; None marks a free handle, listed in free
+        self.slots: List[Optional[ChatConnection]] = []
+        self.free: List[int] = []
+        self.users: Dict[str, int] = {}
+        self.rooms: Dict[str, Set[int]] = {}
+        self.count = 0
+
+    def add(self, user_id: str, room_id: str, websocket, codec) -> ChatConnection:
+        """Register a socket, replacing the user's previous one
+
+        Callers remove the previous socket first (to unregister it elsewhere
+        and tell its room); it is evicted here too so it never lingers in a room.
+        """
+        user_id = sys.intern(user_id)
+        room_id = sys.intern(room_id)
+        previous = self.user(user_id)
+        if previous is not None:
+            self.remove(previous)
+        if self.free:
+            handle = self.free.pop()
+            connection = self.slots[handle] = ChatConnection(handle, user_id, room_id, websocket, codec)
+        else:
+            handle = len(self.slots)
+            connection = ChatConnection(handle, user_id, room_id, websocket, codec)
+            self.slots.append(connection)
+        self.count += 1
+        self.users[user_id] = handle
+        members = self.rooms.get(room_id)
+        if members is None:
+            members = self.rooms[room_id] = set()
+        members.add(handle)
+        return connection
+
+    def remove(self, connection: ChatConnection) -> bool:
+        """Forget a connection; False if it was already gone (or replaced)"""
+        handle = connection.handle
+        if handle >= len(self.slots) or self.slots[handle] is not connection:
+            return False
+        self._release(handle)
+        if self.users.get(connection.user_id) == connection.handle:
+            del self.users[connection.user_id]
+        members = self.rooms.get(connection.room_id)
+        if members is not None:
+            members.discard(connection.handle)
+            if not members:
+                del self.rooms[connection.room_id]
+        return True
+
+    def _release(self, handle: int):
+        self.slots[handle] = None
+        self.free.append(handle)
+        self.count -= 1
+
+    def user(self, user_id: str) -> Optional[ChatConnection]:
+        handle = self.users.get(user_id)
+        return self.slots[handle] if handle is not None else None
+
+    def room(self, room_id: str) -> List[ChatConnection]:
+        """Snapshot of a room's connections (safe to iterate across awaits)"""
+        slots = self.slots
+        return [slots[handle] for handle in self.rooms.get(room_id, ())]
+
+    def room_size(self, room_id: str) -> int:
+        return len(self.rooms.get(room_id, ()))
+
+    def drop_room(self, room_id: str) -> List[ChatConnection]:
+        """Forget every connection in a room and return them"""
+        dropped = []
+        for handle in self.rooms.pop(room_id, ()):
+            connection = self.slots[handle]
+            self._release(handle)
+            if self.users.get(connection.user_id) == handle:
+                del self.users[connection.user_id]
+            dropped.append(connection)
+        return dropped
+
+    def __len__(self) -> int:
+        return self.count
+
+    def memory(self) -> Dict[str, int]:
+        """Approximate bytes held by the registry itself (not the sockets it points to)"""
+        connections = [connection for connection in self.slots if connection is not None]
+        records = sum(sys.getsizeof(connection) for connection in connections)
+        tables = (sys.getsizeof(self.slots) + sys.getsizeof(self.free) + sys.getsizeof(self.users) +
+                  sys.getsizeof(self.rooms) + sum(sys.getsizeof(members) for members in self.rooms.values()))
+        handles = sum(sys.getsizeof(connection.handle) for connection in connections)
+        ids = (sum(sys.getsizeof(user_id) for user_id in self.users) +
+               sum(sys.getsizeof(room_id) for room_id in self.rooms))
+        total = records + tables + handles + ids
+        return {
+            "records": records,
+            "tables": tables,
+            "handles": handles,
+            "ids": ids,
+            "total": total,
+            "per_connection": total // self.count if self.count else 0
+        }
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.count,
+            "users": len(self.users),
+            "rooms": len(self.rooms),
+            "largest_room": max((len(members) for members in self.rooms.values()), default=0),
+            "handles": len(self.slots),
+            "free_handles": len(self.free),
+            "bytes": self.memory()
+        }
@@ -1,8 +1,223 @@
 import sqlite3
 import os
+import time
+
+from metrics import db_query_seconds, db_commit_seconds, statement_kind
 
 DATABASE_PATH = "publicpooper.db"
 
+
+def _add_room_closed_at(conn: sqlite3.Connection):
+    """Room.closedAt: set when the room's duration runs out"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(Room)")}
+    if "closedAt" not in columns:
+        conn.execute("ALTER TABLE Room ADD COLUMN closedAt TIMESTAMP")
+
+
+def _nullable_room_user_leave_at(conn: sqlite3.Connection):
+    """RoomUser.leaveAt was NOT NULL, so a session could never be open; rebuild it nullable"""
+    columns = conn.execute("PRAGMA table_info(RoomUser)").fetchall()
+    if not any(row[1] == "leaveAt" and row[3] for row in columns):
+        return
+    conn.executescript("""
+        BEGIN;
+        CREATE TABLE RoomUser_new (
+            uid TEXT REFERENCES Users(uid) ON DELETE CASCADE,
+            rid TEXT REFERENCES Room(rid) ON DELETE CASCADE,
+            joinAt TIMESTAMP NOT NULL,
+            leaveAt TIMESTAMP,
+            duration REAL NOT NULL,
+            PRIMARY KEY (uid, rid)
+        );
+        INSERT INTO RoomUser_new (uid, rid, joinAt, leaveAt, duration)
+            SELECT uid, rid, joinAt, leaveAt, duration FROM RoomUser;
+        DROP TABLE RoomUser;
+        ALTER TABLE RoomUser_new RENAME TO RoomUser;
+        COMMIT;
+    """)
+
+# Full-text chat search, keyed on Chat's rowid and kept in sync by triggers
+CHAT_SEARCH_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS ChatSearch USING fts5(
+        comment, uid UNINDEXED, rid UNINDEXED, targetUid UNINDEXED, createAt UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS ChatSearchInsert AFTER INSERT ON Chat BEGIN
+        INSERT INTO ChatSearch (rowid, comment, uid, rid, targetUid, createAt)
+        VALUES (new.rowid, new.comment, new.uid, new.rid, new.targetUid, new.createAt);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS ChatSearchDelete AFTER DELETE ON Chat BEGIN
+        DELETE FROM ChatSearch WHERE rowid = old.rowid;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS ChatSearchUpdate AFTER UPDATE ON Chat BEGIN
+        DELETE FROM ChatSearch WHERE rowid = old.rowid;
+        INSERT INTO ChatSearch (rowid, comment, uid, rid, targetUid, createAt)
+        VALUES (new.rowid, new.comment, new.uid, new.rid, new.targetUid, new.createAt);
+    END""",
+]
+
+# Schema added after the initial schema.ddl. Every entry (SQL, or a function
+# taking the connection) must be idempotent: they run on every startup so
+# existing databases pick them up.
+MIGRATIONS = [
+    """CREATE TABLE IF NOT EXISTS BetIdempotency (
+        idempotencyKey TEXT PRIMARY KEY,
+        uid TEXT NOT NULL,
+        rid TEXT NOT NULL,
+        bet REAL NOT NULL,
+        createAt TIMESTAMP NOT NULL
+    )""",
+    *CHAT_SEARCH_SCHEMA,
+    # Chat rows that predate the triggers are indexed in chunks up to targetRowid
+    """CREATE TABLE IF NOT EXISTS ChatSearchBackfill (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        lastRowid INTEGER NOT NULL,
+        targetRowid INTEGER NOT NULL
+    )""",
+    """INSERT OR IGNORE INTO ChatSearchBackfill (id, lastRowid, targetRowid)
+        SELECT 1, 0, COALESCE(MAX(rowid), 0) FROM Chat""",
+    _add_room_closed_at,
+    _nullable_room_user_leave_at,
+    "CREATE INDEX IF NOT EXISTS idx_room_user_open ON RoomUser(rid) WHERE leaveAt IS NULL",
+    # Room history pages and archival both walk one room's chat by time
+    "CREATE INDEX IF NOT EXISTS idx_chat_room_time ON Chat(rid, createAt)",
+    # Per-room chat retention overrides (days) for the archiver
+    """CREATE TABLE IF NOT EXISTS ChatRetention (
+        rid TEXT PRIMARY KEY REFERENCES Room(rid) ON DELETE CASCADE,
+        retentionDays REAL NOT NULL
+    )""",
+    # Stream recordings indexed from SRS's HLS output (recordings.py); uid is the broadcaster's stream id
+    """CREATE TABLE IF NOT EXISTS RecordingSession (
+        sid TEXT PRIMARY KEY,
+        uid TEXT NOT NULL,
+        startedAt TIMESTAMP NOT NULL,
+        endedAt TIMESTAMP,
+        segments INTEGER NOT NULL DEFAULT 0,
+        duration REAL NOT NULL DEFAULT 0,
+        bytes INTEGER NOT NULL DEFAULT 0
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_recording_session_uid ON RecordingSession(uid, startedAt)",
+    """CREATE TABLE IF NOT EXISTS RecordingSegment (
+        sid TEXT REFERENCES RecordingSession(sid) ON DELETE CASCADE,
+        seq INTEGER NOT NULL,
+        duration REAL NOT NULL,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        PRIMARY KEY (sid, seq)
+    )""",
+    # Hourly analytics rollups (analytics.py); bucket is 'YYYY-MM-DDTHH:00'
+    """CREATE TABLE IF NOT EXISTS ChatRollup (
+        bucket TEXT NOT NULL,
+        rid TEXT NOT NULL,
+        messages INTEGER NOT NULL DEFAULT 0,
+        directed INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, rid)
+    )""",
+    """CREATE TABLE IF NOT EXISTS BetRollup (
+        bucket TEXT NOT NULL,
+        rid TEXT NOT NULL,
+        bets INTEGER NOT NULL DEFAULT 0,
+        total REAL NOT NULL DEFAULT 0,
+        maxBet REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, rid)
+    )""",
+    """CREATE TABLE IF NOT EXISTS SessionRollup (
+        bucket TEXT NOT NULL,
+        rid TEXT NOT NULL,
+        roomType TEXT,
+        sessions INTEGER NOT NULL DEFAULT 0,
+        totalDuration REAL NOT NULL DEFAULT 0,
+        maxDuration REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, rid)
+    )""",
+    # Set once rows that predate the rollups have been counted into them
+    """CREATE TABLE IF NOT EXISTS RollupBackfill (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        completedAt TIMESTAMP NOT NULL
+    )""",
+    # Shard count the Chat/Bet rows were last laid out for (shards.py); no row means unsharded
+    """CREATE TABLE IF NOT EXISTS ShardLayout (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        shardCount INTEGER NOT NULL
+    )""",
+]
+
+# Schema of a shard file (shards.py): the per-room tables and their chat search
+# index. Shards hold no Users or Room rows, so there are no foreign keys.
+SHARD_MIGRATIONS = [
+    """CREATE TABLE IF NOT EXISTS Chat (
+        uid TEXT NOT NULL,
+        rid TEXT NOT NULL,
+        targetUid TEXT NULL,
+        comment TEXT NOT NULL,
+        createAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (uid, rid, createAt)
+    )""",
+    """CREATE TABLE IF NOT EXISTS Bet (
+        uid TEXT,
+        rid TEXT,
+        bet REAL DEFAULT 0.0,
+        createAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (uid, rid, createAt)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_chat_room_time ON Chat(rid, createAt)",
+    "CREATE INDEX IF NOT EXISTS idx_bet_room_time ON Bet(rid, createAt)",
+    *CHAT_SEARCH_SCHEMA,
+]
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that records statement latency"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            db_query_seconds.labels(statement_kind(sql)).observe(time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            db_query_seconds.labels(statement_kind(sql)).observe(time.perf_counter() - start)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors and commits record latency"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            db_commit_seconds.observe(time.perf_counter() - start)
+
+
+def connect(path: str = None, **kwargs) -> sqlite3.Connection:
+    """Open an instrumented connection with sqlite3.Row rows"""
+    conn = sqlite3.connect(path or DATABASE_PATH, factory=InstrumentedConnection, **kwargs)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def apply_migrations(conn: sqlite3.Connection, migrations: list = MIGRATIONS):
+    """Apply idempotent schema additions"""
+    for migration in migrations:
+        if callable(migration):
+            migration(conn)
+        else:
+            conn.execute(migration)
+    conn.commit()
+
 def init_database():
     """Initialize database with schema"""
     if not os.path.exists(DATABASE_PATH):
@@ -12,6 +227,7 @@ def init_database():
                 schema = f.read()
                 conn.executescript(schema)
             conn.commit()
+            apply_migrations(conn)
             print(f"Database initialized successfully at {DATABASE_PATH}")
         except Exception as e:
             print(f"Error initializing database: {e}")
@@ -20,3 +236,8 @@ def init_database():
             conn.close()
     else:
         print(f"Database already exists at {DATABASE_PATH}")
+        conn = sqlite3.connect(DATABASE_PATH)
+        try:
+            apply_migrations(conn)
+        finally:
+            conn.close()
@@ -0,0 +1,69 @@
+"""In-memory prefix index over Emoji.name for autocomplete
+
+Names are kept in sorted arrays keyed on their lowercase form, so a prefix
+lookup is a bisect to the first match and a walk over at most `limit`
+entries. Premium emojis only appear in the array searched for premium users
+(the same rule process_emoji_in_comment applies when expanding :name:), so
+normal users never walk past entries they cannot use.
+"""
+import bisect
+import sqlite3
+from typing import Dict, List, Tuple
+
+# Results returned when the caller does not ask for a number, and the most it may ask for
+EMOJI_SEARCH_LIMIT = 10
+EMOJI_SEARCH_MAX_LIMIT = 50
+
+
+class EmojiPrefixIndex:
+    """Emoji rows by name, searchable by case-insensitive name prefix
+
+    Kept in sync by upload_emoji and delete_emoji in this process; emojis
+    changed by other workers appear after their next startup.
+    """
+
+    def __init__(self):
+        self.rows: Dict[str, dict] = {}
+        # Sorted (name.lower(), name) for every emoji, and for regular (non-premium) ones only
+        self.all: List[Tuple[str, str]] = []
+        self.regular: List[Tuple[str, str]] = []
+
+    def load(self, conn: sqlite3.Connection):
+        self.rows = {row["name"]: dict(row) for row in conn.execute("SELECT * FROM Emoji")}
+        self.all = sorted((name.lower(), name) for name in self.rows)
+        self.regular = sorted((name.lower(), name) for name, row in self.rows.items() if not row["isPremium"])
+
+    def add(self, row):
+        row = dict(row)
+        name = row["name"]
+        if name in self.rows:
+            self.remove(name)
+        self.rows[name] = row
+        key = (name.lower(), name)
+        bisect.insort(self.all, key)
+        if not row["isPremium"]:
+            bisect.insort(self.regular, key)
+
+    def remove(self, name: str):
+        row = self.rows.pop(name, None)
+        if row is None:
+            return
+        key = (name.lower(), name)
+        for keys in (self.all, self.regular) if not row["isPremium"] else (self.all,):
+            index = bisect.bisect_left(keys, key)
+            if index < len(keys) and keys[index] == key:
+                del keys[index]
+
+    def search(self, prefix: str, user_type: str, limit: int = EMOJI_SEARCH_LIMIT) -> List[dict]:
+        """Up to limit emojis the user may send whose name starts with prefix, in name order"""
+        keys = self.all if user_type == "premium" else self.regular
+        prefix = prefix.lower()
+        results = []
+        index = bisect.bisect_left(keys, (prefix, ""))
+        while index < len(keys) and len(results) < limit:
+            lowered, name = keys[index]
+            if not lowered.startswith(prefix):
+                break
+            results.append(self.rows[name])
+            index += 1
+        return results
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import math
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+from fastapi import WebSocket
+
+# Heartbeat configuration (seconds)
+HEARTBEAT_INTERVAL = 30.0  # Inbound silence before the server sends a ping
+HEARTBEAT_TIMEOUT = 10.0   # Time allowed for any frame to arrive after a ping
+HEARTBEAT_TICK = 1.0       # Resolution of the timer wheel
+HEARTBEAT_SEND_TIMEOUT = 2.0  # Longest a ping or close may block (a half-open peer's send buffer fills up)
+
+# Close code sent to sockets that missed their heartbeat
+HEARTBEAT_CLOSE_CODE = 4408
+
+
+class TimerWheel:
+    """Hashed timer wheel shared by every tracked connection
+
+    Scheduling and cancelling are O(1); each tick only looks at a single slot,
+    so the cost of a tick grows with the number of timers due, not with the
+    number of open sockets.
+    """
+
+    def __init__(self, slots: int, tick: float):
+        self.tick = tick
+        self.slots: List[Set[Hashable]] = [set() for _ in range(slots)]
+        self.current_tick = 0
+        # Absolute tick each key is due at: {key: tick}
+        self.deadlines: Dict[Hashable, int] = {}
+
+    def schedule(self, key: Hashable, delay: float):
+        """(Re)schedule key to fire after delay seconds"""
+        self.cancel(key)
+        due = self.current_tick + max(1, math.ceil(delay / self.tick))
+        self.slots[due % len(self.slots)].add(key)
+        self.deadlines[key] = due
+
+    def cancel(self, key: Hashable):
+        """Remove key from the wheel if scheduled"""
+        due = self.deadlines.pop(key, None)
+        if due is not None:
+            self.slots[due % len(self.slots)].discard(key)
+
+    def advance(self) -> List[Hashable]:
+        """Move forward one tick and return the keys that expired"""
+        self.current_tick += 1
+        slot = self.slots[self.current_tick % len(self.slots)]
+        # Keys scheduled more than one rotation ahead stay in the slot
+        expired = [key for key in slot if self.deadlines[key] <= self.current_tick]
+        for key in expired:
+            slot.discard(key)
+            del self.deadlines[key]
+        return expired
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+
+class TrackedConnection:
+    """Heartbeat state for one WebSocket"""
+    __slots__ = ("websocket", "kind", "on_reap", "last_seen", "pinged_at")
+
+    def __init__(self, websocket: WebSocket, kind: str, on_reap: Optional[Callable[[], Awaitable[None]]]):
+        self.websocket = websocket
+        self.kind = kind
+        self.on_reap = on_reap
+        self.last_seen = time.monotonic()
+        self.pinged_at: Optional[float] = None
+
+
+class HeartbeatScheduler:
+    """Pings idle WebSockets and reaps the ones that stop answering
+
+    Handlers call touch() whenever a frame arrives, which only stores a
+    timestamp. A single background task advances the timer wheel, pings
+    sockets that have been silent for `interval` seconds and reaps sockets that
+    send nothing within `timeout` seconds of the ping.
+    """
+
+    def __init__(self, interval: float = HEARTBEAT_INTERVAL, timeout: float = HEARTBEAT_TIMEOUT,
+                 tick: float = HEARTBEAT_TICK):
+        self.interval = interval
+        self.timeout = timeout
+        self.wheel = TimerWheel(int(math.ceil(max(interval, timeout) / tick)) + 1, tick)
+        # Tracked sockets: {websocket: TrackedConnection}
+        self.connections: Dict[WebSocket, TrackedConnection] = {}
+        # Reaped socket counts: {kind: count}
+        self.reaped: Dict[str, int] = {}
+        self.pings_sent = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, websocket: WebSocket, kind: str,
+                 on_reap: Optional[Callable[[], Awaitable[None]]] = None):
+        """Start tracking a socket; on_reap removes it from its registry"""
+        self.connections[websocket] = TrackedConnection(websocket, kind, on_reap)
+        self.wheel.schedule(websocket, self.interval)
+
+    def unregister(self, websocket: WebSocket):
+        """Stop tracking a socket (normal disconnect)"""
+        if self.connections.pop(websocket, None) is not None:
+            self.wheel.cancel(websocket)
+
+    def touch(self, websocket: WebSocket):
+        """Record inbound traffic on a socket"""
+        tracked = self.connections.get(websocket)
+        if tracked is not None:
+            tracked.last_seen = time.monotonic()
+
+    async def _check(self, websocket: WebSocket):
+        """Handle a socket whose timer expired"""
+        tracked = self.connections.get(websocket)
+        if tracked is None:
+            return
+
+        now = time.monotonic()
+        if tracked.pinged_at is not None:
+            if tracked.last_seen < tracked.pinged_at:
+                await self.reap(websocket, "heartbeat timeout")
+                return
+            tracked.pinged_at = None
+
+        idle = now - tracked.last_seen
+        if idle < self.interval:
+            self.wheel.schedule(websocket, self.interval - idle)
+            return
+
+        try:
+            await asyncio.wait_for(websocket.send_text(json.dumps({
+                "type": "ping",
+                "timestamp": datetime.now().isoformat()
+            })), HEARTBEAT_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            await self.reap(websocket, "ping timed out")
+            return
+        except Exception:
+            await self.reap(websocket, "ping failed")
+            return
+
+        self.pings_sent += 1
+        tracked.pinged_at = now
+        self.wheel.schedule(websocket, self.timeout)
+
+    async def reap(self, websocket: WebSocket, reason: str):
+        """Drop a dead socket from tracking and from its owning registry"""
+        tracked = self.connections.pop(websocket, None)
+        if tracked is None:
+            return
+        self.wheel.cancel(websocket)
+        self.reaped[tracked.kind] = self.reaped.get(tracked.kind, 0) + 1
+        print(f"[heartbeat] Reaped {tracked.kind} connection: {reason}")
+
+        if tracked.on_reap is not None:
+            try:
+                await tracked.on_reap()
+            except Exception as e:
+                print(f"[heartbeat] Error cleaning up {tracked.kind} connection: {e}")
+
+        try:
+            await asyncio.wait_for(websocket.close(code=HEARTBEAT_CLOSE_CODE, reason="Heartbeat timeout"),
+                                   HEARTBEAT_SEND_TIMEOUT)
+        except Exception:
+            pass
+
+    async def tick_once(self):
+        """Advance the wheel one slot and process expired timers
+
+        The due sockets are checked concurrently and each ping or close is
+        bounded by HEARTBEAT_SEND_TIMEOUT, so a peer that stopped reading
+        delays a tick by at most that and never holds up the others.
+        """
+        expired = self.wheel.advance()
+        if expired:
+            await asyncio.gather(*(self._check(websocket) for websocket in expired))
+
+    async def run(self):
+        """Drive the wheel until cancelled"""
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self.wheel.tick
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            try:
+                await self.tick_once()
+            except Exception as e:
+                print(f"[heartbeat] Error during tick: {e}")
+
+    def start(self):
+        """Start the background task on the running loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Cancel the background task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        """Tracked and reaped counts for reporting"""
+        tracked: Dict[str, int] = {}
+        for conn in self.connections.values():
+            tracked[conn.kind] = tracked.get(conn.kind, 0) + 1
+        return {
+            "interval": self.interval,
+            "timeout": self.timeout,
+            "tracked": tracked,
+            "pings_sent": self.pings_sent,
+            "reaped": dict(self.reaped),
+            "reaped_total": sum(self.reaped.values())
+        }
@@ -0,0 +1,170 @@
+import asyncio
+import heapq
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Close code sent to chat and signaling sockets when their room closes
+ROOM_CLOSED_CODE = 4410
+
+# Longest the scheduler sleeps without re-checking the clock (seconds)
+MAX_SLEEP = 60.0
+# Delay before retrying rooms whose close failed (e.g. database is locked) (seconds)
+CLOSE_RETRY_DELAY = 5.0
+
+
+def room_expiry(create_at: str, duration: float) -> Optional[float]:
+    """Epoch seconds at which a room closes, or None if it never does
+
+    Room.createAt is SQLite's CURRENT_TIMESTAMP (UTC); duration is in seconds.
+    """
+    if not duration or duration <= 0 or not create_at:
+        return None
+    try:
+        created = datetime.fromisoformat(create_at)
+    except ValueError:
+        return None
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    return created.timestamp() + duration
+
+
+def close_rooms(conn: sqlite3.Connection, expired: List[Tuple[str, float]],
+                on_session: Optional[Callable[[str, str, float], None]] = None) -> Dict[str, List[str]]:
+    """Mark rooms closed and finalize their open RoomUser sessions
+
+    Sessions end at the room's expiry rather than now, so time the server was
+    down is not counted; durations are computed as in leave_room. Everything
+    happens in one transaction. Returns {rid: [uid, ...]} for rooms that were
+    still open, listing the sessions that were finalized. After the commit,
+    on_session(rid, leaveAt, duration) is called for each finalized session.
+    """
+    closed_at = datetime.now().isoformat()
+    cursor = conn.cursor()
+    finalized: Dict[str, List[str]] = {}
+    # (leaveAt, duration, uid, rid) of every finalized session
+    ended: List[Tuple[str, float, str, str]] = []
+    for rid, expires_at in expired:
+        cursor.execute("UPDATE Room SET closedAt = ? WHERE rid = ? AND closedAt IS NULL", (closed_at, rid))
+        if cursor.rowcount == 0:
+            continue
+        leave_time = datetime.fromtimestamp(min(expires_at, time.time()))
+        cursor.execute("SELECT uid, joinAt FROM RoomUser WHERE rid = ? AND leaveAt IS NULL", (rid,))
+        sessions = cursor.fetchall()
+        updates = [(leave_time.isoformat(), max(0.0, (leave_time - datetime.fromisoformat(row["joinAt"])).total_seconds()),
+                    row["uid"], rid) for row in sessions]
+        cursor.executemany(
+            "UPDATE RoomUser SET leaveAt = ?, duration = ? WHERE uid = ? AND rid = ? AND leaveAt IS NULL",
+            updates
+        )
+        ended.extend(updates)
+        finalized[rid] = [row["uid"] for row in sessions]
+    conn.commit()
+    if on_session is not None:
+        for leave_at, duration, _, rid in ended:
+            on_session(rid, leave_at, duration)
+    return finalized
+
+
+class RoomLifecycleScheduler:
+    """Closes rooms when their Room.duration runs out
+
+    Room lifetimes vary from minutes to days, so deadlines live in a min-heap
+    (cancelled or rescheduled entries are skipped lazily when popped). One
+    task sleeps until the earliest deadline and hands every room due at that
+    point to on_expire in a single batch. If on_expire fails, the batch is
+    retried after CLOSE_RETRY_DELAY, still with the rooms' original expiry.
+    """
+
+    def __init__(self, on_expire: Callable[[List[Tuple[str, float]]], Awaitable[None]]):
+        self.on_expire = on_expire
+        # (fire_at, rid, expires_at); fire_at is later than expires_at only for retries
+        self.heap: List[Tuple[float, str, float]] = []
+        # Current deadline per room: {rid: expires_at}
+        self.deadlines: Dict[str, float] = {}
+        self.rooms_closed = 0
+        self.close_failures = 0
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def schedule(self, rid: str, expires_at: float, fire_at: Optional[float] = None):
+        """(Re)schedule a room to close at expires_at (epoch seconds), handled at fire_at if given"""
+        entry = (expires_at if fire_at is None else fire_at, rid, expires_at)
+        self.deadlines[rid] = expires_at
+        heapq.heappush(self.heap, entry)
+        if self._wake is not None and self.heap[0] == entry:
+            self._wake.set()
+
+    def schedule_room(self, rid: str, create_at: str, duration: float):
+        expires_at = room_expiry(create_at, duration)
+        if expires_at is not None:
+            self.schedule(rid, expires_at)
+
+    def cancel(self, rid: str):
+        self.deadlines.pop(rid, None)
+
+    def load(self, conn: sqlite3.Connection):
+        """Schedule every open room (rooms already past due close on the first run)"""
+        cursor = conn.cursor()
+        cursor.execute("SELECT rid, createAt, duration FROM Room WHERE closedAt IS NULL")
+        for row in cursor.fetchall():
+            self.schedule_room(row["rid"], row["createAt"], row["duration"])
+
+    def pop_due(self, now: float) -> List[Tuple[str, float]]:
+        """Remove and return (rid, expires_at) for every room due by now"""
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            _, rid, expires_at = heapq.heappop(self.heap)
+            if self.deadlines.get(rid) == expires_at:
+                del self.deadlines[rid]
+                due.append((rid, expires_at))
+        return due
+
+    async def run(self):
+        self._wake = asyncio.Event()
+        while True:
+            due = self.pop_due(time.time())
+            if due:
+                try:
+                    await self.on_expire(due)
+                    self.rooms_closed += len(due)
+                except Exception as e:
+                    self.close_failures += 1
+                    print(f"[lifecycle] Failed to close {len(due)} expired rooms, retrying in "
+                          f"{CLOSE_RETRY_DELAY:g}s: {e}")
+                    retry_at = time.time() + CLOSE_RETRY_DELAY
+                    for rid, expires_at in due:
+                        # Unless the room was rescheduled or cancelled meanwhile
+                        if rid not in self.deadlines:
+                            self.schedule(rid, expires_at, retry_at)
+            delay = MAX_SLEEP
+            if self.heap:
+                delay = min(MAX_SLEEP, max(0.0, self.heap[0][0] - time.time()))
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        next_expiry = min(self.deadlines.values()) if self.deadlines else None
+        return {
+            "scheduled_rooms": len(self.deadlines),
+            "next_expiry": datetime.fromtimestamp(next_expiry).isoformat() if next_expiry is not None else None,
+            "rooms_closed": self.rooms_closed,
+            "close_failures": self.close_failures
+        }
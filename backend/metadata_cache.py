@@ -0,0 +1,187 @@
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from metrics import registry
+
+# Seconds a cached row is trusted before it is read again. Writes made through
+# this process update the cache directly; the TTL bounds how long a change
+# made by another process can go unseen.
+METADATA_TTL = 300.0
+# Entries kept per cache before the least recently used are evicted
+MAX_CACHED_USERS = 10000
+MAX_CACHED_ROOMS = 5000
+MAX_CACHED_EMOJIS = 2000
+
+cache_requests = registry.counter(
+    "publicpooper_metadata_cache_requests_total", "User/room metadata cache lookups", ["cache", "result"])
+
+
+class LRUTTLCache:
+    """Bounded LRU whose entries also expire ttl seconds after being stored"""
+
+    def __init__(self, name: str, max_size: int, ttl: float):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        # {key: (expires_at, value)}, least recently used first
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self._hit = cache_requests.labels(name, "hit")
+        self._miss = cache_requests.labels(name, "miss")
+
+    def get(self, key: Hashable):
+        """Cached value, or None when missing or expired (counted as a miss)"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self._hit.inc()
+                return entry[1]
+            del self.entries[key]
+            self.expirations += 1
+        self.misses += 1
+        self._miss.inc()
+        return None
+
+    def put(self, key: Hashable, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, key: Hashable):
+        """Cached value without counting a hit or miss or refreshing its LRU position"""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def invalidate(self, key: Hashable):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "expirations": self.expirations,
+            "evictions": self.evictions
+        }
+
+
+class MetadataCache:
+    """Read-through cache of Users, Room and Emoji rows, keyed by uid / rid / name
+
+    Rows are stored as plain dicts (whole rows, so any column can be read
+    from a hit) and must not be mutated by callers. Lookups of ids that do
+    not exist are not cached, so a row created by another process is found
+    on the next request. Room names map to rids in their own cache; names
+    never change, so only the rid entry carries the row.
+    """
+
+    def __init__(self, ttl: float = METADATA_TTL, max_users: int = MAX_CACHED_USERS,
+                 max_rooms: int = MAX_CACHED_ROOMS, max_emojis: int = MAX_CACHED_EMOJIS):
+        self.users = LRUTTLCache("user", max_users, ttl)
+        self.rooms = LRUTTLCache("room", max_rooms, ttl)
+        self.room_names = LRUTTLCache("room_name", max_rooms, ttl)
+        self.emojis = LRUTTLCache("emoji", max_emojis, ttl)
+
+    def user(self, conn: sqlite3.Connection, uid: str) -> Optional[dict]:
+        row = self.users.get(uid)
+        if row is None:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM Users WHERE uid = ?", (uid,))
+            found = cursor.fetchone()
+            if found is not None:
+                row = self.put_user(found)
+        return row
+
+    def has_user(self, uid: str) -> bool:
+        """Whether uid is cached (so known to exist); never queries the database"""
+        return self.users.peek(uid) is not None
+
+    def room(self, conn: sqlite3.Connection, rid: str) -> Optional[dict]:
+        row = self.rooms.get(rid)
+        if row is None:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM Room WHERE rid = ?", (rid,))
+            found = cursor.fetchone()
+            if found is not None:
+                row = self.put_room(found)
+        return row
+
+    def room_by_name(self, conn: sqlite3.Connection, rname: str) -> Optional[dict]:
+        rid = self.room_names.get(rname)
+        if rid is not None:
+            row = self.room(conn, rid)
+            if row is not None:
+                return row
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM Room WHERE rname = ?", (rname,))
+        found = cursor.fetchone()
+        return self.put_room(found) if found is not None else None
+
+    def emoji(self, conn: sqlite3.Connection, name: str) -> Optional[dict]:
+        row = self.emojis.get(name)
+        if row is None:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM Emoji WHERE name = ?", (name,))
+            found = cursor.fetchone()
+            if found is not None:
+                row = self.put_emoji(found)
+        return row
+
+    def put_user(self, row) -> dict:
+        row = dict(row)
+        self.users.put(row["uid"], row)
+        return row
+
+    def put_room(self, row) -> dict:
+        row = dict(row)
+        self.rooms.put(row["rid"], row)
+        if row.get("rname") is not None:
+            self.room_names.put(row["rname"], row["rid"])
+        return row
+
+    def put_emoji(self, row) -> dict:
+        row = dict(row)
+        self.emojis.put(row["name"], row)
+        return row
+
+    def invalidate_user(self, uid: str):
+        self.users.invalidate(uid)
+
+    def invalidate_room(self, rid: str):
+        # The name entry only points at the rid, so it can stay
+        self.rooms.invalidate(rid)
+
+    def invalidate_emoji(self, name: str):
+        self.emojis.invalidate(name)
+
+    def clear(self):
+        self.users.clear()
+        self.rooms.clear()
+        self.room_names.clear()
+        self.emojis.clear()
+
+    def stats(self) -> dict:
+        return {
+            "users": self.users.stats(),
+            "rooms": self.rooms.stats(),
+            "room_names": self.room_names.stats(),
+            "emojis": self.emojis.stats()
+        }
@@ -0,0 +1,320 @@
+import asyncio
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond SQLite calls up to slow requests
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Recipients-per-broadcast buckets
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# How often the event-loop lag probe wakes up (seconds)
+LOOP_LAG_INTERVAL = 0.5
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    """Base class: a named family of children keyed by label values"""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Children by label values: {(value, ...): child}
+        self.children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self.children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Child for the given label values (cached, so repeat lookups are one dict get)"""
+        child = self.children.get(values)
+        if child is None:
+            with self._lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = self.children[values] = self._new_child()
+        return child
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self.children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonic counter"""
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.children[()].inc(amount)
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.children[()].inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.children[()].dec(amount)
+
+    def set(self, value: float):
+        self.children[()].set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("upper_bounds", "counts", "sum", "lock")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        # Per-bucket (non-cumulative) counts; the last slot is +Inf
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.upper_bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; observe() is a bisect plus two additions"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.children[()].observe(value)
+
+    def _render_child(self, values, child) -> List[str]:
+        with child.lock:
+            counts = list(child.counts)
+            total = child.sum
+        lines = []
+        cumulative = 0
+        for upper, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{_format_value(upper)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Callback(_Metric):
+    """Metric whose samples are computed at scrape time, costing nothing on the hot path
+
+    fn returns either a single number (no labels) or an iterable of
+    (label_values, value) pairs.
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str,
+                 fn: Callable[[], object], labelnames: Sequence[str] = ()):
+        self.kind = kind
+        self.fn = fn
+        super().__init__(name, documentation, labelnames)
+        self.children = {}
+
+    def _new_child(self):
+        return None
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            samples = self.fn()
+        except Exception:
+            return lines
+        if not self.labelnames:
+            samples = [((), samples)]
+        for values, value in samples:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together in text exposition format"""
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, kind: str, fn: Callable[[], object],
+                 labelnames: Sequence[str] = ()) -> Callback:
+        return self.register(Callback(name, documentation, kind, fn, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Default registry shared by the API process
+registry = Registry()
+
+# SQLite
+db_query_seconds = registry.histogram(
+    "publicpooper_db_query_seconds", "SQLite statement execution latency", ["statement"])
+db_commit_seconds = registry.histogram(
+    "publicpooper_db_commit_seconds", "SQLite commit latency")
+
+# HTTP
+http_request_seconds = registry.histogram(
+    "publicpooper_http_request_seconds", "HTTP request latency by route", ["method", "route", "status"])
+
+# Chat fan-out
+broadcast_seconds = registry.histogram(
+    "publicpooper_broadcast_seconds", "Time to fan a message out to a room")
+broadcast_recipients = registry.histogram(
+    "publicpooper_broadcast_recipients", "Recipients per room broadcast", buckets=FANOUT_BUCKETS)
+directed_messages = registry.counter(
+    "publicpooper_directed_messages_total", "Targeted chat messages sent to sender and target only")
+
+# Signaling
+SIGNALING_TYPES = {"offer", "answer", "ice-candidate", "viewer-joined", "ping", "pong"}
+signaling_messages = registry.counter(
+    "publicpooper_signaling_messages_total", "Signaling messages received by role and type", ["role", "type"])
+
+# Event loop
+loop_lag_seconds = registry.histogram(
+    "publicpooper_event_loop_lag_seconds", "Delay between a scheduled wake-up and when it ran")
+loop_lag_current = registry.gauge(
+    "publicpooper_event_loop_lag_current_seconds", "Most recent event-loop lag sample")
+
+
+def statement_kind(sql: str) -> str:
+    """First keyword of a SQL statement, used as a low-cardinality label"""
+    head = sql.lstrip()[:8].upper()
+    for kind in ("SELECT", "INSERT", "UPDATE", "DELETE", "CREATE"):
+        if head.startswith(kind):
+            return kind
+    return "OTHER"
+
+
+def signaling_type_label(message_type: str) -> str:
+    """Clamp client-supplied message types to a fixed label set"""
+    return message_type if message_type in SIGNALING_TYPES else "other"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route HTTP latency
+
+    Labels use the route template (e.g. /rooms/{rid}/chat) rather than the
+    raw path so label cardinality stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            http_request_seconds.labels(scope["method"], route_path, str(status_holder[0])).observe(
+                time.perf_counter() - start)
+
+
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    """Sample event-loop lag until cancelled"""
+    while True:
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - expected)
+        loop_lag_seconds.observe(lag)
+        loop_lag_current.set(lag)
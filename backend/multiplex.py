@@ -0,0 +1,106 @@
+import asyncio
+from typing import Dict, List, Set, Union
+
+from fastapi import WebSocket
+
+import protocol
+
+# Streams one multiplexed socket may be attached to at once
+MAX_MULTIPLEXED_STREAMS = 64
+
+
+class StreamChannel:
+    """One stream's viewer slot on a multiplexed signaling socket
+
+    Sits in the stream registries (streams, viewer ids, codecs) exactly where
+    a viewer WebSocket would, so broadcaster frames are routed to it
+    unchanged. Sending tags the already-encoded frame with streamId by
+    splicing (codec.inject) and writes it to the shared socket.
+    """
+    __slots__ = ("subscriber", "stream_id")
+
+    def __init__(self, subscriber: "MultiplexSubscriber", stream_id: str):
+        self.subscriber = subscriber
+        self.stream_id = stream_id
+
+    def _tag(self, payload: Union[str, bytes]) -> Union[str, bytes]:
+        codec = protocol.JSON if isinstance(payload, str) else self.subscriber.codec
+        tagged = codec.inject(payload, "streamId", self.stream_id)
+        if tagged is None:
+            tagged = codec.encode({**codec.decode(payload), "streamId": self.stream_id})
+        return tagged
+
+    async def send_text(self, data: str):
+        await self.subscriber.websocket.send_text(self._tag(data))
+
+    async def send_bytes(self, data: bytes):
+        await self.subscriber.websocket.send_bytes(self._tag(data))
+
+    async def close(self, code: int = 1000):
+        """The stream was torn down under this channel; tell the subscriber instead of closing the socket"""
+        if self.subscriber.channels.get(self.stream_id) is self:
+            del self.subscriber.channels[self.stream_id]
+            self.subscriber.notify({"type": "stream-stopped", "streamId": self.stream_id, "code": code})
+
+
+class MultiplexSubscriber:
+    """A signaling socket watching many streams"""
+
+    def __init__(self, websocket: WebSocket, codec, coalesce: bool = False):
+        self.websocket = websocket
+        self.codec = codec
+        self.coalesce = coalesce
+        # Follow every live stream, including ones that start later
+        self.watch_all = False
+        # Streams subscribed to by id (stay attached while their broadcaster is away)
+        self.streams: Set[str] = set()
+        # Attached viewer slots: {stream_id: channel}
+        self.channels: Dict[str, StreamChannel] = {}
+
+    def wants(self, stream_id: str) -> bool:
+        return self.watch_all or stream_id in self.streams
+
+    def notify(self, message: dict):
+        """Queue a control message without waiting for the socket"""
+        asyncio.create_task(self._send_quietly(message))
+
+    async def _send_quietly(self, message: dict):
+        try:
+            await protocol.send_message(self.websocket, self.codec, message)
+        except Exception as e:
+            # The socket's own receive loop notices the disconnect and cleans up
+            print(f"[multiplex] Failed to send {message.get('type')}: {e}")
+
+
+class SignalingMultiplexer:
+    """Registry of multiplexed signaling sockets (/signal/multi)"""
+
+    def __init__(self):
+        self.subscribers: Dict[WebSocket, MultiplexSubscriber] = {}
+        self.events_sent = 0
+
+    def add(self, websocket: WebSocket, codec, coalesce: bool = False) -> MultiplexSubscriber:
+        subscriber = self.subscribers[websocket] = MultiplexSubscriber(websocket, codec, coalesce)
+        return subscriber
+
+    def remove(self, websocket: WebSocket):
+        return self.subscribers.pop(websocket, None)
+
+    def interested(self, stream_id: str) -> List[MultiplexSubscriber]:
+        return [subscriber for subscriber in self.subscribers.values() if subscriber.wants(stream_id)]
+
+    def publish(self, stream_id: str, message: dict) -> List[MultiplexSubscriber]:
+        """Send a stream event to every subscriber following stream_id; returns them"""
+        subscribers = self.interested(stream_id)
+        for subscriber in subscribers:
+            subscriber.notify(message)
+        self.events_sent += len(subscribers)
+        return subscribers
+
+    def stats(self) -> dict:
+        return {
+            "sockets": len(self.subscribers),
+            "watch_all_sockets": sum(1 for subscriber in self.subscribers.values() if subscriber.watch_all),
+            "channels": sum(len(subscriber.channels) for subscriber in self.subscribers.values()),
+            "events_sent": self.events_sent
+        }
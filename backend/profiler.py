@@ -0,0 +1,189 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Dict, Optional
+
+from metrics import registry
+
+# A loop callback blocking longer than this is recorded as a stall (milliseconds)
+STALL_THRESHOLD_MS = 100.0
+# How often the loop proves it is alive; also bounds watchdog detection latency
+WATCHDOG_BEAT_MS = 20.0
+# Default sampling period for the opt-in profiler
+SAMPLE_INTERVAL_MS = 5.0
+# Recent stalls kept for the admin report
+MAX_STALLS = 100
+# Distinct stacks kept by the sampling profiler
+MAX_SAMPLED_STACKS = 5000
+# Frames kept per captured stack
+STACK_DEPTH = 40
+
+loop_stalls = registry.counter(
+    "publicpooper_event_loop_stalls_total", "Event-loop stalls over the watchdog threshold by handler", ["handler"])
+
+
+class LoopProfiler:
+    """Event-loop stall watchdog with an opt-in sampling profiler
+
+    A coroutine on the loop stamps a heartbeat every WATCHDOG_BEAT_MS. A
+    daemon thread watches the stamp; when it goes stale for longer than the
+    threshold, the loop thread's current stack is captured and attributed to
+    the route or WebSocket handler found on it. The sampling profiler reuses
+    the same thread to collect folded stacks at a fixed interval while enabled.
+    """
+
+    def __init__(self, threshold_ms: float = STALL_THRESHOLD_MS):
+        self.threshold = threshold_ms / 1000.0
+        # Endpoint code objects -> handler label ("GET /rooms/{rid}", "WS /ws/...")
+        self.handlers: Dict[object, str] = {}
+        self.stalls = deque(maxlen=MAX_STALLS)
+        # Per-handler stall totals: {handler: {"count": int, "total_ms": float, "max_ms": float}}
+        self.stall_totals: Dict[str, dict] = {}
+        self.loop_thread_id: Optional[int] = None
+        self.last_beat = time.perf_counter()
+        self.sampling = False
+        self.sample_interval = SAMPLE_INTERVAL_MS / 1000.0
+        # Folded stack -> sample count
+        self.samples: Dict[str, int] = {}
+        self.sample_count = 0
+        self._beat_task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def register_routes(self, routes):
+        """Map each endpoint function to a readable handler label"""
+        for route in routes:
+            endpoint = getattr(route, "endpoint", None)
+            code = getattr(endpoint, "__code__", None)
+            if code is None:
+                continue
+            methods = getattr(route, "methods", None)
+            prefix = ",".join(sorted(methods)) if methods else "WS"
+            self.handlers[code] = f"{prefix} {route.path}"
+
+    def attribute(self, frame) -> str:
+        """Handler label for the outermost endpoint frame on a stack"""
+        handler = None
+        while frame is not None:
+            label = self.handlers.get(frame.f_code)
+            if label is not None:
+                handler = label
+            frame = frame.f_back
+        return handler or "unattributed"
+
+    def _loop_frame(self):
+        return sys._current_frames().get(self.loop_thread_id)
+
+    async def _beat(self):
+        interval = WATCHDOG_BEAT_MS / 1000.0
+        while True:
+            self.last_beat = time.perf_counter()
+            await asyncio.sleep(interval)
+
+    def _watch(self):
+        stall = None
+        next_sample = time.perf_counter()
+        while not self._stop.is_set():
+            period = min(WATCHDOG_BEAT_MS / 1000.0, self.sample_interval) if self.sampling else WATCHDOG_BEAT_MS / 1000.0
+            self._stop.wait(period / 2)
+            now = time.perf_counter()
+            blocked_for = now - self.last_beat - WATCHDOG_BEAT_MS / 1000.0
+
+            if stall is None and blocked_for > self.threshold:
+                frame = self._loop_frame()
+                if frame is not None:
+                    stall = {
+                        "started": datetime.now().isoformat(),
+                        "handler": self.attribute(frame),
+                        "stack": traceback.format_list(traceback.extract_stack(frame, limit=STACK_DEPTH)),
+                        "beat": self.last_beat
+                    }
+            elif stall is not None and self.last_beat != stall["beat"]:
+                # Loop is running again: close out the stall
+                duration_ms = (self.last_beat - stall.pop("beat")) * 1000.0 - WATCHDOG_BEAT_MS
+                stall["duration_ms"] = round(max(duration_ms, self.threshold * 1000.0), 1)
+                self._record_stall(stall)
+                stall = None
+
+            if self.sampling and now >= next_sample:
+                next_sample = now + self.sample_interval
+                frame = self._loop_frame()
+                if frame is not None:
+                    self._record_sample(frame)
+
+    def _record_stall(self, stall: dict):
+        self.stalls.append(stall)
+        totals = self.stall_totals.setdefault(stall["handler"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        totals["count"] += 1
+        totals["total_ms"] += stall["duration_ms"]
+        totals["max_ms"] = max(totals["max_ms"], stall["duration_ms"])
+        loop_stalls.labels(stall["handler"]).inc()
+        print(f"[profiler] Event loop blocked {stall['duration_ms']}ms in {stall['handler']}")
+
+    def _record_sample(self, frame):
+        stack = traceback.extract_stack(frame, limit=STACK_DEPTH)
+        folded = ";".join(f"{entry.name} ({entry.filename.rsplit('/', 1)[-1]}:{entry.lineno})" for entry in stack)
+        self.sample_count += 1
+        if folded in self.samples or len(self.samples) < MAX_SAMPLED_STACKS:
+            self.samples[folded] = self.samples.get(folded, 0) + 1
+
+    def start(self):
+        """Start the watchdog; must be called from the event-loop thread"""
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.perf_counter()
+        if self._beat_task is None or self._beat_task.done():
+            self._beat_task = asyncio.create_task(self._beat())
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._thread.start()
+
+    async def stop(self):
+        """Stop the watchdog thread and beat task"""
+        self._stop.set()
+        if self._beat_task is not None:
+            self._beat_task.cancel()
+            try:
+                await self._beat_task
+            except asyncio.CancelledError:
+                pass
+            self._beat_task = None
+
+    def start_sampling(self, interval_ms: float = SAMPLE_INTERVAL_MS):
+        """Enable the sampling profiler (clears previous samples)"""
+        self.sample_interval = max(interval_ms, 1.0) / 1000.0
+        self.samples = {}
+        self.sample_count = 0
+        self.sampling = True
+
+    def stop_sampling(self):
+        self.sampling = False
+
+    def report(self, top: int = 20) -> dict:
+        """Stall history, per-handler totals and the hottest sampled stacks"""
+        hottest = sorted(self.samples.items(), key=lambda item: item[1], reverse=True)[:top]
+        return {
+            "threshold_ms": self.threshold * 1000.0,
+            "stall_totals": self.stall_totals,
+            "recent_stalls": list(self.stalls),
+            "sampling": {
+                "enabled": self.sampling,
+                "interval_ms": self.sample_interval * 1000.0,
+                "samples": self.sample_count,
+                "top_stacks": [
+                    {"stack": folded, "count": count,
+                     "percent": round(100.0 * count / self.sample_count, 2) if self.sample_count else 0.0}
+                    for folded, count in hottest
+                ]
+            }
+        }
+
+    def reset(self):
+        self.stalls.clear()
+        self.stall_totals = {}
+        self.samples = {}
+        self.sample_count = 0
@@ -0,0 +1,192 @@
+"""WebSocket wire encodings for /ws/... and /signal/...
+
+Clients pick an encoding with the WebSocket subprotocol header:
+
+    new WebSocket(url, ["pp.msgpack.v1", "pp.json.v1"])
+
+- pp.json.v1 (default, also used when no subprotocol is offered): JSON text
+  frames, exactly as before
+- pp.msgpack.v1: MessagePack binary frames. Known keys are replaced by small
+  integer field IDs, known "type" values by integer type IDs, and ISO
+  "timestamp" strings by integer epoch milliseconds. Unknown keys and types
+  pass through unchanged, so new fields never break old clients.
+
+Text frames are always JSON, whichever encoding was negotiated (server
+heartbeat pings are sent as JSON text).
+
+Signaling sockets that opt in to coalescing may receive
+{"type": "ice-candidates", "messages": [...]} carrying several messages that
+arrived within a few milliseconds of each other, in order.
+"""
+import json
+from datetime import datetime
+from typing import List, Optional, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+try:
+    import msgpack
+except ImportError:  # Binary encoding is optional; JSON keeps working without it
+    msgpack = None
+
+# Field IDs for the compact encoding. Append only: IDs are part of the protocol.
+FIELDS = [
+    "type", "uid", "rid", "targetUid", "comment", "timestamp", "user_id", "message",
+    "viewerId", "sdp", "candidate", "total", "count", "bettors", "messages",
+    "streamId", "streams", "code", "seq", "epoch", "replayed", "complete",
+]
+FIELD_IDS = {name: index for index, name in enumerate(FIELDS)}
+
+# Message type IDs for the compact encoding. Append only.
+TYPES = [
+    "chat", "user_joined", "user_left", "error", "ping", "pong", "pot_update",
+    "offer", "answer", "ice-candidate", "viewer-joined", "ice-candidates",
+    "subscribe", "unsubscribe", "streams", "stream-started", "stream-stopped",
+    "sync",
+]
+TYPE_IDS = {name: index for index, name in enumerate(TYPES)}
+
+TYPE_FIELD = FIELD_IDS["type"]
+TIMESTAMP_FIELD = FIELD_IDS["timestamp"]
+
+# Type of the frame carrying several coalesced signaling messages in "messages"
+BATCH_TYPE = "ice-candidates"
+
+
+class JsonCodec:
+    """JSON text frames (the original protocol)"""
+    name = "pp.json.v1"
+    binary = False
+
+    def encode(self, message: dict) -> str:
+        return json.dumps(message)
+
+    def decode(self, data: Union[str, bytes]) -> dict:
+        return json.loads(data)
+
+    def inject(self, payload: str, key: str, value) -> Optional[str]:
+        """Add a top-level key to an encoded object by splicing, without re-encoding it"""
+        body = payload.rstrip()
+        if not body.endswith("}"):
+            return None
+        body = body[:-1].rstrip()
+        separator = "" if body.endswith("{") else ", "
+        return f"{body}{separator}{json.dumps(key)}: {json.dumps(value)}}}"
+
+    def batch(self, payloads: List[str]) -> str:
+        """Wrap already-encoded messages in one frame"""
+        return f'{{"type": "{BATCH_TYPE}", "messages": [{", ".join(payloads)}]}}'
+
+
+class CompactCodec:
+    """MessagePack binary frames with integer field/type IDs and epoch-ms timestamps"""
+    name = "pp.msgpack.v1"
+    binary = True
+
+    def encode(self, message: dict) -> bytes:
+        compact = {}
+        for key, value in message.items():
+            field = FIELD_IDS.get(key, key)
+            if field == TYPE_FIELD:
+                value = TYPE_IDS.get(value, value)
+            elif field == TIMESTAMP_FIELD and isinstance(value, str):
+                try:
+                    value = int(datetime.fromisoformat(value).timestamp() * 1000)
+                except ValueError:
+                    pass
+            compact[field] = value
+        return msgpack.packb(compact, use_bin_type=True)
+
+    def decode(self, data: Union[str, bytes]) -> dict:
+        if isinstance(data, str):
+            return json.loads(data)
+        return self._expand(msgpack.unpackb(data, raw=False, strict_map_key=False))
+
+    def _expand(self, compact: dict) -> dict:
+        message = {}
+        for key, value in compact.items():
+            if isinstance(key, int) and 0 <= key < len(FIELDS):
+                key = FIELDS[key]
+            if key == "type" and isinstance(value, int) and 0 <= value < len(TYPES):
+                value = TYPES[value]
+            message[key] = value
+        if message.get("type") == BATCH_TYPE and isinstance(message.get("messages"), list):
+            message["messages"] = [self._expand(item) if isinstance(item, dict) else item
+                                   for item in message["messages"]]
+        return message
+
+    def inject(self, payload: bytes, key: str, value) -> Optional[bytes]:
+        """Add a top-level key by bumping the map header and appending the pair"""
+        if not payload:
+            return None
+        pair = msgpack.packb(FIELD_IDS.get(key, key)) + msgpack.packb(value, use_bin_type=True)
+        header = payload[0]
+        if 0x80 <= header < 0x8f:  # fixmap with room for one more entry
+            return bytes((header + 1,)) + payload[1:] + pair
+        if header == 0xde:  # map16
+            size = int.from_bytes(payload[1:3], "big")
+            if size < 0xffff:
+                return b"\xde" + (size + 1).to_bytes(2, "big") + payload[3:] + pair
+        return None
+
+    def batch(self, payloads: List[bytes]) -> bytes:
+        """Wrap already-encoded messages in one frame"""
+        packer = msgpack.Packer(use_bin_type=True)
+        return (packer.pack_map_header(2)
+                + packer.pack(TYPE_FIELD) + packer.pack(TYPE_IDS[BATCH_TYPE])
+                + packer.pack(FIELD_IDS["messages"]) + packer.pack_array_header(len(payloads))
+                + b"".join(payloads))
+
+
+JSON = JsonCodec()
+COMPACT = CompactCodec() if msgpack is not None else None
+
+# Encodings the server can speak, by subprotocol name
+CODECS = {codec.name: codec for codec in (JSON, COMPACT) if codec is not None}
+
+
+def negotiate(websocket: WebSocket):
+    """Pick the client's most preferred supported encoding
+
+    Returns (codec, subprotocol); subprotocol is None when the client offered
+    none we support, in which case JSON is used.
+    """
+    offered: List[str] = websocket.scope.get("subprotocols") or []
+    for name in offered:
+        codec = CODECS.get(name)
+        if codec is not None:
+            return codec, name
+    return JSON, None
+
+
+async def accept(websocket: WebSocket):
+    """Accept a WebSocket with the negotiated subprotocol and return its codec"""
+    codec, subprotocol = negotiate(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+    return codec
+
+
+async def send(websocket: WebSocket, payload: Union[str, bytes]):
+    """Send an already-encoded payload as a text or binary frame"""
+    if isinstance(payload, bytes):
+        await websocket.send_bytes(payload)
+    else:
+        await websocket.send_text(payload)
+
+
+async def send_message(websocket: WebSocket, codec, message: dict):
+    await send(websocket, codec.encode(message))
+
+
+async def receive_raw(websocket: WebSocket) -> Union[str, bytes]:
+    """Next text or binary frame; raises WebSocketDisconnect on close"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("text") is not None:
+        return message["text"]
+    return message.get("bytes") or b""
+
+
+async def receive_message(websocket: WebSocket, codec) -> dict:
+    return codec.decode(await receive_raw(websocket))
@@ -0,0 +1,256 @@
+import json
+import math
+import re
+import time
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from metrics import registry
+
+# Token-bucket limits as (sustained rate per second, burst). A client may send
+# `burst` messages back to back and then `rate` a second after that.
+# Chat messages per user, across HTTP and WebSocket
+USER_RATE, USER_BURST = 5.0, 20
+# Chat messages per room from everyone in it
+ROOM_RATE, ROOM_BURST = 100.0, 300
+# Signaling frames per stream from all of its peers (ICE trickles dozens per viewer)
+STREAM_RATE, STREAM_BURST = 500.0, 2000
+# Signaling frames per socket, so one peer cannot use up its stream's budget
+PEER_RATE, PEER_BURST = 50.0, 200
+
+# Seconds between sweeps for idle (full) buckets
+PRUNE_INTERVAL = 60.0
+
+rate_limited = registry.counter(
+    "publicpooper_rate_limited_total", "Messages rejected by ingress rate limits", ["scope", "endpoint"])
+
+
+class TokenBucket:
+    """Token bucket refilled lazily from the monotonic clock on each check"""
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def allow(self, now: Optional[float] = None, cost: float = 1.0) -> bool:
+        if self.available(now, cost):
+            self.tokens -= cost
+            return True
+        return False
+
+    def available(self, now: Optional[float] = None, cost: float = 1.0) -> bool:
+        """Whether cost tokens could be taken now, without taking them"""
+        self._refill(time.monotonic() if now is None else now)
+        return self.tokens >= cost
+
+    def retry_after(self, now: Optional[float] = None, cost: float = 1.0) -> float:
+        """Seconds until cost tokens are available"""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= cost or self.rate <= 0:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def idle(self, now: float) -> bool:
+        """True once the bucket has refilled, i.e. forgetting it changes nothing"""
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class RateLimiter:
+    """Token buckets for one scope (user, room, stream, ...), one per key
+
+    Checks are a dict lookup and a little arithmetic, so they run before a
+    frame is decoded or the database is touched. Buckets that have refilled
+    are dropped periodically, keeping memory bounded by active keys.
+    """
+
+    def __init__(self, scope: str, rate: float, burst: float):
+        self.scope = scope
+        self.rate = rate
+        self.burst = burst
+        self.buckets: Dict[Hashable, TokenBucket] = {}
+        self.allowed = 0
+        self.rejected = 0
+        self._last_prune = time.monotonic()
+
+    def configure(self, rate: float, burst: float):
+        """Change the limit; existing buckets keep their tokens, capped at the new burst"""
+        self.rate = rate
+        self.burst = burst
+        for bucket in self.buckets.values():
+            bucket.rate = rate
+            bucket.burst = burst
+            bucket.tokens = min(bucket.tokens, burst)
+
+    def new_bucket(self) -> TokenBucket:
+        """Standalone bucket with this limiter's limits, for state owned by one socket
+
+        Configure() does not reach these; they last only as long as the socket.
+        """
+        return TokenBucket(self.rate, self.burst)
+
+    def allow_bucket(self, bucket: TokenBucket, endpoint: str) -> bool:
+        if bucket.allow():
+            self.allowed += 1
+            return True
+        self.reject(endpoint)
+        return False
+
+    def bucket(self, key: Hashable, now: Optional[float] = None) -> TokenBucket:
+        if now is None:
+            now = time.monotonic()
+        if now - self._last_prune >= PRUNE_INTERVAL:
+            self.prune(now)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst, now)
+        return bucket
+
+    def allow(self, key: Hashable, endpoint: str, now: Optional[float] = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+        bucket = self.bucket(key, now)
+        if bucket.allow(now):
+            self.allowed += 1
+            return True
+        self.reject(endpoint)
+        return False
+
+    def reject(self, endpoint: str):
+        self.rejected += 1
+        rate_limited.labels(self.scope, endpoint).inc()
+
+    def retry_after(self, key: Hashable) -> float:
+        bucket = self.buckets.get(key)
+        return bucket.retry_after() if bucket is not None else 0.0
+
+    def prune(self, now: Optional[float] = None):
+        if now is None:
+            now = time.monotonic()
+        self._last_prune = now
+        for key in [key for key, bucket in self.buckets.items() if bucket.idle(now)]:
+            del self.buckets[key]
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "active_keys": len(self.buckets),
+            "allowed": self.allowed,
+            "rejected": self.rejected
+        }
+
+
+user_limiter = RateLimiter("user", USER_RATE, USER_BURST)
+room_limiter = RateLimiter("room", ROOM_RATE, ROOM_BURST)
+stream_limiter = RateLimiter("stream", STREAM_RATE, STREAM_BURST)
+peer_limiter = RateLimiter("peer", PEER_RATE, PEER_BURST)
+
+limiters: Dict[str, RateLimiter] = {limiter.scope: limiter for limiter in
+                                    (user_limiter, room_limiter, stream_limiter, peer_limiter)}
+
+
+def allow_chat(uid: str, rid: str, endpoint: str, charge_room: bool = True) -> Optional[RateLimiter]:
+    """Charge one chat message to its user and room; returns the limiter that refused it, if any
+
+    Both buckets are checked before either is charged, so a refused message
+    costs nothing. With charge_room False only the user's bucket is used
+    (for senders not yet known to exist, who must not drain a real room's).
+    """
+    now = time.monotonic()
+    user_bucket = user_limiter.bucket(uid, now)
+    if not user_bucket.available(now):
+        user_limiter.reject(endpoint)
+        return user_limiter
+    if charge_room:
+        room_bucket = room_limiter.bucket(rid, now)
+        if not room_bucket.available(now):
+            room_limiter.reject(endpoint)
+            return room_limiter
+        room_bucket.tokens -= 1
+        room_limiter.allowed += 1
+    user_bucket.tokens -= 1
+    user_limiter.allowed += 1
+    return None
+
+
+def allow_signaling(peer_bucket: TokenBucket, stream_id: str, endpoint: str) -> Optional[RateLimiter]:
+    """Charge one signaling frame to its socket and stream; returns the limiter that refused it, if any
+
+    As with chat, both are checked before either is charged.
+    """
+    now = time.monotonic()
+    if not peer_bucket.available(now):
+        peer_limiter.reject(endpoint)
+        return peer_limiter
+    stream_bucket = stream_limiter.bucket(stream_id, now)
+    if not stream_bucket.available(now):
+        stream_limiter.reject(endpoint)
+        return stream_limiter
+    peer_bucket.tokens -= 1
+    peer_limiter.allowed += 1
+    stream_bucket.tokens -= 1
+    stream_limiter.allowed += 1
+    return None
+
+
+def stats() -> dict:
+    return {scope: limiter.stats() for scope, limiter in limiters.items()}
+
+
+class RateLimitMiddleware:
+    """ASGI middleware that refuses throttled chat posts with 429
+
+    Runs before routing, so a refused request never has its body read or
+    parsed, and never opens a database connection. known_user(uid) says
+    whether the sender is known to exist without touching the database;
+    unknown senders are charged to their own bucket only, so made-up uids
+    cannot use up a real room's budget (the route then 404s them).
+    """
+
+    # (method, path pattern) -> match groups are (rid, uid)
+    routes: Tuple[Tuple[str, "re.Pattern"], ...] = (
+        ("POST", re.compile(r"^/rooms/([^/]+)/chat/([^/]+)$")),
+    )
+
+    def __init__(self, app, known_user: Optional[Callable[[str], bool]] = None):
+        self.app = app
+        self.known_user = known_user
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for method, pattern in self.routes:
+                if scope["method"] != method:
+                    continue
+                match = pattern.match(scope["path"])
+                if match is None:
+                    continue
+                rid, uid = match.groups()
+                known = self.known_user is None or self.known_user(uid)
+                limiter = allow_chat(uid, rid, "http", charge_room=known)
+                if limiter is not None:
+                    key = uid if limiter is user_limiter else rid
+                    await self._reject(send, limiter, limiter.retry_after(key))
+                    return
+                break
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _reject(send, limiter: RateLimiter, retry_after: float):
+        body = json.dumps({"detail": f"Rate limit exceeded ({limiter.scope})"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
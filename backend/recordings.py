@@ -0,0 +1,375 @@
+"""Recordings of live streams, built from SRS's HLS output
+
+SRS (backend-streaming/srs.conf) remuxes every WebRTC publish to HLS,
+writing {stream}-{seq}.ts segments and a rolling {stream}.m3u8 under its
+hls_path; with hls_window 6 it deletes segments a few fragments later. The
+indexer polls that directory, links each finished segment into
+recordings/{sid}/{seq}.ts before SRS can remove it, and records it in
+RecordingSegment. Consecutive segments of one stream form a session
+(RecordingSession); a sequence reset or a gap of SESSION_GAP seconds starts a
+new one. Streams are keyed by the broadcaster's uid, and each new session is
+linked from LeaderBoard.recording as its playlist URL.
+"""
+import asyncio
+import math
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from starlette.responses import Response
+
+# SRS hls_path, relative to backend/ (SRS runs from backend-streaming/)
+HLS_DIR = os.path.join("..", "backend-streaming", "objs", "nginx", "html", "live")
+RECORDINGS_DIR = "recordings"
+# srs.conf hls_fragment; used when a segment is no longer in the live playlist
+HLS_FRAGMENT = 2.0
+# Seconds between scans of HLS_DIR
+RECORDING_SCAN_INTERVAL = 1.0
+# Seconds without a new segment after which a stream's session ends
+SESSION_GAP = 30.0
+# Bytes read per chunk when the server cannot sendfile
+RANGE_CHUNK_SIZE = 256 * 1024
+
+SEGMENT_MEDIA_TYPE = "video/mp2t"
+PLAYLIST_MEDIA_TYPE = "application/vnd.apple.mpegurl"
+
+# SRS's default hls_ts_file is [app]/[stream]-[seq].ts; in-progress files end in .tmp
+_SEGMENT_PATTERN = re.compile(r"^(?P<stream>.+)-(?P<seq>\d+)\.ts$")
+_PLAYLIST_URL_PATTERN = re.compile(r"^/recordings/(?P<sid>[^/]+)/index\.m3u8$")
+# Session ids are uuid4 strings; anything else never names a directory under RECORDINGS_DIR
+_SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def playlist_url(sid: str) -> str:
+    return f"/recordings/{sid}/index.m3u8"
+
+
+def playlist_sid(url: str) -> Optional[str]:
+    """Session id from a playlist URL (as stored in LeaderBoard.recording)"""
+    match = _PLAYLIST_URL_PATTERN.match(url or "")
+    return match["sid"] if match else None
+
+
+def is_session_id(sid: str) -> bool:
+    return _SESSION_ID_PATTERN.match(sid or "") is not None
+
+
+def segment_path(sid: str, seq: int, base_dir: str = RECORDINGS_DIR) -> str:
+    if not is_session_id(sid) or seq < 0:
+        raise ValueError(f"Invalid recording segment: {sid!r}/{seq}")
+    return os.path.join(base_dir, sid, f"{seq}.ts")
+
+
+def scan_hls_dir(hls_dir: str) -> List[Tuple[str, int, str, float, int]]:
+    """Finished segments under hls_dir as (stream, seq, path, mtime, size)"""
+    found = []
+    for root, _, names in os.walk(hls_dir):
+        for name in names:
+            match = _SEGMENT_PATTERN.match(name)
+            if match is None:
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # Rotated out by SRS since the listing
+            found.append((match["stream"], int(match["seq"]), path, stat.st_mtime, stat.st_size))
+    return found
+
+
+def playlist_durations(path: str) -> Dict[str, float]:
+    """Segment durations from a live playlist: {segment file name: seconds}"""
+    durations: Dict[str, float] = {}
+    try:
+        with open(path) as f:
+            duration = None
+            for line in f:
+                line = line.strip()
+                if line.startswith("#EXTINF:"):
+                    try:
+                        duration = float(line[len("#EXTINF:"):].split(",", 1)[0])
+                    except ValueError:
+                        duration = None
+                elif line and not line.startswith("#"):
+                    if duration is not None:
+                        durations[os.path.basename(line.split("?", 1)[0])] = duration
+                    duration = None
+    except FileNotFoundError:
+        pass
+    return durations
+
+
+def build_playlist(segments: List[sqlite3.Row], ended: bool) -> str:
+    """HLS playlist for a session's segments (VOD once the session ended, EVENT while live)"""
+    target = max((row["duration"] for row in segments), default=HLS_FRAGMENT)
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-PLAYLIST-TYPE:{'VOD' if ended else 'EVENT'}",
+        f"#EXT-X-TARGETDURATION:{max(1, math.ceil(target))}",
+        f"#EXT-X-MEDIA-SEQUENCE:{segments[0]['seq'] if segments else 0}",
+    ]
+    for row in segments:
+        lines.append(f"#EXTINF:{row['duration']:.3f},")
+        lines.append(f"{row['seq']}.ts")
+    if ended:
+        lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def link_or_copy(source: str, destination: str):
+    """Hard-link a segment into the recordings tree (copy across filesystems)"""
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.link(source, destination)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+class RecordingIndexer:
+    """Indexes HLS segments into per-stream recording sessions as SRS writes them
+
+    Each scan runs in a worker thread with its own connection. Segments are
+    identified per stream by (mtime, seq), so restarts and repeated scans of
+    the same files never index a segment twice.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], hls_dir: str = HLS_DIR,
+                 recordings_dir: str = RECORDINGS_DIR, session_gap: float = SESSION_GAP):
+        self.connect = connect
+        self.hls_dir = hls_dir
+        self.recordings_dir = recordings_dir
+        self.session_gap = session_gap
+        # Newest indexed segment per stream: {stream: (mtime, seq)}
+        self.last_indexed: Dict[str, Tuple[float, int]] = {}
+        # Sessions still receiving segments: {stream: {"sid", "seq", "mtime"}}
+        self.open_sessions: Dict[str, dict] = {}
+        self.scans = 0
+        self.segments_indexed = 0
+        self.sessions_started = 0
+        self.sessions_ended = 0
+        self.last_scan_ms = 0.0
+        # Held by the worker thread for a whole scan; cancelling the awaiting
+        # task does not stop the thread, so an asyncio lock alone is not enough
+        self._scan_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def load(self, conn: sqlite3.Connection):
+        """Pick up where the last run stopped"""
+        cursor = conn.cursor()
+        # Last segment of every session
+        cursor.execute(
+            "SELECT s.uid, s.sid, s.endedAt, g.seq, g.mtime FROM RecordingSession s "
+            "JOIN RecordingSegment g ON g.sid = s.sid "
+            "WHERE g.rowid = (SELECT rowid FROM RecordingSegment WHERE sid = s.sid ORDER BY mtime DESC, seq DESC LIMIT 1)"
+        )
+        self.last_indexed = {}
+        self.open_sessions = {}
+        for row in cursor.fetchall():
+            key = (row["mtime"], row["seq"])
+            if row["uid"] not in self.last_indexed or key > self.last_indexed[row["uid"]]:
+                self.last_indexed[row["uid"]] = key
+            if row["endedAt"] is None:
+                self.open_sessions[row["uid"]] = {"sid": row["sid"], "seq": row["seq"], "mtime": row["mtime"]}
+
+    def _end_session(self, cursor: sqlite3.Cursor, stream: str):
+        session = self.open_sessions.pop(stream)
+        cursor.execute("UPDATE RecordingSession SET endedAt = ? WHERE sid = ?", (_iso(session["mtime"]), session["sid"]))
+        self.sessions_ended += 1
+
+    def _start_session(self, cursor: sqlite3.Cursor, stream: str, mtime: float) -> dict:
+        sid = str(uuid.uuid4())
+        cursor.execute("INSERT INTO RecordingSession (sid, uid, startedAt) VALUES (?, ?, ?)", (sid, stream, _iso(mtime)))
+        cursor.execute(
+            "INSERT INTO LeaderBoard (uid, spendTime, recording) VALUES (?, 0, ?) "
+            "ON CONFLICT (uid) DO UPDATE SET recording = excluded.recording",
+            (stream, playlist_url(sid))
+        )
+        self.sessions_started += 1
+        session = self.open_sessions[stream] = {"sid": sid, "seq": -1, "mtime": mtime}
+        return session
+
+    def scan(self, now: Optional[float] = None) -> int:
+        """Index new segments and end idle sessions; returns segments indexed"""
+        with self._scan_lock:
+            return self._scan(now)
+
+    def _scan(self, now: Optional[float]) -> int:
+        started = time.perf_counter()
+        now = time.time() if now is None else now
+        new = [segment for segment in scan_hls_dir(self.hls_dir)
+               if (segment[3], segment[1]) > self.last_indexed.get(segment[0], (-1.0, -1))]
+        new.sort(key=lambda segment: (segment[3], segment[1]))
+        durations: Dict[str, Dict[str, float]] = {}
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            for stream, seq, path, mtime, size in new:
+                session = self.open_sessions.get(stream)
+                if session is not None and (seq <= session["seq"] or mtime - session["mtime"] > self.session_gap):
+                    self._end_session(cursor, stream)
+                    session = None
+                if session is None:
+                    session = self._start_session(cursor, stream, mtime)
+                directory = os.path.dirname(path)
+                if directory not in durations:
+                    durations[directory] = playlist_durations(os.path.join(directory, f"{stream}.m3u8"))
+                duration = durations[directory].get(os.path.basename(path), HLS_FRAGMENT)
+                try:
+                    link_or_copy(path, segment_path(session["sid"], seq, self.recordings_dir))
+                except FileNotFoundError:
+                    continue  # Rotated out before it could be linked
+                cursor.execute(
+                    "INSERT OR IGNORE INTO RecordingSegment (sid, seq, duration, size, mtime) VALUES (?, ?, ?, ?, ?)",
+                    (session["sid"], seq, duration, size, mtime)
+                )
+                if cursor.rowcount:
+                    cursor.execute(
+                        "UPDATE RecordingSession SET segments = segments + 1, duration = duration + ?, bytes = bytes + ? "
+                        "WHERE sid = ?",
+                        (duration, size, session["sid"])
+                    )
+                session["seq"], session["mtime"] = seq, mtime
+                self.last_indexed[stream] = (mtime, seq)
+                self.segments_indexed += 1
+
+            for stream in [stream for stream, session in self.open_sessions.items()
+                           if now - session["mtime"] > self.session_gap]:
+                self._end_session(cursor, stream)
+            conn.commit()
+        finally:
+            conn.close()
+        self.scans += 1
+        self.last_scan_ms = (time.perf_counter() - started) * 1000.0
+        return len(new)
+
+    async def run_once(self) -> int:
+        return await asyncio.to_thread(self.scan)
+
+    async def run(self, interval: float = RECORDING_SCAN_INTERVAL):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"[recordings] Scan of {self.hls_dir} failed: {e}")
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float = RECORDING_SCAN_INTERVAL):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "hls_dir": self.hls_dir,
+            "recordings_dir": self.recordings_dir,
+            "scans": self.scans,
+            "last_scan_ms": round(self.last_scan_ms, 3),
+            "segments_indexed": self.segments_indexed,
+            "sessions_started": self.sessions_started,
+            "sessions_ended": self.sessions_ended,
+            "live_sessions": {stream: session["sid"] for stream, session in self.open_sessions.items()}
+        }
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) inclusive for a single-range Range header, None for the whole file
+
+    Raises ValueError when the range cannot be satisfied. Multi-range
+    requests are answered with the whole file, which RFC 9110 allows.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            length = int(last)
+            if length <= 0:
+                raise ValueError("Empty suffix range")
+            start, end = max(0, size - length), size - 1
+    except ValueError:
+        raise ValueError(f"Invalid range {header!r}")
+    if start >= size or end < start:
+        raise ValueError(f"Range {header!r} not satisfiable for {size} bytes")
+    return start, min(end, size - 1)
+
+
+class RangeFileResponse(Response):
+    """File response honouring a single byte range
+
+    Uses the ASGI zerocopysend extension (os.sendfile in the server) when the
+    server offers it; otherwise the range is read with pread in chunks off the
+    event loop.
+    """
+
+    def __init__(self, path: str, media_type: str, range_header: Optional[str] = None,
+                 headers: Optional[dict] = None):
+        self.path = path
+        self.media_type = media_type
+        self.background = None
+        size = os.stat(path).st_size
+        extra = {"accept-ranges": "bytes", **(headers or {})}
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            self.status_code = 416
+            self.offset, self.count = 0, 0
+            extra["content-range"] = f"bytes */{size}"
+        else:
+            if byte_range is None:
+                self.status_code = 200
+                self.offset, self.count = 0, size
+            else:
+                self.status_code = 206
+                self.offset, self.count = byte_range[0], byte_range[1] - byte_range[0] + 1
+                extra["content-range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+        extra["content-length"] = str(self.count)
+        self.init_headers(extra)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.count == 0 or scope.get("method") == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+            return
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": fd,
+                            "offset": self.offset, "count": self.count})
+                return
+            offset, remaining = self.offset, self.count
+            while remaining > 0:
+                chunk = await asyncio.to_thread(os.pread, fd, min(RANGE_CHUNK_SIZE, remaining), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # File shrank under us; end the response rather than hang the client
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            os.close(fd)
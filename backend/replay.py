@@ -0,0 +1,132 @@
+"""Per-room broadcast sequence numbers and a bounded replay window
+
+Every frame broadcast to a room is stamped with the room's next "seq" and
+kept for a while, so a client reconnecting with resume_from=<last seq seen>
+(and the epoch it was given) receives only the frames it missed instead of
+reloading the room's history. Sequences are in memory: a restarted server
+starts a new epoch, and clients from an older one are told to reload.
+"""
+import time
+import uuid
+from collections import deque
+from typing import Deque, Dict, FrozenSet, List, Optional
+
+# Frames kept per room for replay
+REPLAY_WINDOW = 500
+# Seconds a frame stays replayable
+REPLAY_MAX_AGE = 300.0
+# Seconds between sweeps that drop frames older than REPLAY_MAX_AGE
+REPLAY_PRUNE_INTERVAL = 60.0
+
+
+class ReplayEntry:
+    """One broadcast frame; encoded holds its payload per codec, filled as codecs use it"""
+    __slots__ = ("seq", "sent_at", "message", "exclude", "recipients", "encoded")
+
+    def __init__(self, seq: int, sent_at: float, message: dict, exclude: Optional[str] = None,
+                 recipients: Optional[FrozenSet[str]] = None):
+        self.seq = seq
+        self.sent_at = sent_at
+        self.message = message
+        # User the frame was not sent to (e.g. their own user_joined); not replayed to them either
+        self.exclude = exclude
+        # Users a directed frame (e.g. a chat with a targetUid) went to; None for the whole room
+        self.recipients = recipients
+        self.encoded: Dict[object, object] = {}
+
+    def for_user(self, user_id: str) -> bool:
+        if self.recipients is not None:
+            return user_id in self.recipients
+        return user_id != self.exclude
+
+    def payload(self, codec):
+        payload = self.encoded.get(codec)
+        if payload is None:
+            payload = self.encoded[codec] = codec.encode(self.message)
+        return payload
+
+
+class ReplayBuffer:
+    """Sequence counters and recent frames for every room"""
+
+    def __init__(self, window: int = REPLAY_WINDOW, max_age: float = REPLAY_MAX_AGE):
+        self.window = window
+        self.max_age = max_age
+        # Changes on every restart; sequence numbers only mean something within one epoch
+        self.epoch = uuid.uuid4().hex[:12]
+        # Last seq issued per room. Kept when the room's frames are pruned, so
+        # seq never goes backwards within an epoch; dropped when the room closes.
+        self.seqs: Dict[str, int] = {}
+        # Recent frames per room, oldest first
+        self.rooms: Dict[str, Deque[ReplayEntry]] = {}
+        self.stamped = 0
+        self.resumes = 0
+        self.frames_replayed = 0
+        # Resumes that could not be served from the window (client must reload)
+        self.gaps = 0
+        self._last_prune = time.monotonic()
+
+    def stamp(self, room_id: str, message: dict, exclude: Optional[str] = None,
+              recipients: Optional[FrozenSet[str]] = None) -> ReplayEntry:
+        """Give a frame the room's next seq and retain it; returns the entry to send"""
+        now = time.monotonic()
+        if now - self._last_prune >= REPLAY_PRUNE_INTERVAL:
+            self.prune(now)
+        seq = self.seqs[room_id] = self.seqs.get(room_id, 0) + 1
+        entries = self.rooms.get(room_id)
+        if entries is None:
+            entries = self.rooms[room_id] = deque(maxlen=self.window)
+        entry = ReplayEntry(seq, now, {**message, "seq": seq}, exclude, recipients)
+        entries.append(entry)
+        self.stamped += 1
+        return entry
+
+    def last_seq(self, room_id: str) -> int:
+        return self.seqs.get(room_id, 0)
+
+    def since(self, room_id: str, after: int, epoch: Optional[str] = None) -> Optional[List[ReplayEntry]]:
+        """Frames with seq > after, oldest first; None if some of them are no longer retained"""
+        if epoch is not None and epoch != self.epoch:
+            return None
+        last = self.seqs.get(room_id, 0)
+        if after >= last:
+            # Nothing missed (or a seq from the future, which only an older epoch could have issued)
+            return [] if after == last else None
+        cutoff = time.monotonic() - self.max_age
+        entries = [entry for entry in self.rooms.get(room_id, ()) if entry.seq > after and entry.sent_at >= cutoff]
+        if not entries or entries[0].seq != after + 1:
+            return None
+        return entries
+
+    def drop(self, room_id: str):
+        self.seqs.pop(room_id, None)
+        self.rooms.pop(room_id, None)
+
+    def prune(self, now: Optional[float] = None):
+        """Forget frames past max_age, and the frame logs left empty
+
+        The room's seq counter stays, so its next frame continues the
+        sequence and resuming from a pruned seq is reported as a gap.
+        """
+        if now is None:
+            now = time.monotonic()
+        self._last_prune = now
+        cutoff = now - self.max_age
+        for room_id, entries in list(self.rooms.items()):
+            while entries and entries[0].sent_at < cutoff:
+                entries.popleft()
+            if not entries:
+                del self.rooms[room_id]
+
+    def stats(self) -> dict:
+        return {
+            "epoch": self.epoch,
+            "window": self.window,
+            "max_age": self.max_age,
+            "rooms": len(self.seqs),
+            "retained_frames": sum(len(entries) for entries in self.rooms.values()),
+            "stamped": self.stamped,
+            "resumes": self.resumes,
+            "frames_replayed": self.frames_replayed,
+            "gaps": self.gaps
+        }
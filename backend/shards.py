@@ -0,0 +1,219 @@
+"""Optional per-room sharding of the high-volume tables (Chat, Bet)
+
+With SHARD_COUNT > 0 the Chat and Bet rows live in SHARD_COUNT extra SQLite
+files, each room's rows in the file chosen by a stable hash of its rid.
+Users, Room, Emoji and everything else stay in the primary database. Rooms
+on different shards commit to different files, so their writers no longer
+queue on one database-wide write lock. With SHARD_COUNT = 0 (the default)
+every route resolves to the primary database and nothing changes.
+
+Changing SHARD_COUNT (including turning sharding on or off) moves the
+existing rows to their new files at the next startup (ShardRouter.init).
+"""
+import glob
+import heapq
+import itertools
+import os
+import sqlite3
+import zlib
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+from db import SHARD_MIGRATIONS, apply_migrations, connect
+
+# Number of shard files for Chat and Bet (0 keeps them in the primary database)
+SHARD_COUNT = 0
+# Directory holding the shard files ("" is next to the primary database)
+SHARD_DIR = ""
+
+# (table, columns) of the sharded tables, moved row for row when the layout changes
+SHARDED_TABLES = (
+    ("Chat", "uid, rid, targetUid, comment, createAt"),
+    ("Bet", "uid, rid, bet, createAt"),
+)
+
+
+def shard_index(rid: str, count: int) -> int:
+    """Shard number for a room; crc32 so it is the same in every process"""
+    return zlib.crc32(rid.encode("utf-8")) % count
+
+
+class ShardRouter:
+    """Picks the database file holding a room's Chat and Bet rows
+
+    Data access goes through room() for one room's rows and query_all() for
+    per-user views that span rooms (and so every shard).
+    """
+
+    def __init__(self, primary_path: str, count: int = SHARD_COUNT, shard_dir: str = SHARD_DIR):
+        self.primary_path = primary_path
+        self.count = count
+        self.shard_dir = shard_dir or os.path.dirname(primary_path)
+        self.stem = os.path.splitext(os.path.basename(primary_path))[0]
+
+    @property
+    def enabled(self) -> bool:
+        return self.count > 0
+
+    def shard_path(self, index: int) -> str:
+        return os.path.join(self.shard_dir, f"{self.stem}.shard{index}.db")
+
+    def path_for(self, rid: str) -> str:
+        if not self.enabled:
+            return self.primary_path
+        return self.shard_path(shard_index(rid, self.count))
+
+    def paths(self) -> List[str]:
+        """Every file Chat and Bet rows are stored in"""
+        if not self.enabled:
+            return [self.primary_path]
+        return [self.shard_path(index) for index in range(self.count)]
+
+    def connect(self, rid: str, **kwargs) -> sqlite3.Connection:
+        return connect(self.path_for(rid), **kwargs)
+
+    @contextmanager
+    def room(self, conn: sqlite3.Connection, rid: str) -> Iterator[sqlite3.Connection]:
+        """Connection for rid's Chat/Bet rows: conn itself when unsharded, else its shard (closed afterwards)"""
+        if not self.enabled:
+            yield conn
+            return
+        shard = self.connect(rid, check_same_thread=False)
+        try:
+            yield shard
+        finally:
+            shard.close()
+
+    def connect_all(self, conn: sqlite3.Connection) -> List[sqlite3.Connection]:
+        """Connections to every shard, or [conn] when unsharded; close them with close_all()"""
+        if not self.enabled:
+            return [conn]
+        return [connect(path, check_same_thread=False) for path in self.paths()]
+
+    def close_all(self, conn: sqlite3.Connection, connections: List[sqlite3.Connection]):
+        for shard in connections:
+            if shard is not conn:
+                shard.close()
+
+    def map_all(self, conn: sqlite3.Connection, fetch: Callable[[sqlite3.Connection], list],
+                key: Optional[Callable] = None, reverse: bool = False, limit: Optional[int] = None) -> list:
+        """Call fetch(connection) on every shard and merge the rows it returns
+
+        With key, each shard's rows must already be ordered by it and the
+        result is merged in that order; limit caps the merged rows, so fetch
+        should apply the same limit per shard.
+        """
+        connections = self.connect_all(conn)
+        try:
+            per_shard = [fetch(shard) for shard in connections]
+        finally:
+            self.close_all(conn, connections)
+        if len(per_shard) == 1:
+            rows = per_shard[0]
+        elif key is not None:
+            rows = heapq.merge(*per_shard, key=key, reverse=reverse)
+        else:
+            rows = itertools.chain.from_iterable(per_shard)
+        return list(itertools.islice(rows, limit))
+
+    def query_all(self, conn: sqlite3.Connection, sql: str, params: Sequence = (),
+                  key: Optional[Callable] = None, reverse: bool = False, limit: Optional[int] = None) -> list:
+        """map_all() for one SQL statement (order it by key, and LIMIT it, in the SQL)"""
+        return self.map_all(conn, lambda shard: shard.execute(sql, params).fetchall(), key, reverse, limit)
+
+    def _stored_count(self, conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT shardCount FROM ShardLayout WHERE id = 1").fetchone()
+        return row[0] if row is not None else 0
+
+    def init(self) -> Dict[str, int]:
+        """Create the shard files and move rows left over from a different layout
+
+        Call after the primary database's migrations. Returns rows moved per
+        table; the layout is recorded only once every row is in place, so an
+        interrupted move is finished by the next startup.
+        """
+        for path in self.paths():
+            if path != self.primary_path:
+                conn = connect(path)
+                try:
+                    apply_migrations(conn, SHARD_MIGRATIONS)
+                finally:
+                    conn.close()
+
+        primary = connect(self.primary_path)
+        try:
+            if self._stored_count(primary) == self.count:
+                return {}
+            moved = self.rebalance()
+            primary.execute(
+                "INSERT INTO ShardLayout (id, shardCount) VALUES (1, ?) "
+                "ON CONFLICT (id) DO UPDATE SET shardCount = excluded.shardCount",
+                (self.count,)
+            )
+            primary.commit()
+        finally:
+            primary.close()
+        if any(moved.values()):
+            layout = f"{self.count}-shard" if self.enabled else "unsharded"
+            print(f"[shards] Moved {moved} rows into the {layout} layout")
+        return moved
+
+    def _existing_shard_files(self) -> List[str]:
+        pattern = os.path.join(glob.escape(self.shard_dir), f"{glob.escape(self.stem)}.shard*.db")
+        return sorted(glob.glob(pattern))
+
+    def rebalance(self) -> Dict[str, int]:
+        """Move every Chat/Bet row to the file its rid routes to now
+
+        Rows are copied with INSERT OR IGNORE (both tables are keyed on uid,
+        rid, createAt) and deleted from the source in the same transaction,
+        one room at a time; the chat search triggers follow them in both files.
+        """
+        moved = {table: 0 for table, _ in SHARDED_TABLES}
+        sources = [self.primary_path] + [path for path in self._existing_shard_files()
+                                         if os.path.abspath(path) != os.path.abspath(self.primary_path)]
+        for source in sources:
+            conn = connect(source)
+            try:
+                if source != self.primary_path:
+                    apply_migrations(conn, SHARD_MIGRATIONS)
+                for table, columns in SHARDED_TABLES:
+                    # {target path: [rid, ...]}
+                    targets: Dict[str, List[str]] = {}
+                    for (rid,) in conn.execute(f"SELECT DISTINCT rid FROM {table}").fetchall():
+                        target = self.path_for(rid)
+                        if os.path.abspath(target) != os.path.abspath(source):
+                            targets.setdefault(target, []).append(rid)
+                    for target, rids in targets.items():
+                        if target != self.primary_path:
+                            # Sources can include shards past the new count
+                            shard = connect(target)
+                            try:
+                                apply_migrations(shard, SHARD_MIGRATIONS)
+                            finally:
+                                shard.close()
+                        conn.execute("ATTACH DATABASE ? AS target", (target,))
+                        try:
+                            for rid in rids:
+                                cursor = conn.execute(
+                                    f"INSERT OR IGNORE INTO target.{table} ({columns}) "
+                                    f"SELECT {columns} FROM main.{table} WHERE rid = ?",
+                                    (rid,)
+                                )
+                                moved[table] += cursor.rowcount
+                                conn.execute(f"DELETE FROM main.{table} WHERE rid = ?", (rid,))
+                                conn.commit()
+                        finally:
+                            conn.execute("DETACH DATABASE target")
+            finally:
+                conn.close()
+        return moved
+
+    def stats(self) -> dict:
+        files = []
+        for path in self.paths():
+            files.append({
+                "path": path,
+                "bytes": os.path.getsize(path) if os.path.exists(path) else 0
+            })
+        return {"enabled": self.enabled, "shard_count": self.count, "files": files}
@@ -0,0 +1,93 @@
+import asyncio
+from typing import Dict, List, Tuple, Union
+
+from fastapi import WebSocket
+
+import protocol
+from metrics import registry
+
+# How long candidates for one socket are held so they can share a frame (milliseconds)
+COALESCE_WINDOW_MS = 5.0
+# Flush early once this many messages are waiting for one socket
+MAX_COALESCED = 32
+
+coalesced_frames = registry.counter(
+    "publicpooper_signaling_coalesced_frames_total", "Batched signaling frames sent to coalescing sockets")
+coalesced_messages = registry.counter(
+    "publicpooper_signaling_coalesced_messages_total", "Signaling messages delivered inside batched frames")
+
+
+class CandidateCoalescer:
+    """Batch ICE candidates bound for the same socket into one frame
+
+    Payloads are held already encoded for their target, so a flush only wraps
+    them (codec.batch) instead of decoding and re-encoding each candidate.
+    Sockets must opt in with ?coalesce=1 on /signal/...; anything else sent to
+    a socket flushes its pending candidates first so ordering is preserved.
+    """
+
+    def __init__(self, window_ms: float = COALESCE_WINDOW_MS, max_batch: int = MAX_COALESCED):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.enabled: set = set()
+        # Pending payloads per socket: {websocket: (codec, [payload, ...])}
+        self.pending: Dict[WebSocket, Tuple[object, List[Union[str, bytes]]]] = {}
+        self.timers: Dict[WebSocket, asyncio.TimerHandle] = {}
+
+    def enable(self, websocket: WebSocket):
+        self.enabled.add(websocket)
+
+    def wants(self, websocket: WebSocket) -> bool:
+        return websocket in self.enabled
+
+    async def add(self, websocket: WebSocket, codec, payload: Union[str, bytes]):
+        """Queue a payload (encoded with codec) for websocket"""
+        entry = self.pending.get(websocket)
+        if entry is None:
+            entry = self.pending[websocket] = (codec, [])
+            self.timers[websocket] = asyncio.get_running_loop().call_later(
+                self.window, self._flush_later, websocket)
+        entry[1].append(payload)
+        if len(entry[1]) >= self.max_batch:
+            await self.flush(websocket)
+
+    def _flush_later(self, websocket: WebSocket):
+        asyncio.create_task(self._flush_quietly(websocket))
+
+    async def _flush_quietly(self, websocket: WebSocket):
+        try:
+            await self.flush(websocket)
+        except Exception as e:
+            # The socket's own receive loop notices the disconnect and cleans up
+            print(f"[signaling] Failed to flush coalesced candidates: {e}")
+
+    async def flush(self, websocket: WebSocket):
+        """Send everything pending for websocket now"""
+        timer = self.timers.pop(websocket, None)
+        if timer is not None:
+            timer.cancel()
+        entry = self.pending.pop(websocket, None)
+        if entry is None:
+            return
+        codec, payloads = entry
+        if len(payloads) == 1:
+            await protocol.send(websocket, payloads[0])
+            return
+        coalesced_frames.inc()
+        coalesced_messages.inc(len(payloads))
+        await protocol.send(websocket, codec.batch(payloads))
+
+    def discard(self, websocket: WebSocket):
+        """Forget a closed socket and anything still pending for it"""
+        self.enabled.discard(websocket)
+        timer = self.timers.pop(websocket, None)
+        if timer is not None:
+            timer.cancel()
+        self.pending.pop(websocket, None)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "window_ms": self.window * 1000.0,
+            "coalescing_sockets": len(self.enabled),
+            "pending_sockets": len(self.pending),
+        }
@@ -0,0 +1,139 @@
+"""Startup phases, lazy heavy imports and cache prewarming
+
+A worker answers /health as soon as it serves requests; /ready only once
+the database is migrated, the in-memory aggregates are rebuilt and the
+metadata caches are warm, so a load balancer can hold traffic back from a
+freshly restarted worker until then.
+"""
+import asyncio
+import importlib
+import sqlite3
+import time
+from typing import Callable, Dict, Optional
+
+# Set when this module is first imported, which api.py does before anything heavy
+PROCESS_STARTED = time.perf_counter()
+
+# Rows loaded into the metadata caches before the worker reports ready
+PREWARM_USERS = 5000
+PREWARM_ROOMS = 5000
+PREWARM_EMOJIS = 2000
+# Rows put into a cache between yields to the event loop
+PREWARM_CHUNK_SIZE = 500
+
+
+class LazyModule:
+    """Module imported on first attribute access, e.g. PIL.Image for emoji uploads only"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.import_seconds: Optional[float] = None
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            started = time.perf_counter()
+            self._module = importlib.import_module(self.name)
+            self.import_seconds = time.perf_counter() - started
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attribute: str):
+        return getattr(self.load(), attribute)
+
+
+class LazyTemplates:
+    """Jinja2Templates built on the first page render instead of at import"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._templates = None
+
+    def __getattr__(self, attribute: str):
+        if self._templates is None:
+            from fastapi.templating import Jinja2Templates
+            self._templates = Jinja2Templates(directory=self.directory)
+        return getattr(self._templates, attribute)
+
+
+class StartupTracker:
+    """Startup phase timings and the readiness flag behind /ready
+
+    Phases are seconds since PROCESS_STARTED. prewarm() fills the user,
+    room and emoji caches (queries run in a worker thread); a failure there
+    is logged and the worker still becomes ready, just with cold caches.
+    """
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.prewarmed: Dict[str, int] = {}
+        self.prewarm_error: Optional[str] = None
+        self.ready = False
+        self._task: Optional[asyncio.Task] = None
+
+    def mark(self, phase: str):
+        self.phases[phase] = round(time.perf_counter() - PROCESS_STARTED, 4)
+
+    def _load(self, connect: Callable[[], sqlite3.Connection], sql: str, limit: int) -> list:
+        conn = connect()
+        try:
+            return conn.execute(sql, (limit,)).fetchall()
+        finally:
+            conn.close()
+
+    async def _warm(self, connect: Callable[[], sqlite3.Connection], name: str, sql: str,
+                    limit: int, put: Callable):
+        """Load up to limit rows from sql (which ends in LIMIT ?) into a cache"""
+        rows = await asyncio.to_thread(self._load, connect, sql, limit)
+        for start in range(0, len(rows), PREWARM_CHUNK_SIZE):
+            for row in rows[start:start + PREWARM_CHUNK_SIZE]:
+                put(row)
+            # Let requests in between chunks
+            await asyncio.sleep(0)
+        self.prewarmed[name] = len(rows)
+
+    async def prewarm(self, connect: Callable[[], sqlite3.Connection], metadata):
+        """Fill the metadata caches with the rows the first requests are most likely to need"""
+        try:
+            # Open rooms and the users in them first, then the newest of each
+            await self._warm(connect, "rooms",
+                             "SELECT * FROM Room ORDER BY closedAt IS NOT NULL, createAt DESC LIMIT ?",
+                             min(PREWARM_ROOMS, metadata.rooms.max_size), metadata.put_room)
+            await self._warm(connect, "users",
+                             "SELECT Users.* FROM Users LEFT JOIN "
+                             "(SELECT DISTINCT uid FROM RoomUser WHERE leaveAt IS NULL) AS Active USING (uid) "
+                             "ORDER BY Active.uid IS NULL, Users.createAt DESC LIMIT ?",
+                             min(PREWARM_USERS, metadata.users.max_size), metadata.put_user)
+            await self._warm(connect, "emojis", "SELECT * FROM Emoji ORDER BY createAt DESC LIMIT ?",
+                             min(PREWARM_EMOJIS, metadata.emojis.max_size), metadata.put_emoji)
+        except Exception as e:
+            self.prewarm_error = str(e)
+            print(f"[startup] Cache prewarm failed, serving with cold caches: {e}")
+        self.mark("prewarmed")
+        self.ready = True
+        print(f"[startup] Ready in {self.phases['prewarmed']:.3f}s (prewarmed {self.prewarmed})")
+
+    def start_prewarm(self, connect: Callable[[], sqlite3.Connection], metadata):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.prewarm(connect, metadata))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.ready = False
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "phases": self.phases,
+            "prewarmed": self.prewarmed,
+            "prewarm_error": self.prewarm_error
+        }
@@ -77,7 +77,7 @@ function setupWebRTC(role, streamId, videoElementId = null) {
       return; // Already connected
     }
 
-    ws = new WebSocket(`${ws_protocol}://${location.host}/signal/${streamId}/${role}`);
+    ws = new WebSocket(`${ws_protocol}://${location.host}/signal/${streamId}/${role}?coalesce=1`);
 
     ws.onopen = () => {
       console.log(`[${streamId}] ${role} WebSocket connected`);
@@ -89,80 +89,99 @@ function setupWebRTC(role, streamId, videoElementId = null) {
       }
     };
 
-    ws.onmessage = async ({ data }) => {
-      try {
-        const msg = JSON.parse(data);
-        console.log(`[${streamId}] ${role} received:`, msg.type, msg.viewerId ? `(viewer ${msg.viewerId})` : '');
+    // Handle one signaling message (also used for each entry of a coalesced batch)
+    const handleMessage = async (msg) => {
+      // Answer server heartbeat so idle signaling sockets are not reaped
+      if (msg.type === 'ping') {
+        ws.send(JSON.stringify({ type: 'pong' }));
+        return;
+      }
 
-        if (msg.type === 'offer' && role === 'viewer') {
-          if (pc && pc.signalingState !== 'stable') {
-            console.log(`[${streamId}] Ignoring offer, signaling state: ${pc.signalingState}`);
-            return;
-          }
-          
-          await pc.setRemoteDescription(new RTCSessionDescription(msg));
-          const answer = await pc.createAnswer();
-          await pc.setLocalDescription(answer);
-          
-          ws.send(JSON.stringify({
-            type: 'answer',
-            sdp: answer.sdp,
-            viewerId: msg.viewerId // Echo back the viewer ID
-          }));
+      console.log(`[${streamId}] ${role} received:`, msg.type, msg.viewerId ? `(viewer ${msg.viewerId})` : '');
+
+      if (msg.type === 'offer' && role === 'viewer') {
+        if (pc && pc.signalingState !== 'stable') {
+          console.log(`[${streamId}] Ignoring offer, signaling state: ${pc.signalingState}`);
+          return;
         }
+        
+        await pc.setRemoteDescription(new RTCSessionDescription(msg));
+        const answer = await pc.createAnswer();
+        await pc.setLocalDescription(answer);
+        
+        ws.send(JSON.stringify({
+          type: 'answer',
+          sdp: answer.sdp,
+          viewerId: msg.viewerId // Echo back the viewer ID
+        }));
+      }
 
-        if (msg.type === 'answer' && role === 'broadcaster') {
+      if (msg.type === 'answer' && role === 'broadcaster') {
+        const viewerId = msg.viewerId;
+        const targetPc = peerConnections.get(viewerId);
+        
+        if (targetPc && targetPc.signalingState === 'have-local-offer') {
+          await targetPc.setRemoteDescription(new RTCSessionDescription(msg));
+          console.log(`[${streamId}] Answer processed for viewer ${viewerId}`);
+        } else {
+          console.log(`[${streamId}] Ignoring answer for viewer ${viewerId}, state: ${targetPc?.signalingState}`);
+        }
+      }
+
+      if (msg.type === 'ice-candidate' && msg.candidate) {
+        if (role === 'viewer' && pc) {
+          if (pc.remoteDescription) {
+            await pc.addIceCandidate(new RTCIceCandidate(msg.candidate));
+          } else {
+            console.log(`[${streamId}] Queueing ICE candidate for viewer`);
+          }
+        } else if (role === 'broadcaster') {
           const viewerId = msg.viewerId;
           const targetPc = peerConnections.get(viewerId);
           
-          if (targetPc && targetPc.signalingState === 'have-local-offer') {
-            await targetPc.setRemoteDescription(new RTCSessionDescription(msg));
-            console.log(`[${streamId}] Answer processed for viewer ${viewerId}`);
+          if (targetPc && targetPc.remoteDescription) {
+            await targetPc.addIceCandidate(new RTCIceCandidate(msg.candidate));
           } else {
-            console.log(`[${streamId}] Ignoring answer for viewer ${viewerId}, state: ${targetPc?.signalingState}`);
+            console.log(`[${streamId}] Queueing ICE candidate for viewer ${viewerId}`);
           }
         }
+      }
 
-        if (msg.type === 'ice-candidate' && msg.candidate) {
-          if (role === 'viewer' && pc) {
-            if (pc.remoteDescription) {
-              await pc.addIceCandidate(new RTCIceCandidate(msg.candidate));
-            } else {
-              console.log(`[${streamId}] Queueing ICE candidate for viewer`);
-            }
-          } else if (role === 'broadcaster') {
-            const viewerId = msg.viewerId;
-            const targetPc = peerConnections.get(viewerId);
-            
-            if (targetPc && targetPc.remoteDescription) {
-              await targetPc.addIceCandidate(new RTCIceCandidate(msg.candidate));
-            } else {
-              console.log(`[${streamId}] Queueing ICE candidate for viewer ${viewerId}`);
-            }
-          }
+      // When broadcaster receives viewer-joined, create new peer connection
+      if (msg.type === 'viewer-joined' && role === 'broadcaster') {
+        if (localStream) {
+          const viewerId = ++viewerIdCounter;
+          console.log(`[${streamId}] Creating new connection for viewer ${viewerId}`);
+          
+          const newPc = createPeerConnection(viewerId);
+          localStream.getTracks().forEach(track => newPc.addTrack(track, localStream));
+          peerConnections.set(viewerId, newPc);
+          
+          const offer = await newPc.createOffer();
+          await newPc.setLocalDescription(offer);
+          
+          ws.send(JSON.stringify({
+            type: 'offer',
+            sdp: offer.sdp,
+            viewerId: viewerId
+          }));
+        } else {
+          console.log(`[${streamId}] Cannot create offer - no local stream`);
         }
+      }
+    };
 
-        // When broadcaster receives viewer-joined, create new peer connection
-        if (msg.type === 'viewer-joined' && role === 'broadcaster') {
-          if (localStream) {
-            const viewerId = ++viewerIdCounter;
-            console.log(`[${streamId}] Creating new connection for viewer ${viewerId}`);
-            
-            const newPc = createPeerConnection(viewerId);
-            localStream.getTracks().forEach(track => newPc.addTrack(track, localStream));
-            peerConnections.set(viewerId, newPc);
-            
-            const offer = await newPc.createOffer();
-            await newPc.setLocalDescription(offer);
-            
-            ws.send(JSON.stringify({
-              type: 'offer',
-              sdp: offer.sdp,
-              viewerId: viewerId
-            }));
-          } else {
-            console.log(`[${streamId}] Cannot create offer - no local stream`);
+    ws.onmessage = async ({ data }) => {
+      try {
+        const msg = JSON.parse(data);
+
+        // Coalesced ICE candidates arrive in one frame; handle them in order
+        if (msg.type === 'ice-candidates') {
+          for (const inner of msg.messages) {
+            await handleMessage(inner);
           }
+        } else {
+          await handleMessage(msg);
         }
       } catch (error) {
         console.error(`[${streamId}] Error handling message:`, error);
@@ -269,3 +288,158 @@ function setupWebRTC(role, streamId, videoElementId = null) {
   };
 }
 
+
+// Watch every live stream over one multiplexed signaling socket (/signal/multi).
+// A <video> is added to the container when a stream starts and removed when it stops.
+function watchAllStreams(containerId) {
+  const container = document.getElementById(containerId);
+  const peers = new Map(); // streamId -> RTCPeerConnection
+  let ws;
+  let retryCount = 0;
+  const maxRetries = 5;
+
+  function send(message) {
+    if (ws && ws.readyState === WebSocket.OPEN) {
+      ws.send(JSON.stringify(message));
+    }
+  }
+
+  function videoFor(streamId) {
+    let video = document.getElementById(`video-${streamId}`);
+    if (!video) {
+      const wrapper = document.createElement('div');
+      wrapper.id = `stream-${streamId}`;
+      const title = document.createElement('h3');
+      title.textContent = streamId;
+      video = document.createElement('video');
+      video.id = `video-${streamId}`;
+      video.autoplay = true;
+      video.playsInline = true;
+      video.controls = true;
+      video.width = 320;
+      video.height = 240;
+      wrapper.append(title, video);
+      container.appendChild(wrapper);
+    }
+    return video;
+  }
+
+  function startStream(streamId) {
+    stopStream(streamId, false);
+    const pc = new RTCPeerConnection({
+      iceServers: [
+        { urls: 'stun:stun.l.google.com:19302' },
+        { urls: 'stun:stun1.l.google.com:19302' }
+      ]
+    });
+    pc.onicecandidate = ({ candidate }) => {
+      if (candidate) {
+        send({ type: 'ice-candidate', candidate: candidate, streamId: streamId });
+      }
+    };
+    pc.ontrack = (event) => {
+      if (event.streams[0]) {
+        videoFor(streamId).srcObject = event.streams[0];
+        console.log(`[${streamId}] stream attached to viewer`);
+      }
+    };
+    peers.set(streamId, pc);
+    videoFor(streamId);
+    // Ask the broadcaster for an offer, as a single-stream viewer does on connect
+    send({ type: 'viewer-joined', streamId: streamId });
+  }
+
+  function stopStream(streamId, removeVideo = true) {
+    const pc = peers.get(streamId);
+    if (pc) {
+      pc.close();
+      peers.delete(streamId);
+    }
+    const wrapper = document.getElementById(`stream-${streamId}`);
+    if (removeVideo && wrapper) {
+      wrapper.remove();
+    }
+  }
+
+  const handleMessage = async (msg) => {
+    if (msg.type === 'ping') {
+      send({ type: 'pong' });
+      return;
+    }
+    if (msg.type === 'streams') {
+      msg.streams.forEach(startStream);
+      return;
+    }
+    if (msg.type === 'stream-started') {
+      startStream(msg.streamId);
+      return;
+    }
+    if (msg.type === 'stream-stopped') {
+      stopStream(msg.streamId);
+      return;
+    }
+
+    const pc = peers.get(msg.streamId);
+    if (!pc) return;
+
+    if (msg.type === 'offer') {
+      if (pc.signalingState !== 'stable') {
+        console.log(`[${msg.streamId}] Ignoring offer, signaling state: ${pc.signalingState}`);
+        return;
+      }
+      await pc.setRemoteDescription(new RTCSessionDescription(msg));
+      const answer = await pc.createAnswer();
+      await pc.setLocalDescription(answer);
+      send({ type: 'answer', sdp: answer.sdp, viewerId: msg.viewerId, streamId: msg.streamId });
+    }
+
+    if (msg.type === 'ice-candidate' && msg.candidate && pc.remoteDescription) {
+      await pc.addIceCandidate(new RTCIceCandidate(msg.candidate));
+    }
+  };
+
+  function connect() {
+    ws = new WebSocket(`${ws_protocol}://${location.host}/signal/multi?coalesce=1`);
+
+    ws.onopen = () => {
+      retryCount = 0;
+      send({ type: 'subscribe', all: true });
+    };
+
+    ws.onmessage = async ({ data }) => {
+      try {
+        const msg = JSON.parse(data);
+        // Batched candidates carry streamId on the batch, not on each entry
+        if (msg.type === 'ice-candidates') {
+          for (const inner of msg.messages) {
+            await handleMessage({ ...inner, streamId: msg.streamId });
+          }
+        } else {
+          await handleMessage(msg);
+        }
+      } catch (error) {
+        console.error('[watch-all] Error handling message:', error);
+      }
+    };
+
+    ws.onclose = (event) => {
+      console.log('[watch-all] WebSocket closed:', event.code, event.reason);
+      Array.from(peers.keys()).forEach(streamId => stopStream(streamId, false));
+      if (retryCount < maxRetries) {
+        retryCount++;
+        setTimeout(connect, 1000 * retryCount);
+      }
+    };
+  }
+
+  connect();
+
+  return {
+    close: () => {
+      retryCount = maxRetries;
+      Array.from(peers.keys()).forEach(streamId => stopStream(streamId));
+      if (ws) ws.close();
+    },
+    getStats: () => ({ streams: Array.from(peers.keys()) })
+  };
+}
@@ -459,6 +459,12 @@ export default function RoomPage() {
         case 'error':
           setApiError(data.message);
           break;
+        case 'ping':
+          // Answer server heartbeat so the connection is not reaped
+          if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+            wsRef.current.send(JSON.stringify({ type: 'pong' }));
+          }
+          break;
         default:
           console.log('Unknown message type:', data.type);
       }
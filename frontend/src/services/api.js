@@ -277,6 +277,13 @@ class ApiService {
     return this.apiCall(endpoint);
   }
 
+  // Autocomplete: emojis the user can send whose name starts with prefix
+  async searchEmojis(prefix, uid = null, limit = 10) {
+    const params = new URLSearchParams({ prefix, limit });
+    if (uid) params.append('uid', uid);
+    return this.apiCall(`/emojis/search?${params}`);
+  }
+
   async uploadEmoji(uid, file, name, isPremium = false) {
     const formData = new FormData();
     formData.append('file', file);
@@ -32,6 +32,13 @@ function setupWebRTC(role, streamId, videoElementId = null, onDebugUpdate = null
 
   ws.onmessage = async ({ data }) => {
     const msg = JSON.parse(data);
+
+    // Answer server heartbeat so idle signaling sockets are not reaped
+    if (msg.type === 'ping') {
+      ws.send(JSON.stringify({ type: 'pong' }));
+      return;
+    }
+
     console.log(`[${streamId}] Received message:`, msg);
 
     if (msg.type === 'offer' && role === 'viewer') {